@@ -13,6 +13,9 @@ use App\Models\IoTModel;
 
 class dashboardController extends Action {
 
+    // Endereço do report_generator.py em modo serviço ("python report_generator.py serve")
+    private $reportServiceAddr = 'tcp://127.0.0.1:8765';
+
     // Página principal (Dashboard)
     public function home() {
 
@@ -69,6 +72,7 @@ class dashboardController extends Action {
 
     // Recebe JSON via POST (enviado pelo simulador Python)
     // Responsável por salvar o dado e registrar no histórico
+    // Aceita uma leitura (objeto), um lote (array JSON) ou NDJSON, com gzip opcional
     public function receiveIoT() {
         header("Content-Type: application/json; charset=utf-8");
 
@@ -80,9 +84,40 @@ class dashboardController extends Action {
             return;
         }
 
-        // Decodifica JSON enviado
-        $json = json_decode($raw, true);
-        if ($json === null) {
+        // Lotes comprimidos pelo simulador (--gzip)
+        if (stripos($_SERVER['HTTP_CONTENT_ENCODING'] ?? '', 'gzip') !== false) {
+            $raw = @gzdecode($raw);
+            if ($raw === false) {
+                http_response_code(400);
+                echo json_encode(['status' => 'error', 'message' => 'gzip inválido']);
+                return;
+            }
+        }
+
+        // Decodifica JSON enviado (NDJSON: um objeto por linha)
+        $readings = null;
+        if (stripos($_SERVER['CONTENT_TYPE'] ?? '', 'ndjson') !== false) {
+            $readings = [];
+            foreach (preg_split('/\r?\n/', trim($raw)) as $line) {
+                if ($line === '') continue;
+                $item = json_decode($line, true);
+                if (!is_array($item)) {
+                    $readings = null;
+                    break;
+                }
+                $readings[] = $item;
+            }
+        } else {
+            $json = json_decode($raw, true);
+            if (is_array($json)) {
+                // array_is_list: lote de leituras; senão, uma leitura só
+                $readings = ($json !== [] && array_keys($json) === range(0, count($json) - 1))
+                    ? $json
+                    : [$json];
+            }
+        }
+
+        if ($readings === null || $readings === []) {
             http_response_code(400);
             echo json_encode(['status' => 'error', 'message' => 'JSON inválido']);
             return;
@@ -92,11 +127,11 @@ class dashboardController extends Action {
             // Instancia o model e grava os dados
             $iotModel = Container::getModel('IoTModel');
 
-            $saved = $iotModel->saveLatest($json); // salva último dado
-            $logged = $iotModel->appendLog($json); // adiciona no histórico
+            $saved = $iotModel->saveLatest(end($readings)); // salva último dado
+            $logged = $iotModel->appendLogBatch($readings); // adiciona no histórico (uma escrita por lote)
 
             if ($saved) {
-                echo json_encode(['status' => 'ok']);
+                echo json_encode(['status' => 'ok', 'received' => count($readings)]);
             } else {
                 http_response_code(500);
                 echo json_encode(['status' => 'error', 'message' => 'Falha ao salvar']);
@@ -144,6 +179,27 @@ class dashboardController extends Action {
     public function generateReport() {
         header("Content-Type: application/json; charset=utf-8");
 
+        $raw = file_get_contents("php://input");
+        $this->respondReport('generate_report', $raw ?: "{}");
+    }
+
+    // Gera "insights" ou lições aprendidas via Python
+    public function generateLessons() {
+        header("Content-Type: application/json; charset=utf-8");
+
+        $raw = file_get_contents("php://input");
+        $this->respondReport('generate_lessons', $raw ?: "{}");
+    }
+
+    // Tenta o serviço persistente; se não estiver no ar, executa o script via shell_exec
+    private function respondReport(string $action, string $payload) {
+
+        $decoded = $this->callReportService($action, $payload);
+        if ($decoded !== null) {
+            echo json_encode($decoded, JSON_UNESCAPED_UNICODE);
+            return;
+        }
+
         $pyFile = realpath(__DIR__ . '/../../iot/report_generator.py');
 
         if (!$pyFile || !file_exists($pyFile)) {
@@ -155,12 +211,8 @@ class dashboardController extends Action {
         // Caminho do Python (Windows)
         $pythonCmd = 'C:\\Users\\arthu\\AppData\\Local\\Programs\\Python\\Python313\\python.exe';
 
-        // Pega payload recebido
-        $raw = file_get_contents("php://input");
-        $payload = $raw ?: "{}";
-
         // Comando executado via shell
-        $cmd = '"' . $pythonCmd . '" "' . $pyFile . '" generate_report';
+        $cmd = '"' . $pythonCmd . '" "' . $pyFile . '" ' . $action;
         $full = "echo " . escapeshellarg($payload) . " | " . $cmd . " 2>&1";
 
         // Executa script Python
@@ -184,43 +236,30 @@ class dashboardController extends Action {
         echo json_encode($decoded, JSON_UNESCAPED_UNICODE);
     }
 
-    // Gera "insights" ou lições aprendidas via Python
-    public function generateLessons() {
-        header("Content-Type: application/json; charset=utf-8");
-
-        $pyFile = realpath(__DIR__ . '/../../iot/report_generator.py');
-
-        if (!$pyFile || !file_exists($pyFile)) {
-            http_response_code(500);
-            echo json_encode(["error" => "Script Python não encontrado em: $pyFile"]);
-            return;
-        }
-
-        $pythonCmd = 'C:\\Users\\arthu\\AppData\\Local\\Programs\\Python\\Python313\\python.exe';
-
-        $raw = file_get_contents("php://input");
-        $payload = $raw ?: "{}";
+    // Envia uma linha JSON ao serviço e lê a resposta; retorna null se indisponível
+    private function callReportService(string $action, string $payload): ?array {
+        $sock = @stream_socket_client($this->reportServiceAddr, $errno, $errstr, 0.2);
+        if (!$sock) return null;
 
-        $cmd = '"' . $pythonCmd . '" "' . $pyFile . '" generate_lessons';
-        $full = "echo " . escapeshellarg($payload) . " | " . $cmd . " 2>&1";
+        stream_set_timeout($sock, 10);
 
-        $output = shell_exec($full);
+        // payload vai como string: o serviço aplica o mesmo parse robusto do modo pipe
+        $request = json_encode([
+            'id' => 1,
+            'action' => $action,
+            'payload' => $payload
+        ], JSON_UNESCAPED_UNICODE) . "\n";
 
-        if ($output === null) {
-            http_response_code(500);
-            echo json_encode(["error" => "shell_exec retornou null"]);
-            return;
-        }
+        fwrite($sock, $request);
+        $line = fgets($sock);
+        fclose($sock);
 
-        $decoded = json_decode($output, true);
+        if ($line === false) return null;
 
-        if ($decoded === null) {
-            http_response_code(500);
-            echo json_encode(["error" => "Python retornou saída inválida (não JSON)", "raw" => $output]);
-            return;
-        }
+        $resp = json_decode($line, true);
+        if (!is_array($resp) || empty($resp['ok'])) return null;
 
-        echo json_encode($decoded, JSON_UNESCAPED_UNICODE);
+        return $resp['result'];
     }
 
     // Verifica se o usuário está logado
@@ -72,6 +72,17 @@ class IoTModel extends Model {
     | criando o arquivo se ele não existir.
     */
     public function appendLog(array $payload): bool {
+        return $this->appendLogBatch([$payload]);
+    }
+
+    /*
+    |--------------------------------------------------------------------------
+    | ADICIONA UM LOTE DE REGISTROS AO HISTÓRICO
+    |--------------------------------------------------------------------------
+    | Mesmo formato de appendLog, mas lê e regrava o arquivo uma única vez
+    | para todo o lote enviado pelo simulador (--batch-size).
+    */
+    public function appendLogBatch(array $payloads): bool {
         $log = [];
 
         // Se já existe log, carrega como array
@@ -80,8 +91,10 @@ class IoTModel extends Model {
             if (!is_array($log)) $log = [];
         }
 
-        // Adiciona item no final
-        $log[] = $payload;
+        // Adiciona os itens no final
+        foreach ($payloads as $payload) {
+            $log[] = $payload;
+        }
 
         // Sobrescreve o arquivo com histórico atualizado
         return file_put_contents(
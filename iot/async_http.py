@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# async_http.py
+#
+# Cliente HTTP/1.1 mínimo sobre asyncio, com pool limitado de conexões
+# keep-alive. Usado pelo modo frota do iot_simulator.py: milhares de
+# dispositivos virtuais compartilham poucas conexões TCP reaproveitadas,
+# sem threads e sem dependências externas (nem 'requests' nem 'aiohttp').
+#
+# Suporta apenas o necessário para falar com o endpoint PHP:
+# POST com corpo em bytes, resposta com Content-Length, chunked ou
+# fechamento da conexão.
+
+import ssl
+import asyncio
+from urllib.parse import urlsplit
+
+class HTTPError(Exception):
+    """Resposta com status >= 400 (mantém status e corpo para diagnóstico)."""
+
+    def __init__(self, status, body):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.body = body
+
+class _Connection:
+    __slots__ = ("reader", "writer", "stage")
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # etapa da requisição atual: "envio", "status" (aguardando a linha de
+        # status) ou "resposta" (o servidor já respondeu algo)
+        self.stage = None
+
+    def close(self):
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+class AsyncHTTPPool:
+    """
+    Pool de conexões keep-alive para um único endpoint.
+    - size: número máximo de conexões abertas ao mesmo tempo (as demais
+      requisições aguardam uma conexão livre).
+    - timeout: limite, em segundos, para conectar + enviar + receber a resposta.
+    """
+
+    def __init__(self, endpoint, size=32, timeout=6.0):
+        parts = urlsplit(endpoint)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"esquema não suportado: {parts.scheme!r}")
+
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.host_header = parts.netloc
+        self.timeout = timeout
+
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []
+        self.connections_opened = 0
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        self.connections_opened += 1
+        return _Connection(reader, writer)
+
+    async def post(self, body, content_type="application/json", headers=None):
+        """
+        Envia um POST e devolve (status, corpo_bytes).
+        Levanta HTTPError para status >= 400 (como raise_for_status do requests).
+        """
+        async with self._slots:
+            # Uma conexão ociosa pode ter sido fechada pelo servidor: nesse
+            # caso tenta de novo uma vez, com conexão nova — só se a falha foi
+            # no envio ou antes de chegar a linha de status. Depois disso o
+            # servidor já pode ter gravado as leituras, e reenviar duplicaria.
+            for attempt in (0, 1):
+                reused = bool(self._idle)
+                conn = self._idle.pop() if reused else await self._connect()
+                try:
+                    status, data, keep = await asyncio.wait_for(
+                        self._roundtrip(conn, body, content_type, headers), self.timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    conn.close()
+                    if reused and attempt == 0 and conn.stage != "resposta":
+                        continue
+                    raise ConnectionError(f"conexão perdida: {e}") from e
+                except BaseException:
+                    conn.close()
+                    raise
+
+                if keep:
+                    self._idle.append(conn)
+                else:
+                    conn.close()
+                if status >= 400:
+                    raise HTTPError(status, data)
+                return status, data
+
+    async def _roundtrip(self, conn, body, content_type, headers):
+        lines = [
+            f"POST {self.path} HTTP/1.1",
+            f"Host: {self.host_header}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            "Connection: keep-alive",
+        ]
+        for k, v in (headers or {}).items():
+            lines.append(f"{k}: {v}")
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        conn.stage = "envio"
+        conn.writer.write(head + body)
+        await conn.writer.drain()
+
+        conn.stage = "status"
+        status_line = await conn.reader.readline()
+        if not status_line:
+            raise ConnectionError("servidor fechou a conexão")
+        conn.stage = "resposta"
+        parts = status_line.decode("latin-1").split(" ", 2)
+        status = int(parts[1])
+        version = parts[0]
+
+        resp_headers = {}
+        while True:
+            line = await conn.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            resp_headers[name.strip().lower()] = value.strip()
+
+        conn_hdr = resp_headers.get("connection", "").lower()
+        keep = conn_hdr != "close" and (version == "HTTP/1.1" or conn_hdr == "keep-alive")
+
+        if resp_headers.get("transfer-encoding", "").lower() == "chunked":
+            data = await self._read_chunked(conn.reader)
+        elif "content-length" in resp_headers:
+            data = await conn.reader.readexactly(int(resp_headers["content-length"]))
+        else:
+            data = await conn.reader.read()
+            keep = False
+        return status, data, keep
+
+    @staticmethod
+    async def _read_chunked(reader):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                # trailers até a linha em branco
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)  # CRLF após o chunk
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop().close()
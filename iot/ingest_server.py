@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# ingest_server.py
+#
+# Receptor de ingestão local que substitui o endpoint PHP em máquinas de
+# desenvolvimento. Fala o mesmo contrato que o simulador usa:
+#     POST /index.php/iot/receive   (uma leitura, array JSON ou NDJSON; gzip opcional)
+#     GET  /index.php/iot/data      (último dado, como DashboardController::getIoTData)
+#
+# Diferente de IoTModel::appendLog (que lê, decodifica e regrava o
+# iot_log.json inteiro a cada leitura, custo O(n)), aqui cada leitura vira
+# uma linha acrescentada a um diário (journal) NDJSON segmentado: custo O(1).
+# As escritas de várias requisições simultâneas são agrupadas e confirmadas
+# com um único fsync ("group commit"); a resposta só sai depois do fsync.
+# O snapshot iot_latest.json continua sendo atualizado para o dashboard.
+#
+# Uso:
+#   python ingest_server.py                          -> escuta em 127.0.0.1:8080
+#   python ingest_server.py --port 8090 --no-fsync
+#   python iot_simulator.py --endpoint http://127.0.0.1:8090/index.php/iot/receive
+
+import os
+import sys
+import json
+import gzip
+import time
+import queue
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import iot_stream
+
+RECEIVE_PATH = "/index.php/iot/receive"
+DATA_PATH = "/index.php/iot/data"
+
+DEFAULT_DATA_DIR = os.path.dirname(iot_stream.DEFAULT_LOG_PATH)
+DEFAULT_SEGMENT_MB = 64
+
+# Limite do corpo de uma requisição (lotes grandes do simulador cabem folgados)
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+SEGMENT_PREFIX = "journal-"
+SEGMENT_SUFFIX = ".ndjson"
+
+# -------------------------
+# Diário NDJSON segmentado
+# -------------------------
+
+def journal_segments(journal_dir):
+    """Caminhos dos segmentos do diário, em ordem de escrita."""
+    try:
+        names = os.listdir(journal_dir)
+    except OSError:
+        return []
+    names = sorted(n for n in names if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(journal_dir, n) for n in names]
+
+def iter_journal(journal_dir):
+    """Itera sobre todos os registros do diário (segmento a segmento, em streaming)."""
+    for path in journal_segments(journal_dir):
+        for rec, _ in iot_stream.iter_log_records(path):
+            yield rec
+
+class Journal:
+    """
+    Diário append-only com group commit.
+    - append(readings) bloqueia até as linhas estarem gravadas (e, se fsync
+      estiver ativo, persistidas em disco).
+    - Uma única thread escritora drena a fila: tudo que chegou enquanto o
+      fsync anterior acontecia vai no próximo write + fsync.
+    - Cada segmento é rotacionado ao passar de segment_bytes.
+    """
+
+    def __init__(self, journal_dir, latest_path=None, segment_bytes=DEFAULT_SEGMENT_MB << 20,
+                 fsync=True):
+        self.journal_dir = journal_dir
+        self.latest_path = latest_path
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        os.makedirs(journal_dir, exist_ok=True)
+
+        self.readings = 0
+        self.commits = 0
+        self._queue = queue.Queue()
+        self._file = None
+        self._seq = 0
+        self._open_segment()
+
+        self._writer = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._writer.start()
+
+    def _open_segment(self, rotate=False):
+        segs = journal_segments(self.journal_dir)
+        if segs and not rotate:
+            last = os.path.basename(segs[-1])
+            self._seq = int(last[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+        else:
+            self._seq += 1
+        path = os.path.join(self.journal_dir, f"{SEGMENT_PREFIX}{self._seq:06d}{SEGMENT_SUFFIX}")
+        new = open(path, "ab")      # se falhar, o segmento atual continua aberto
+        if self._file is not None:
+            self._file.close()
+        self._file = new
+        self.segment_path = path
+
+    def append(self, readings):
+        """Enfileira as leituras e espera o commit do grupo. Retorna quando persistidas."""
+        lines = b"".join(
+            json.dumps(r, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+            for r in readings
+        )
+        done = threading.Event()
+        item = [lines, readings[-1], len(readings), done, None]
+        self._queue.put(item)
+        done.wait()
+        if item[4] is not None:
+            raise item[4]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            if batch[0] is None:
+                return
+            # Tudo o que já estiver na fila entra no mesmo commit
+            while True:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.put(None)  # encerra depois deste grupo
+                    break
+                batch.append(nxt)
+
+            error = None
+            try:
+                self._file.write(b"".join(item[0] for item in batch))
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+                self.commits += 1
+                self.readings += sum(item[2] for item in batch)
+            except Exception as e:
+                error = e
+
+            # A resposta depende só da gravação no diário: um erro daqui em
+            # diante não pode virar 500, senão o cliente reenvia leituras já
+            # gravadas. Snapshot e rotação só registram o erro.
+            for item in batch:
+                item[4] = error
+                item[3].set()
+            if error is not None:
+                continue
+
+            if self.latest_path:
+                try:
+                    self._write_latest(batch[-1][1])
+                except Exception as e:
+                    print(f"[ingest] falha ao gravar {self.latest_path}: {e}", file=sys.stderr, flush=True)
+            if self._file.tell() >= self.segment_bytes:
+                try:
+                    self._open_segment(rotate=True)
+                except Exception as e:
+                    self._seq -= 1  # tenta o mesmo número na próxima rotação
+                    print(f"[ingest] falha ao rotacionar o diário: {e}", file=sys.stderr, flush=True)
+
+    def _write_latest(self, reading):
+        """Mesmo conteúdo que IoTModel::saveLatest: última leitura + received_at."""
+        if not isinstance(reading, dict):
+            return
+        snap = dict(reading)
+        snap["received_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        tmp = self.latest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snap, f, indent=4)
+        os.replace(tmp, self.latest_path)
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+# -------------------------
+# Decodificação do corpo (mesmas regras do receiveIoT em PHP)
+# -------------------------
+
+def decode_body(raw, content_type="", content_encoding=""):
+    """
+    Converte o corpo da requisição em lista de leituras.
+    Levanta ValueError com a mesma mensagem que o PHP devolveria.
+    """
+    if not raw:
+        raise ValueError("Request vazio")
+    if "gzip" in (content_encoding or "").lower():
+        try:
+            raw = gzip.decompress(raw)
+        except (OSError, EOFError):
+            raise ValueError("gzip inválido")
+
+    try:
+        text = raw.decode("utf-8")
+        if "ndjson" in (content_type or "").lower():
+            readings = [json.loads(line) for line in text.splitlines() if line.strip()]
+            if not all(isinstance(r, dict) for r in readings):
+                raise ValueError
+        else:
+            data = json.loads(text)
+            if isinstance(data, list):
+                readings = data
+            elif isinstance(data, dict):
+                readings = [data]
+            else:
+                raise ValueError
+    except ValueError:
+        raise ValueError("JSON inválido")
+
+    if not readings:
+        raise ValueError("JSON inválido")
+    return readings
+
+# -------------------------
+# Servidor HTTP
+# -------------------------
+
+class _IngestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive para o pool do simulador
+    server_version = "smartHospital-ingest/1"
+
+    def _reply(self, status, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0] != RECEIVE_PATH:
+            self._reply(404, {"status": "error", "message": "Rota não encontrada"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            # sem um tamanho válido não dá para saber onde o corpo termina
+            self._reply(400, {"status": "error", "message": "Content-Length inválido"})
+            self.close_connection = True
+            return
+        if length > MAX_BODY_BYTES:
+            self._reply(413, {"status": "error", "message": "Request muito grande"})
+            self.close_connection = True
+            return
+        raw = self.rfile.read(length) if length else b""
+
+        try:
+            readings = decode_body(raw, self.headers.get("Content-Type", ""),
+                                   self.headers.get("Content-Encoding", ""))
+        except ValueError as e:
+            self._reply(400, {"status": "error", "message": str(e)})
+            return
+
+        try:
+            self.server.journal.append(readings)
+        except Exception as e:
+            self._reply(500, {"status": "error", "message": f"Exception: {e}"})
+            return
+        self._reply(200, {"status": "ok", "received": len(readings)})
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != DATA_PATH:
+            self._reply(404, {"status": "error", "message": "Rota não encontrada"})
+            return
+        try:
+            with open(self.server.journal.latest_path, "r", encoding="utf-8") as f:
+                self._reply(200, json.load(f))
+        except (OSError, TypeError):
+            self._reply(404, {"status": "error", "message": "Sem dados ainda"})
+        except ValueError:
+            self._reply(500, {"status": "error", "message": "JSON inválido no arquivo"})
+
+    def log_message(self, fmt, *args):
+        # um log por requisição é caro demais sob carga; o resumo periódico basta
+        pass
+
+class IngestServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address, journal):
+        super().__init__(address, _IngestHandler)
+        self.journal = journal
+
+def _report_loop(journal, every):
+    last_r, last_c, last_t = 0, 0, time.monotonic()
+    while True:
+        time.sleep(every)
+        now = time.monotonic()
+        r, c = journal.readings, journal.commits
+        if r != last_r:
+            rate = (r - last_r) / (now - last_t)
+            group = (r - last_r) / (c - last_c) if c != last_c else 0.0
+            print(f"[ingest] leituras {r} ({rate:.1f}/s) | commits {c} "
+                  f"({group:.1f} leituras/commit) | segmento {os.path.basename(journal.segment_path)}",
+                  file=sys.stderr, flush=True)
+        last_r, last_c, last_t = r, c, now
+
+def main():
+    parser = argparse.ArgumentParser(description="Receptor local de ingestão IoT (diário NDJSON)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="porta (padrão 8080, a do simulador)")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR,
+                        help="pasta de iot_latest.json e do diário (padrão public/iot)")
+    parser.add_argument("--segment-mb", type=float, default=DEFAULT_SEGMENT_MB,
+                        help="tamanho de rotação dos segmentos em MB (padrão 64)")
+    parser.add_argument("--no-fsync", action="store_true",
+                        help="não chama fsync a cada commit (mais rápido, menos durável)")
+    parser.add_argument("--summary-every", type=float, default=5.0,
+                        help="segundos entre linhas de resumo")
+    args = parser.parse_args()
+
+    journal = Journal(
+        os.path.join(args.data_dir, "journal"),
+        latest_path=os.path.join(args.data_dir, "iot_latest.json"),
+        segment_bytes=int(args.segment_mb * (1 << 20)),
+        fsync=not args.no_fsync,
+    )
+    server = IngestServer((args.host, args.port), journal)
+    threading.Thread(target=_report_loop, args=(journal, args.summary_every), daemon=True).start()
+
+    print(f"[ingest] ouvindo em http://{args.host}:{server.server_address[1]}{RECEIVE_PATH} "
+          f"-> {journal.journal_dir}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        journal.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+# iot_aggregates.py
+#
+# Cache incremental de agregados do histórico IoT, persistido ao lado do log
+# (iot_log.json -> iot_log.json.agg/).
+#
+# Guarda, por dia (UTC) e por device_id, soma/contagem/mínimo/máximo de cada
+# métrica, além de um checkpoint (offset em bytes + impressões digitais do
+# arquivo). A cada relatório só os registros acrescentados desde a última
+# execução são lidos; se o log for truncado ou reescrito, o cache é refeito.
+# O estado fica particionado por dia (um arquivo por dia, carregado sob
+# demanda), então consultar um dia lê só aquele arquivo e uma atualização
+# regrava só os dias que mudaram, por maior que seja o histórico.
+# refresh_together() atualiza vários desses caches (e os rollups) numa única
+# leitura do log.
+#
+# Uso:
+#   python iot_aggregates.py                      -> atualiza e mostra o resumo
+#   python iot_aggregates.py --periodo 2025-11-20
+#   python iot_aggregates.py --rebuild
+#   python iot_aggregates.py --periodo 2025-11 --percentis   -> p50/p95/p99 (SketchCache)
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import iot_stream
+from quantile_sketch import KLLSketch
+
+CACHE_VERSION = 2
+
+# Partições diárias mantidas em memória por cache (as menos usadas e sem
+# alterações são liberadas)
+MAX_LOADED_DAYS = 40
+
+# Bytes usados nas impressões digitais do início do arquivo e do trecho antes do checkpoint
+_FINGERPRINT_BYTES = 256
+
+# -------------------------
+# Estatística de uma métrica
+# -------------------------
+
+class MetricStats:
+    """Soma, contagem, mínimo e máximo de uma métrica (combináveis via merge)."""
+
+    __slots__ = ("sum", "count", "min", "max")
+
+    def __init__(self, total=0.0, count=0, vmin=None, vmax=None):
+        self.sum = total
+        self.count = count
+        self.min = vmin
+        self.max = vmax
+
+    def add(self, v):
+        self.sum += v
+        self.count += 1
+        if self.min is None or v < self.min:
+            self.min = v
+        if self.max is None or v > self.max:
+            self.max = v
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        self.sum += other.sum
+        self.count += other.count
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def to_list(self):
+        return [self.sum, self.count, self.min, self.max]
+
+    @classmethod
+    def from_list(cls, data):
+        return cls(data[0], data[1], data[2], data[3])
+
+# -------------------------
+# Cache persistido
+# -------------------------
+
+def default_cache_path(log_path):
+    return log_path + AggregateCache.SUFFIX
+
+def _day_key(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d")
+
+def _day_start(key):
+    return datetime.strptime(key, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+
+def _digest(f, start, length):
+    f.seek(start)
+    return hashlib.sha1(f.read(length)).hexdigest()
+
+# Um lock por caminho: no modo serve (threads) dois caches podem salvar o mesmo arquivo
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+def _write_lock(path):
+    with _write_locks_guard:
+        lock = _write_locks.get(path)
+        if lock is None:
+            lock = _write_locks[path] = threading.Lock()
+        return lock
+
+def write_json_atomic(path, state):
+    """
+    Grava JSON via arquivo temporário + os.replace: outro processo ou thread
+    nunca lê um estado pela metade. O temporário é único por processo e
+    thread, e gravações no mesmo caminho são serializadas. Se o diretório não
+    aceitar escrita, o estado vale só para esta execução (retorna False).
+    """
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with _write_lock(path):
+        try:
+            # json.dumps usa o codificador em C; json.dump em arquivo cai no de Python puro
+            data = json.dumps(state, separators=(",", ":"))
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            return True
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return False
+
+class LogCheckpoint:
+    """
+    Posição já processada do log (offset em bytes) + impressões digitais do
+    início do arquivo e do trecho imediatamente anterior ao offset. Como o
+    log só cresce, esses bytes nunca mudam; se mudarem (ou o arquivo
+    encolher), o log foi reescrito e quem depende do checkpoint reconstrói.
+    """
+
+    __slots__ = ("offset", "head", "tail")
+
+    def __init__(self, offset=0, head=None, tail=None):
+        self.offset = offset
+        self.head = head
+        self.tail = tail
+
+    def is_valid(self, log_path):
+        """O log ainda contém, intactos, os bytes já processados?"""
+        if self.offset == 0:
+            return True
+        try:
+            with open(log_path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < self.offset:
+                    return False  # truncado
+                if _digest(f, 0, min(_FINGERPRINT_BYTES, self.offset)) != self.head:
+                    return False  # reescrito desde o início
+                start = max(0, self.offset - _FINGERPRINT_BYTES)
+                return _digest(f, start, self.offset - start) == self.tail
+        except OSError:
+            return False
+
+    def advance(self, log_path, offset):
+        """Move o checkpoint para 'offset' e recalcula as impressões digitais."""
+        with open(log_path, "rb") as f:
+            self.head = _digest(f, 0, min(_FINGERPRINT_BYTES, offset))
+            start = max(0, offset - _FINGERPRINT_BYTES)
+            self.tail = _digest(f, start, offset - start)
+        self.offset = offset
+
+    def to_dict(self):
+        return {"offset": self.offset, "head": self.head, "tail": self.tail}
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(data.get("offset", 0), data.get("head"), data.get("tail"))
+
+class AggregateCache:
+    """
+    Estado agregado do log com checkpoint, particionado por dia (UTC).
+    - refresh(): incorpora apenas os registros novos (ou reconstrói se necessário).
+    - query(inicio, fim, device_id): combina os dias inteiros do intervalo.
+    - iter_days(inicio, fim): (dia, {device_id: entrada}) carregando só esses dias.
+
+    Em disco (log + SUFFIX, um diretório), como os rollups (iot_rollups):
+    state.json (checkpoint, geração e índice dos dias) e um arquivo por dia,
+    <dia>.g<geração>.json. save() grava os dias alterados com uma geração
+    nova e só então o state.json; os arquivos substituídos são apagados
+    depois. shared_cache() mantém uma instância por processo (modo serviço).
+
+    Subclasses trocam o que é guardado por dia/dispositivo/métrica via STAT
+    (precisa de add, merge, to_list e from_list), METRICS e o diretório; quem
+    guarda outra coisa por dia/dispositivo sobrescreve add, _load_entry,
+    _dump_entry e query.
+    """
+
+    VERSION = CACHE_VERSION
+    STAT = MetricStats
+    METRICS = None          # None = todas as métricas de iot_stream.METRICS
+    SUFFIX = ".agg"
+
+    def __init__(self, log_path=iot_stream.DEFAULT_LOG_PATH, cache_path=None):
+        self.log_path = log_path
+        self.cache_path = cache_path or log_path + self.SUFFIX
+        self.lock = threading.Lock()
+        self.generation = 0
+        self._garbage = set()
+        self._files = {}
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.checkpoint = LogCheckpoint()
+        self.records = 0
+        self.skipped = 0
+        # o que já está em disco passa a ser lixo da próxima gravação
+        self._garbage.update(e[0] for e in self._files.values())
+        self._files = {}                # dia -> [arquivo, dispositivos]
+        self._parts = OrderedDict()     # dia -> {device_id: entrada} (LRU)
+        self._dirty = set()
+        self._hot = (None, None)        # (dia em epoch, tabela) da última leitura
+
+    # ---- partições ----
+
+    def _day(self, key, create=True):
+        table = self._parts.get(key)
+        if table is not None:
+            self._parts.move_to_end(key)
+            return table
+        entry = self._files.get(key)
+        if entry is None:
+            if not create:
+                return None
+            table = {}
+        else:
+            with open(os.path.join(self.cache_path, entry[0]), "r", encoding="utf-8") as f:
+                table = {dev: self._load_entry(data) for dev, data in json.load(f).items()}
+        self._parts[key] = table
+        self._evict()
+        return table
+
+    def _evict(self):
+        """Libera os dias menos usados que não têm alterações pendentes."""
+        excess = len(self._parts) - MAX_LOADED_DAYS
+        if excess <= 0:
+            return
+        for key in [k for k in self._parts if k not in self._dirty][:excess]:
+            del self._parts[key]
+        self._hot = (None, None)
+
+    def _table(self, key):
+        """Tabela do dia 'key' para escrita (marcada como alterada)."""
+        self._dirty.add(key)
+        return self._day(key)
+
+    def _table_for(self, ts):
+        """_table() do dia de 'ts', com atalho para o mesmo dia da leitura anterior."""
+        day = int(ts // 86400)
+        if self._hot[0] == day:
+            return self._hot[1]
+        table = self._table(_day_key(ts))
+        self._hot = (day, table)
+        return table
+
+    def iter_days(self, start=None, end=None):
+        """(dia, {device_id: entrada}) dos dias que começam em [start, end), em ordem."""
+        for key in sorted(set(self._files) | set(self._parts)):
+            t = _day_start(key)
+            if (start is not None and t < start) or (end is not None and t >= end):
+                continue
+            table = self._day(key, create=False)
+            if table:
+                yield key, table
+
+    # ---- persistência ----
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.cache_path, "state.json"), "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(state, dict) or state.get("version") != self.VERSION:
+            return
+
+        self.checkpoint = LogCheckpoint.from_dict(state.get("checkpoint"))
+        self.records = state.get("records", 0)
+        self.skipped = state.get("skipped", 0)
+        self.generation = state.get("geracao", 0)
+        self._files = {k: list(v) for k, v in state.get("dias", {}).items()}
+
+    def _load_entry(self, data):
+        return {m: self.STAT.from_list(v) for m, v in data.items()}
+
+    def _dump_entry(self, metrics):
+        return {m: s.to_list() for m, s in metrics.items()}
+
+    def save(self):
+        self.generation += 1
+        os.makedirs(self.cache_path, exist_ok=True)
+        failed = set()
+        for key in sorted(self._dirty):
+            table = self._parts[key]
+            old = self._files.get(key)
+            if not table:
+                if old is not None:
+                    self._garbage.add(old[0])
+                self._files.pop(key, None)
+                continue
+            name = f"{key}.g{self.generation}.json"
+            data = {dev: self._dump_entry(entry) for dev, entry in table.items()}
+            if not write_json_atomic(os.path.join(self.cache_path, name), data):
+                failed.add(key)     # diretório sem escrita: o dia segue só em memória
+                continue
+            if old is not None:
+                self._garbage.add(old[0])
+            self._files[key] = [name, len(table)]
+
+        state = {
+            "version": self.VERSION,
+            "log": os.path.basename(self.log_path),
+            "checkpoint": self.checkpoint.to_dict(),
+            "records": self.records,
+            "skipped": self.skipped,
+            "geracao": self.generation,
+            "dias": dict(sorted(self._files.items())),
+        }
+        write_json_atomic(os.path.join(self.cache_path, "state.json"), state)
+        self._dirty = failed
+        self._hot = (None, None)
+        self._evict()
+
+        # só depois do state.json novo: arquivos substituídos e o formato antigo (um JSON único)
+        live = {e[0] for e in self._files.values()}
+        for name in self._garbage - live:
+            try:
+                os.remove(os.path.join(self.cache_path, name))
+            except OSError:
+                pass
+        self._garbage.clear()
+        try:
+            os.remove(self.cache_path + ".json")
+        except OSError:
+            pass
+
+    def is_stale(self):
+        """Outro processo gravou um state.json mais novo que o carregado?"""
+        try:
+            with open(os.path.join(self.cache_path, "state.json"), "r", encoding="utf-8") as f:
+                return json.load(f).get("geracao", 0) != self.generation
+        except (OSError, ValueError, AttributeError):
+            return False
+
+    # ---- atualização incremental ----
+
+    @property
+    def offset(self):
+        return self.checkpoint.offset
+
+    def refresh(self, save=True):
+        """
+        Lê somente o que foi acrescentado ao log desde o último checkpoint
+        (refresh_together com um cache só). Retorna o número de registros
+        novos incorporados.
+        """
+        return refresh_together(self.log_path, [self], save)[0]
+
+    def needs_flush(self):
+        """Dias alterados demais em memória: hora de um checkpoint intermediário."""
+        return len(self._dirty) > MAX_LOADED_DAYS
+
+    def advance(self, offset, added, skipped, save=True):
+        """Conta os registros lidos até 'offset', move o checkpoint e grava."""
+        self.records += added
+        self.skipped += skipped
+        self.checkpoint.advance(self.log_path, offset)
+        if save:
+            self.save()
+
+    def add(self, ts, device_id, values):
+        """Incorpora uma leitura válida ('values' de iot_stream.reading_values)."""
+        table = self._table_for(ts)
+        metrics = table.get(device_id)
+        if metrics is None:
+            metrics = table[device_id] = {}
+        for m, v in values.items():
+            if v is None or (self.METRICS is not None and m not in self.METRICS):
+                continue
+            st = metrics.get(m)
+            if st is None:
+                st = metrics[m] = self.STAT()
+            st.add(v)
+
+    # ---- consulta ----
+
+    def covers(self, start, end):
+        """True se [start, end) cai em limites de dia (o cache responde exatamente)."""
+        def aligned(t):
+            return t is None or t % 86400 == 0
+        return aligned(start) and aligned(end)
+
+    def query(self, start=None, end=None, device_id=None):
+        """Combina os agregados dos dias em [start, end) -> {metrica: STAT}."""
+        out = {}
+        for _, devices in self.iter_days(start, end):
+            for dev, metrics in devices.items():
+                if device_id is not None and dev != device_id:
+                    continue
+                for m, st in metrics.items():
+                    out.setdefault(m, self.STAT()).merge(st)
+        return out
+
+class SketchCache(AggregateCache):
+    """
+    Mesmo cache incremental, com um sketch de quantis KLL por dia, device_id e
+    métrica no lugar de soma/mínimo/máximo (iot_log.json -> .sketch/).
+    Os sketches de vários dias/dispositivos se combinam na consulta, então
+    p95/p99 de um mês não exigem guardar cada leitura. A energia acumulada
+    (energy_total) fica de fora: percentis de um contador não dizem nada.
+    """
+
+    VERSION = 2
+    STAT = KLLSketch
+    METRICS = ("temperature", "humidity", "oxygen", "co2", "energy_instant", "energy_peak")
+    SUFFIX = ".sketch"
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def shared_cache(cls=AggregateCache, log_path=None):
+    """
+    Instância de 'cls' (AggregateCache ou subclasse) do log reaproveitada entre
+    chamadas no mesmo processo (modo serviço do report_generator): o índice e
+    os dias já lidos ficam em memória. Recarrega se outro processo gravou um
+    estado mais novo. Use 'with cache.lock:' em volta de refresh() + consultas.
+    """
+    path = log_path or iot_stream.DEFAULT_LOG_PATH
+    with _shared_lock:
+        cache = _shared.get((cls, path))
+        if cache is None or cache.is_stale():
+            cache = _shared[(cls, path)] = cls(path)
+        return cache
+
+# -------------------------
+# Leitura única para vários caches
+# -------------------------
+
+def refresh_together(log_path, caches, save=True):
+    """
+    Atualiza vários caches incrementais do mesmo log numa só leitura: cada
+    registro novo é interpretado uma vez e entregue a todos os caches cujo
+    checkpoint ainda não o inclui, em vez de cada cache reler o log inteiro.
+    - Cada cache (AggregateCache e subclasses, iot_rollups.RollupEngine)
+      precisa de checkpoint, _reset(), add(ts, device_id, valores),
+      needs_flush() e advance(offset, novos, ignorados, save).
+    - Um cache com o log truncado/reescrito é refeito; quando needs_flush()
+      pede, ele grava um checkpoint intermediário (memória limitada).
+    - Retorna a lista de registros novos incorporados por cache.
+    """
+    added = [0] * len(caches)
+    if not os.path.exists(log_path):
+        return added
+    for cache in caches:
+        if not cache.checkpoint.is_valid(log_path):
+            cache._reset()
+
+    begins = [cache.checkpoint.offset for cache in caches]
+    new = [0] * len(caches)         # desde o último advance de cada cache
+    bad = [0] * len(caches)
+    offset = min(begins, default=0)
+    for rec, end in iot_stream.iter_log_records(log_path, offset=offset):
+        offset = end
+        ts = iot_stream.parse_timestamp(rec.get("timestamp")) if isinstance(rec, dict) else None
+        values = iot_stream.reading_values(rec) if ts is not None else None
+        valid = values is not None and any(v is not None for v in values.values())
+        device_id = (rec.get("device_id") or "desconhecido") if valid else None
+        for i, cache in enumerate(caches):
+            if end <= begins[i]:
+                continue    # este cache já incorporou o registro
+            if not valid:
+                bad[i] += 1
+                continue
+            cache.add(ts, device_id, values)
+            added[i] += 1
+            new[i] += 1
+            if save and cache.needs_flush():
+                cache.advance(end, new[i], bad[i])
+                new[i] = bad[i] = 0
+
+    for i, cache in enumerate(caches):
+        if offset > cache.checkpoint.offset:
+            cache.advance(offset, new[i], bad[i], save)
+    return added
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache incremental de agregados do iot_log.json")
+    parser.add_argument("--log", default=iot_stream.DEFAULT_LOG_PATH, help="caminho do iot_log.json")
+    parser.add_argument("--periodo", default=None, help="período a resumir (ex.: 2025-11-20)")
+    parser.add_argument("--device", default=None, help="filtra por device_id")
+    parser.add_argument("--rebuild", action="store_true", help="descarta o cache e reprocessa o log")
+    parser.add_argument("--percentis", action="store_true",
+                        help="mostra p50/p95/p99 (sketches KLL) em vez de média/mín/máx")
+    args = parser.parse_args()
+
+    cache = (SketchCache if args.percentis else AggregateCache)(args.log)
+    if args.rebuild:
+        cache._reset()
+    added = cache.refresh()
+
+    rng = iot_stream.parse_periodo(args.periodo) if args.periodo else None
+    start, end = rng if rng else (None, None)
+    stats = cache.query(start, end, args.device)
+
+    out = {
+        "novos_registros": added,
+        "registros": cache.records,
+        "ignorados": cache.skipped,
+        "offset": cache.offset,
+        "metricas": {
+            m: st.summary() if args.percentis else
+               {"media": st.mean, "min": st.min, "max": st.max, "n": st.count}
+            for m, st in sorted(stats.items())
+        },
+    }
+    json.dump(out, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# iot_alerts.py
+#
+# Motor de alertas em streaming sobre as leituras IoT, com suavização e
+# debounce (o "implementar debounce e smoothing" das lições aprendidas).
+#
+# Para cada dispositivo e métrica o estado é fixo (O(1) de memória):
+#   - EWMA rápida (alpha) -> valor suavizado comparado com os limites;
+#   - média/variância exponenciais lentas (beta) -> z-score "móvel" do valor
+#     bruto em relação ao comportamento recente do próprio sensor;
+#   - histerese: dispara acima de 'trigger' e só normaliza abaixo de 'clear';
+#   - debounce: a mudança de estado exige N amostras seguidas.
+# Os limites seguem o dashboard (public/assets/js/iot.js): temperatura > 26 °C,
+# O₂ < 90 %, CO₂ > 1000 ppm; e energia de pico > 3,5 kW.
+#
+# Entradas (NDJSON, uma leitura por linha; arrays JSON também são aceitos):
+#   python iot_alerts.py < leituras.ndjson
+#   python iot_alerts.py --journal ../public/iot/journal      -> segue o diário do ingest_server
+#   python iot_alerts.py --listen 127.0.0.1:8770              -> NDJSON via TCP
+#   python iot_alerts.py --bench 500000                       -> mede a vazão
+# Saída: um evento JSON por linha em stdout; resumo periódico em stderr.
+
+import io
+import os
+import sys
+import json
+import time
+import math
+import random
+import argparse
+import threading
+import socketserver
+
+from latency_histogram import LatencyHistogram
+
+# -------------------------
+# Regras
+# -------------------------
+
+class Rule:
+    """
+    Limite com histerese para uma métrica.
+    - direction "above": alerta quando o suavizado passa de trigger; normaliza abaixo de clear.
+    - direction "below": alerta quando fica abaixo de trigger; normaliza acima de clear.
+    """
+
+    __slots__ = ("metric", "field", "sub", "direction", "trigger", "clear")
+
+    def __init__(self, metric, field, direction, trigger, clear, sub=None):
+        if direction not in ("above", "below"):
+            raise ValueError(f"direção inválida: {direction!r}")
+        if (direction == "above" and clear > trigger) or (direction == "below" and clear < trigger):
+            raise ValueError(f"{metric}: o limite de normalização deve ficar aquém do de disparo")
+        self.metric = metric
+        self.field = field
+        self.sub = sub
+        self.direction = direction
+        self.trigger = trigger
+        self.clear = clear
+
+DEFAULT_RULES = (
+    Rule("co2", "co2", "above", 1000, 900),
+    Rule("oxygen", "oxygen", "below", 90, 91.5),
+    Rule("temperature", "temperature", "above", 26, 25.5),
+    Rule("energy_peak", "energy", "above", 3.5, 3.2, sub="peak"),
+)
+
+DEFAULT_ALPHA = 0.3      # suavização do valor comparado aos limites
+DEFAULT_BETA = 0.02      # janela efetiva ~50 amostras para média/variância do z-score
+DEFAULT_DEBOUNCE = 3     # amostras seguidas para mudar de estado
+DEFAULT_Z = 4.0          # |z| a partir do qual a amostra é anômala
+DEFAULT_WARMUP = 30      # amostras antes de confiar no z-score
+
+# -------------------------
+# Motor
+# -------------------------
+
+# Índices do estado por (dispositivo, métrica) — lista mutável, mais barata que objeto
+_EWMA, _MU, _VAR, _N, _ACTIVE, _RUN, _ANOM_RUN = range(7)
+
+class AlertEngine:
+    """
+    Processa leituras uma a uma e chama emit(evento) quando algo muda.
+    Tipos de evento: "alerta" (entrou em alarme), "normalizado" (saiu) e
+    "anomalia" (|z| alto por 'debounce' amostras, independente dos limites).
+    """
+
+    def __init__(self, rules=DEFAULT_RULES, emit=None, alpha=DEFAULT_ALPHA, beta=DEFAULT_BETA,
+                 debounce=DEFAULT_DEBOUNCE, z_threshold=DEFAULT_Z, warmup=DEFAULT_WARMUP):
+        self.rules = tuple(rules)
+        self.emit = emit or (lambda event: None)
+        self.alpha = alpha
+        self.beta = beta
+        self.debounce = debounce
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.latency = LatencyHistogram()
+        self.readings = 0
+        self.skipped = 0
+        self.events = 0
+        self._devices = {}
+        # Regras "achatadas" em tuplas: o laço por amostra evita acesso a atributos
+        self._plan = tuple(
+            (r, r.field, r.sub, r.direction == "above", r.trigger, r.clear) for r in self.rules
+        )
+
+    def _event(self, kind, device, rule, value, smoothed, z, rec, t_in):
+        ev = {
+            "tipo": kind,
+            "device_id": device,
+            "metrica": rule.metric,
+            "valor": value,
+            "suavizado": round(smoothed, 3),
+            "limite": rule.trigger if kind == "alerta" else rule.clear if kind == "normalizado" else None,
+            "z": round(z, 2),
+            "timestamp": rec.get("timestamp"),
+        }
+        if t_in is not None:
+            lat = time.perf_counter() - t_in
+            self.latency.record(lat)
+            ev["latencia_ms"] = round(lat * 1000, 3)
+        self.events += 1
+        self.emit(ev)
+
+    def process(self, rec, t_in=None):
+        """Incorpora uma leitura (dict no formato do simulador). t_in: perf_counter da chegada."""
+        if not isinstance(rec, dict):
+            self.skipped += 1
+            return
+        device = rec.get("device_id") or "desconhecido"
+        states = self._devices.get(device)
+        if states is None:
+            states = self._devices[device] = [[0.0, 0.0, 0.0, 0, 0, 0, 0] for _ in self.rules]
+        self.readings += 1
+
+        alpha, beta, debounce = self.alpha, self.beta, self.debounce
+        warmup, zmax = self.warmup, self.z_threshold
+        for (rule, field, sub, above, trigger, clear), st in zip(self._plan, states):
+            v = rec.get(field)
+            if sub is not None:
+                v = v.get(sub) if v.__class__ is dict else None
+            if v.__class__ is not int and v.__class__ is not float:
+                continue
+
+            n = st[_N]
+            if n == 0:
+                s = st[_EWMA] = st[_MU] = float(v)
+                z = 0.0
+            else:
+                s = st[_EWMA] = st[_EWMA] + alpha * (v - st[_EWMA])
+                mu, var = st[_MU], st[_VAR]
+                d = v - mu
+                z = d / math.sqrt(var) if var > 0 else 0.0
+                st[_MU] = mu + beta * d
+                st[_VAR] = (1 - beta) * (var + beta * d * d)
+            st[_N] = n + 1
+
+            # Limites com histerese sobre o valor suavizado + debounce
+            if above:
+                beyond, back = s > trigger, s < clear
+            else:
+                beyond, back = s < trigger, s > clear
+            if not st[_ACTIVE]:
+                if beyond:
+                    st[_RUN] += 1
+                    if st[_RUN] >= debounce:
+                        st[_ACTIVE], st[_RUN] = 1, 0
+                        self._event("alerta", device, rule, v, s, z, rec, t_in)
+                else:
+                    st[_RUN] = 0
+            elif back:
+                st[_RUN] += 1
+                if st[_RUN] >= debounce:
+                    st[_ACTIVE], st[_RUN] = 0, 0
+                    self._event("normalizado", device, rule, v, s, z, rec, t_in)
+            else:
+                st[_RUN] = 0
+
+            # z-score do valor bruto: um evento por episódio de 'debounce' amostras anômalas
+            if n >= warmup and (z >= zmax or z <= -zmax):
+                st[_ANOM_RUN] += 1
+                if st[_ANOM_RUN] == debounce:
+                    self._event("anomalia", device, rule, v, s, z, rec, t_in)
+            else:
+                st[_ANOM_RUN] = 0
+
+    def process_line(self, line, t_in=None):
+        """Decodifica uma linha NDJSON (objeto ou array de objetos) e processa."""
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            self.skipped += 1
+            return
+        if isinstance(obj, list):
+            for rec in obj:
+                self.process(rec, t_in)
+        else:
+            self.process(obj, t_in)
+
+    def process_lines(self, lines, t_in=None):
+        """
+        Processa um bloco de linhas NDJSON (bytes, sem '\\n').
+        O bloco é decodificado com um único json.loads (várias vezes mais
+        rápido que uma chamada por linha); se houver lixo, cai para linha a linha.
+        """
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return
+        try:
+            objs = json.loads(b"[" + b",".join(lines) + b"]")
+        except ValueError:
+            for line in lines:
+                self.process_line(line, t_in)
+            return
+        process = self.process
+        for obj in objs:
+            if obj.__class__ is list:
+                for rec in obj:
+                    process(rec, t_in)
+            else:
+                process(obj, t_in)
+
+    def active_alerts(self):
+        """Alarmes abertos no momento: [(device, métrica), ...]."""
+        return [
+            (dev, rule.metric)
+            for dev, states in self._devices.items()
+            for rule, st in zip(self.rules, states)
+            if st[_ACTIVE]
+        ]
+
+    def summary(self):
+        return (f"leituras {self.readings} | eventos {self.events} | alarmes abertos "
+                f"{len(self.active_alerts())} | descartadas {self.skipped} | "
+                f"latência p99 {self.latency.summary_ms()['p99']} ms")
+
+# -------------------------
+# Fontes de leituras
+# -------------------------
+
+_BLOCK_BYTES = 1 << 16
+
+def run_stream(engine, stream):
+    """
+    Lê NDJSON de um arquivo binário (stdin) até o fim.
+    Usa read1 (o que já estiver disponível, até 64 KiB): em pipes lentos cada
+    linha é processada assim que chega; em cargas altas os blocos enchem.
+    """
+    clock = time.perf_counter
+    read = getattr(stream, "read1", stream.read)
+    partial = b""
+    while True:
+        chunk = read(_BLOCK_BYTES)
+        if not chunk:
+            break
+        lines = (partial + chunk).split(b"\n")
+        partial = lines.pop()
+        engine.process_lines(lines, clock())
+    if partial.strip():
+        engine.process_line(partial, clock())
+
+def _segment_seq(name):
+    return int(name[len("journal-"):-len(".ndjson")])
+
+def tail_journal(engine, journal_dir, from_start=False, poll=0.2, stop=None):
+    """
+    Segue o diário NDJSON do ingest_server (segmentos journal-NNNNNN.ndjson).
+    Começa no fim do segmento atual (ou do primeiro, com from_start), passa ao
+    próximo segmento quando ele aparece e guarda linhas incompletas até o '\\n'.
+    """
+    from ingest_server import journal_segments
+
+    clock = time.perf_counter
+    segs = journal_segments(journal_dir)
+    while not segs:
+        if stop is not None and stop.is_set():
+            return
+        time.sleep(poll)
+        segs = journal_segments(journal_dir)
+        from_start = True  # diário criado depois de começarmos: nada foi visto ainda
+
+    path = segs[0] if from_start else segs[-1]
+    f = open(path, "rb")
+    if not from_start:
+        f.seek(0, os.SEEK_END)
+    partial = b""
+    try:
+        while stop is None or not stop.is_set():
+            chunk = f.read(1 << 20)
+            if chunk:
+                lines = (partial + chunk).split(b"\n")
+                partial = lines.pop()
+                engine.process_lines(lines, clock())
+                continue
+
+            # Fim do segmento: se já existe um posterior, este não cresce mais
+            newer = [p for p in journal_segments(journal_dir)
+                     if _segment_seq(os.path.basename(p)) > _segment_seq(os.path.basename(path))]
+            if newer:
+                if partial:
+                    engine.process_line(partial, clock())
+                    partial = b""
+                f.close()
+                path = newer[0]
+                f = open(path, "rb")
+            else:
+                time.sleep(poll)
+    finally:
+        f.close()
+
+class _AlertSocketHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        engine, lock = self.server.engine, self.server.lock
+        clock = time.perf_counter
+        for line in self.rfile:
+            if line.strip():
+                t_in = clock()
+                with lock:
+                    engine.process_line(line, t_in)
+
+class _AlertSocketServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def listen(engine, host, port):
+    """Aceita conexões TCP que enviam NDJSON (várias fontes ao mesmo tempo)."""
+    server = _AlertSocketServer((host, port), _AlertSocketHandler)
+    server.engine = engine
+    server.lock = threading.Lock()
+    print(f"[alertas] ouvindo NDJSON em {host}:{server.server_address[1]}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+# -------------------------
+# Benchmark
+# -------------------------
+
+def _synthetic_lines(n, devices=100, seed=1):
+    """Linhas NDJSON no formato do simulador, com episódios sustentados de CO₂ alto."""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        dev = i % devices
+        episode = (i // devices) % 400 < 40  # ~10% do tempo em episódio
+        rec = {
+            "device_id": f"sim-{dev:04d}",
+            "timestamp": "2025-11-20T10:00:00Z",
+            "temperature": round(rnd.uniform(20.0, 26.5), 1),
+            "humidity": rnd.randint(30, 70),
+            "oxygen": rnd.randint(90, 99),
+            "co2": int(rnd.gauss(1300 if episode and dev % 10 == 0 else 700, 120)),
+            "energy": {"instant": round(rnd.uniform(0.2, 3.0), 2), "total": 5.0,
+                       "peak": round(rnd.uniform(1.0, 3.3), 2)},
+        }
+        out.append(json.dumps(rec).encode("utf-8"))
+    return out
+
+def bench(n, devices=100):
+    """Vazão de ponta a ponta (decodificação + motor) em blocos de 64 KiB, como em run_stream."""
+    data = b"\n".join(_synthetic_lines(n, devices)) + b"\n"
+    events = []
+    engine = AlertEngine(emit=events.append)
+    clock = time.perf_counter
+    t0 = clock()
+    run_stream(engine, io.BytesIO(data))
+    elapsed = clock() - t0
+    kinds = {}
+    for ev in events:
+        kinds[ev["tipo"]] = kinds.get(ev["tipo"], 0) + 1
+    print(f"[alertas] {n} leituras em {elapsed:.3f} s -> {n / elapsed:,.0f} leituras/s | "
+          f"eventos {kinds} | latência {engine.latency.summary_ms()}")
+
+# -------------------------
+# CLI
+# -------------------------
+
+def _reporter(engine, every):
+    while True:
+        time.sleep(every)
+        print(f"[alertas] {engine.summary()}", file=sys.stderr, flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Alertas IoT em streaming (EWMA, z-score, histerese, debounce)")
+    src = parser.add_mutually_exclusive_group()
+    src.add_argument("--journal", default=None, help="segue o diário NDJSON do ingest_server")
+    src.add_argument("--listen", default=None, help="[host:]porta para receber NDJSON via TCP")
+    src.add_argument("--bench", type=int, default=None, help="mede a vazão com N leituras sintéticas")
+    parser.add_argument("--from-start", action="store_true", help="com --journal, processa o diário desde o início")
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA)
+    parser.add_argument("--beta", type=float, default=DEFAULT_BETA)
+    parser.add_argument("--debounce", type=int, default=DEFAULT_DEBOUNCE)
+    parser.add_argument("--z", type=float, default=DEFAULT_Z, help="limite de |z| para anomalias")
+    parser.add_argument("--summary-every", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.bench)
+        return
+
+    out = sys.stdout
+
+    def emit(event):
+        out.write(json.dumps(event, ensure_ascii=False) + "\n")
+        out.flush()  # eventos são raros; sair já limita a latência de ponta a ponta
+
+    engine = AlertEngine(emit=emit, alpha=args.alpha, beta=args.beta, debounce=args.debounce,
+                         z_threshold=args.z)
+    threading.Thread(target=_reporter, args=(engine, args.summary_every), daemon=True).start()
+
+    try:
+        if args.journal:
+            tail_journal(engine, args.journal, args.from_start)
+        elif args.listen:
+            host, _, port = args.listen.rpartition(":")
+            listen(engine, host or "127.0.0.1", int(port))
+        else:
+            run_stream(engine, sys.stdin.buffer)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    print(f"[alertas] fim: {engine.summary()}", file=sys.stderr, flush=True)
+
+if __name__ == "__main__":
+    main()
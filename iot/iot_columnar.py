@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+# iot_columnar.py
+#
+# Armazenamento colunar e mapeado em memória (mmap) das leituras IoT.
+#
+# Cada métrica fica em um arquivo binário próprio, de largura fixa:
+#   timestamp.bin   float64  (epoch UTC, segundos)
+#   device.bin      uint32   (índice no dicionário meta.json["devices"])
+#   <metrica>.bin   float32  (NaN quando a leitura não trouxe o valor)
+# e meta.json guarda o número de linhas, os tipos, o checkpoint do log de origem
+# e o menor/maior timestamp de cada bloco de BLOCK_ROWS linhas.
+# O meta.json é o ponto de confirmação: linhas além de meta["rows"] (de uma
+# conversão interrompida) são cortadas na próxima abertura para escrita, e o
+# checkpoint gravado junto com elas diz de onde retomar o log.
+#
+# Na leitura, os arquivos são mapeados com mmap e expostos como memoryview
+# (ou arrays NumPy, se instalado) sem cópia; recortes por intervalo de tempo
+# são feitos por busca binária na coluna de timestamp e também não copiam.
+# Logs de vários dispositivos intercalados (frota, lotes) trazem timestamps
+# um pouco fora de ordem: aí o recorte usa o mín/máx por bloco para achar as
+# linhas candidatas e filtra o tempo com uma máscara.
+#
+# Uso:
+#   python iot_columnar.py convert                 -> converte/atualiza a partir do iot_log.json
+#   python iot_columnar.py convert --rebuild
+#   python iot_columnar.py stats --periodo 2025-11-20
+
+import os
+import sys
+import json
+import mmap
+import array
+import bisect
+import argparse
+
+import iot_stream
+from iot_aggregates import MetricStats, LogCheckpoint
+
+# Usa NumPy automaticamente se instalado; caso contrário, memoryview + Python puro
+_use_numpy = False
+try:
+    import numpy as np
+    _use_numpy = True
+except Exception:
+    np = None
+
+FORMAT_VERSION = 1
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(iot_stream.DEFAULT_LOG_PATH), "columnar")
+
+# Tipos por coluna (códigos do módulo array / struct)
+COLUMN_TYPES = {"timestamp": "d", "device": "I"}
+COLUMN_TYPES.update({m: "f" for m in iot_stream.METRICS})
+
+_NUMPY_DTYPES = {"d": "=f8", "I": "=u4", "f": "=f4"}
+
+# Linhas acumuladas em memória antes de descarregar nos arquivos
+_FLUSH_ROWS = 65536
+
+# Linhas por bloco no índice mín/máx de timestamp (meta.json["block_ts"])
+BLOCK_ROWS = 4096
+
+_NAN = float("nan")
+
+def _read_meta(store_dir):
+    try:
+        with open(os.path.join(store_dir, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _block_ts(timestamps, row0, blocks):
+    """Atualiza 'blocks' ([mín, máx] por bloco) com 'timestamps' a partir da linha row0."""
+    rows = len(timestamps)
+    i = 0
+    while i < rows:
+        row = row0 + i
+        k = row // BLOCK_ROWS
+        n = min(rows - i, (k + 1) * BLOCK_ROWS - row)
+        chunk = timestamps[i:i + n]
+        lo, hi = float(min(chunk)), float(max(chunk))
+        if k == len(blocks):
+            blocks.append([lo, hi])
+        else:
+            b = blocks[k]
+            b[0], b[1] = min(b[0], lo), max(b[1], hi)
+        i += n
+
+# -------------------------
+# Escrita
+# -------------------------
+
+class ColumnarWriter:
+    """
+    Acrescenta linhas às colunas de um diretório (criando-o se necessário).
+    As linhas ficam em buffers array.array e são gravadas em blocos; o
+    meta.json só é atualizado em commit()/close(), depois dos dados.
+    abort() fecha sem confirmar (as linhas não confirmadas são descartadas).
+    """
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, rebuild=False):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+        meta = None if rebuild else _read_meta(store_dir)
+        if meta and meta.get("version") == FORMAT_VERSION and meta.get("byteorder") == sys.byteorder:
+            self.meta = meta
+        else:
+            self.meta = {
+                "version": FORMAT_VERSION,
+                "byteorder": sys.byteorder,
+                "rows": 0,
+                "columns": dict(COLUMN_TYPES),
+                "devices": [],
+                "sorted": True,
+                "block_ts": [],
+                "source": {"offset": 0, "size": 0},
+            }
+            rebuild = True
+        self.rebuilt = rebuild
+
+        self._device_index = {d: i for i, d in enumerate(self.meta["devices"])}
+        self._last_ts = None
+        self._buffers = {c: array.array(t) for c, t in COLUMN_TYPES.items()}
+
+        mode = "wb" if rebuild else "ab"
+        self._files = {c: open(self._column_path(c), mode) for c in COLUMN_TYPES}
+        if not rebuild:
+            self._truncate_to_rows()
+            if self.meta["rows"]:
+                store = ColumnarStore(store_dir)
+                ts = store.column("timestamp")
+                self._last_ts = ts[self.meta["rows"] - 1]
+                if "block_ts" not in self.meta:    # gravado antes do índice por bloco
+                    self.meta["block_ts"] = []
+                    _block_ts(ts, 0, self.meta["block_ts"])
+                del ts
+                store.close()
+            self.meta.setdefault("block_ts", [])
+
+    def _column_path(self, name):
+        return os.path.join(self.store_dir, name + ".bin")
+
+    def _truncate_to_rows(self):
+        """Descarta bytes de uma gravação interrompida (além do que o meta.json registra)."""
+        rows = self.meta["rows"]
+        for c, f in self._files.items():
+            size = rows * array.array(COLUMN_TYPES[c]).itemsize
+            f.flush()
+            if os.path.getsize(self._column_path(c)) != size:
+                f.truncate(size)
+
+    def append(self, ts, device_id, values):
+        """Acrescenta uma linha; 'values' é o dict de iot_stream.reading_values."""
+        dev = self.register_device(device_id)
+
+        if self._last_ts is not None and ts < self._last_ts:
+            self.meta["sorted"] = False
+        self._last_ts = ts
+
+        blocks = self.meta["block_ts"]
+        k = self.meta["rows"] // BLOCK_ROWS
+        if k == len(blocks):
+            blocks.append([ts, ts])
+        elif ts < blocks[k][0]:
+            blocks[k][0] = ts
+        elif ts > blocks[k][1]:
+            blocks[k][1] = ts
+
+        b = self._buffers
+        b["timestamp"].append(ts)
+        b["device"].append(dev)
+        for m in iot_stream.METRICS:
+            v = values.get(m)
+            b[m].append(_NAN if v is None else v)
+
+        self.meta["rows"] += 1
+        if len(b["timestamp"]) >= _FLUSH_ROWS:
+            self.flush()
+
+    def register_device(self, device_id):
+        """Índice do dispositivo no dicionário meta.json["devices"] (cria se novo)."""
+        dev = self._device_index.get(device_id)
+        if dev is None:
+            dev = self._device_index[device_id] = len(self.meta["devices"])
+            self.meta["devices"].append(device_id)
+        return dev
+
+    def append_block(self, timestamps, devices, columns):
+        """
+        Acrescenta um bloco de linhas de uma vez (gerador em massa, por exemplo).
+        - timestamps: sequência float64 (epoch); devices: índices de register_device();
+        - columns: {metrica: sequência}; métricas ausentes ficam NaN.
+        Aceita arrays NumPy ou array.array; os dados vão direto para os arquivos.
+        """
+        rows = len(timestamps)
+        if not rows:
+            return
+        self.flush()  # mantém a ordem em relação a linhas pendentes de append()
+
+        first, last = timestamps[0], timestamps[rows - 1]
+        if self._last_ts is not None and first < self._last_ts:
+            self.meta["sorted"] = False
+        self._last_ts = last
+        _block_ts(timestamps, self.meta["rows"], self.meta["block_ts"])
+
+        data = {"timestamp": timestamps, "device": devices}
+        data.update(columns)
+        for c, code in COLUMN_TYPES.items():
+            col = data.get(c)
+            if col is None:
+                col = array.array(code, [_NAN]) * rows
+            elif _use_numpy and isinstance(col, np.ndarray):
+                col = np.ascontiguousarray(col, dtype=_NUMPY_DTYPES[code])
+            elif not (isinstance(col, array.array) and col.typecode == code):
+                col = array.array(code, col)
+            if len(col) != rows:
+                raise ValueError(f"coluna {c!r} com {len(col)} linhas; esperado {rows}")
+            self._files[c].write(memoryview(col).cast("B"))
+        self.meta["rows"] += rows
+
+    def flush(self):
+        for c, buf in self._buffers.items():
+            if buf:
+                buf.tofile(self._files[c])
+                del buf[:]
+        for f in self._files.values():
+            f.flush()
+
+    def commit(self):
+        """Grava os buffers e confirma as linhas (e o checkpoint) no meta.json."""
+        self.flush()
+        tmp = os.path.join(self.store_dir, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, os.path.join(self.store_dir, "meta.json"))
+
+    def close(self):
+        self.commit()
+        for f in self._files.values():
+            f.close()
+
+    def abort(self):
+        for f in self._files.values():
+            f.close()
+
+def convert(log_path=iot_stream.DEFAULT_LOG_PATH, store_dir=DEFAULT_STORE_DIR, rebuild=False):
+    """
+    Converte o iot_log.json em colunas. Se o diretório já existir, retoma do
+    checkpoint registrado e só acrescenta as leituras novas; se o log foi
+    reescrito, reconstrói do zero. A cada bloco de _FLUSH_ROWS linhas, dados
+    e checkpoint são confirmados juntos, então uma conversão interrompida
+    retoma do último bloco sem duplicar linhas. Retorna o número de linhas
+    acrescentadas.
+    """
+    meta = None if rebuild else _read_meta(store_dir)
+    checkpoint = LogCheckpoint()
+    if meta:
+        checkpoint = LogCheckpoint.from_dict(meta.get("source"))
+        if not checkpoint.is_valid(log_path):
+            rebuild, checkpoint = True, LogCheckpoint()
+
+    writer = ColumnarWriter(store_dir, rebuild=rebuild)
+    if writer.rebuilt:
+        checkpoint = LogCheckpoint()  # meta ausente ou de outra versão: recomeça do início do log
+    offset = checkpoint.offset
+    added = 0
+    pending = 0
+
+    def _commit():
+        checkpoint.advance(log_path, offset)
+        writer.meta["source"] = checkpoint.to_dict()
+        writer.commit()
+
+    try:
+        for rec, end in iot_stream.iter_log_records(log_path, offset=offset):
+            offset = end
+            if not iot_stream.is_valid_reading(rec):
+                continue
+            ts = iot_stream.parse_timestamp(rec.get("timestamp"))
+            writer.append(ts, rec.get("device_id") or "desconhecido", iot_stream.reading_values(rec))
+            added += 1
+            pending += 1
+            if pending >= _FLUSH_ROWS:
+                _commit()
+                pending = 0
+        _commit()
+    except BaseException:
+        writer.abort()  # o meta.json continua no último bloco confirmado
+        raise
+    writer.close()
+    return added
+
+# -------------------------
+# Leitura
+# -------------------------
+
+class ColumnSlice:
+    """
+    Recorte de todas as colunas entre as linhas [lo, hi). Em armazenamentos
+    fora de ordem, 'window' = (start, end) filtra também pelo timestamp; só
+    então column() copia (as linhas selecionadas não são contíguas).
+    """
+
+    def __init__(self, store, lo, hi, window=None):
+        self.store = store
+        self.lo = lo
+        self.hi = hi
+        self.window = window
+
+    def __len__(self):
+        if self.window is None:
+            return self.hi - self.lo
+        keep = self.store._time_mask(self.lo, self.hi, *self.window)
+        return int(keep.sum()) if _use_numpy else sum(keep)
+
+    def column(self, name):
+        col = self.store.column(name)[self.lo:self.hi]
+        if self.window is None:
+            return col
+        keep = self.store._time_mask(self.lo, self.hi, *self.window)
+        if _use_numpy:
+            return col[keep]
+        return array.array(self.store.meta["columns"][name], (x for x, k in zip(col, keep) if k))
+
+    def stats(self, device_id=None):
+        """Agregados {metrica: MetricStats} do recorte (vetorizados com NumPy)."""
+        return self.store._stats(self.lo, self.hi, device_id, self.window)
+
+class ColumnarStore:
+    """Leitor mapeado em memória de um diretório gerado por ColumnarWriter/convert."""
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR):
+        meta = _read_meta(store_dir)
+        if not meta:
+            raise FileNotFoundError(f"armazenamento colunar não encontrado em {store_dir}")
+        if meta.get("byteorder") != sys.byteorder:
+            raise ValueError("armazenamento gravado com outra ordem de bytes")
+
+        self.store_dir = store_dir
+        self.meta = meta
+        self.rows = meta["rows"]
+        self.devices = meta["devices"]
+        self._maps = []
+        self._columns = {}
+
+    def column(self, name):
+        """Coluna inteira como memoryview (ou ndarray) sobre o mmap, sem cópia."""
+        col = self._columns.get(name)
+        if col is not None:
+            return col
+
+        code = self.meta["columns"][name]
+        nbytes = self.rows * array.array(code).itemsize
+        if nbytes == 0:
+            col = np.empty(0, dtype=_NUMPY_DTYPES[code]) if _use_numpy else memoryview(array.array(code))
+        else:
+            with open(os.path.join(self.store_dir, name + ".bin"), "rb") as f:
+                mm = mmap.mmap(f.fileno(), nbytes, access=mmap.ACCESS_READ)
+            self._maps.append(mm)
+            if _use_numpy:
+                col = np.frombuffer(mm, dtype=_NUMPY_DTYPES[code], count=self.rows)
+            else:
+                col = memoryview(mm).cast(code)
+        self._columns[name] = col
+        return col
+
+    def time_slice(self, start=None, end=None):
+        """
+        Linhas com timestamp em [start, end) como ColumnSlice.
+        Colunas ordenadas por tempo (o caso normal do log) usam busca binária;
+        fora de ordem, o recorte cobre os blocos cujo mín/máx cruza o
+        intervalo e filtra as linhas pelo timestamp.
+        """
+        if start is None and end is None:
+            return ColumnSlice(self, 0, self.rows)
+        if not self.meta.get("sorted", True):
+            return self._unsorted_slice(start, end)
+        ts = self.column("timestamp")
+        if _use_numpy:
+            lo = 0 if start is None else int(np.searchsorted(ts, start, side="left"))
+            hi = self.rows if end is None else int(np.searchsorted(ts, end, side="left"))
+        else:
+            lo = 0 if start is None else bisect.bisect_left(ts, start)
+            hi = self.rows if end is None else bisect.bisect_left(ts, end)
+        return ColumnSlice(self, lo, hi)
+
+    def _unsorted_slice(self, start, end):
+        blocks = self.meta.get("block_ts")
+        if blocks is None:
+            return ColumnSlice(self, 0, self.rows, (start, end))   # sem índice: varre tudo
+        hit = [k for k, (lo, hi) in enumerate(blocks)
+               if (start is None or hi >= start) and (end is None or lo < end)]
+        if not hit:
+            return ColumnSlice(self, 0, 0)
+        return ColumnSlice(self, hit[0] * BLOCK_ROWS, min(self.rows, (hit[-1] + 1) * BLOCK_ROWS),
+                           (start, end))
+
+    def _time_mask(self, lo, hi, start, end):
+        """Máscara (ndarray bool ou lista) das linhas [lo, hi) com timestamp em [start, end)."""
+        ts = self.column("timestamp")[lo:hi]
+        if _use_numpy:
+            keep = np.ones(hi - lo, dtype=bool)
+            if start is not None:
+                keep &= ts >= start
+            if end is not None:
+                keep &= ts < end
+            return keep
+        return [(start is None or t >= start) and (end is None or t < end) for t in ts]
+
+    def stats(self, start=None, end=None, device_id=None):
+        return self.time_slice(start, end).stats(device_id)
+
+    def _stats(self, lo, hi, device_id=None, window=None):
+        code = None
+        if device_id is not None:
+            if device_id not in self.devices:
+                return {}
+            code = self.devices.index(device_id)
+
+        out = {}
+        if _use_numpy:
+            mask = None
+            if code is not None:
+                mask = self.column("device")[lo:hi] == code
+            if window is not None:
+                keep = self._time_mask(lo, hi, *window)
+                mask = keep if mask is None else mask & keep
+            for m in iot_stream.METRICS:
+                v = self.column(m)[lo:hi]
+                if mask is not None:
+                    v = v[mask]
+                v = v[~np.isnan(v)]
+                if v.size:
+                    out[m] = MetricStats(float(v.sum(dtype=np.float64)), int(v.size),
+                                         float(v.min()), float(v.max()))
+            return out
+
+        keep = self._time_mask(lo, hi, *window) if window is not None else None
+        if code is not None:
+            devs = self.column("device")[lo:hi]
+            if keep is None:
+                keep = [d == code for d in devs]
+            else:
+                keep = [k and d == code for k, d in zip(keep, devs)]
+        for m in iot_stream.METRICS:
+            col = self.column(m)[lo:hi]
+            if keep is None:
+                vals = [x for x in col if x == x]
+            else:
+                vals = [x for x, k in zip(col, keep) if k and x == x]
+            if vals:
+                out[m] = MetricStats(float(sum(vals)), len(vals), min(vals), max(vals))
+        return out
+
+    def close(self):
+        # memoryviews precisam ser liberados antes de fechar o mmap
+        for col in self._columns.values():
+            if isinstance(col, memoryview):
+                col.release()
+        self._columns.clear()
+        for mm in self._maps:
+            try:
+                mm.close()
+            except BufferError:
+                # ainda há recortes vivos apontando para o mmap; o GC fecha depois
+                pass
+        self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Armazenamento colunar mmap das leituras IoT")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_conv = sub.add_parser("convert", help="converte/atualiza a partir do iot_log.json")
+    p_conv.add_argument("--log", default=iot_stream.DEFAULT_LOG_PATH)
+    p_conv.add_argument("--out", default=DEFAULT_STORE_DIR)
+    p_conv.add_argument("--rebuild", action="store_true")
+
+    p_stats = sub.add_parser("stats", help="agregados de um período")
+    p_stats.add_argument("--dir", default=DEFAULT_STORE_DIR)
+    p_stats.add_argument("--periodo", default=None)
+    p_stats.add_argument("--device", default=None)
+
+    args = parser.parse_args()
+
+    if args.cmd == "convert":
+        added = convert(args.log, args.out, args.rebuild)
+        print(f"{added} linhas acrescentadas em {args.out}")
+        return
+
+    rng = iot_stream.parse_periodo(args.periodo) if args.periodo else None
+    start, end = rng if rng else (None, None)
+    with ColumnarStore(args.dir) as store:
+        sl = store.time_slice(start, end)
+        stats = sl.stats(args.device)
+        out = {
+            "linhas": len(sl),
+            "numpy": _use_numpy,
+            "metricas": {
+                m: {"media": st.mean, "min": st.min, "max": st.max, "n": st.count}
+                for m, st in stats.items()
+            },
+        }
+    json.dump(out, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
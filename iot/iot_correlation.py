@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# iot_correlation.py
+#
+# Análise de correlação entre consumo de energia, CO₂ e climatização.
+#
+# As séries são alinhadas em uma grade de tempo comum a partir dos rollups
+# (iot_rollups): cada ponto da grade é a média do balde de 1 min, 5 min ou
+# 1 h, escolhido para que a janela caiba em MAX_GRID_POINTS pontos. Assim um
+# mês de leituras a cada 5 s vira ~9 mil pontos por série, e os cálculos
+# abaixo rodam em milissegundos.
+#
+# Medidas:
+#   - Pearson e Spearman por par de séries (apenas pontos com os dois valores);
+#   - correlação cruzada com defasagem (qual atraso maximiza |r|);
+#   - correlação em janela móvel (estabilidade da relação no tempo);
+#   - coocorrência de picos de energia e de CO₂ por dispositivo.
+#
+# Não há sensor de HVAC no payload; o acionamento é aproximado pela variação
+# absoluta de temperatura entre pontos consecutivos da grade ("hvac").
+#
+# Uso:
+#   python iot_correlation.py --periodo 2025-11
+#   python iot_correlation.py --periodo 2025-11-20 --device simulator-001
+
+import sys
+import json
+import math
+import argparse
+
+import iot_stream
+import iot_rollups
+
+# Usa NumPy automaticamente se instalado; caso contrário, Python puro
+_use_numpy = False
+try:
+    import numpy as np
+    _use_numpy = True
+except Exception:
+    np = None
+
+# Séries da grade -> (métrica do rollup, campo do balde)
+SERIES = {
+    "energia": ("energy_instant", "mean"),
+    "co2": ("co2", "mean"),
+    "temperatura": ("temperature", "mean"),
+    "umidade": ("humidity", "mean"),
+}
+
+# Pares analisados (o primeiro elemento "lidera" na correlação cruzada)
+PAIRS = (
+    ("energia", "co2"),
+    ("energia", "hvac"),
+    ("co2", "temperatura"),
+    ("energia", "temperatura"),
+)
+
+MAX_GRID_POINTS = 20000
+DEFAULT_MAX_LAG = 12       # pontos da grade para cada lado
+DEFAULT_WINDOW = 60        # pontos da grade por janela móvel
+PEAK_QUANTILE = 0.9        # pico = acima do percentil 90 do próprio dispositivo
+PEAK_TOLERANCE = 1         # picos de CO₂ até 1 ponto antes/depois contam como coocorrência
+
+_NAN = float("nan")
+
+def _isnan(v):
+    return v != v
+
+def _round(v, nd=4):
+    return None if v is None or _isnan(v) else round(v, nd)
+
+# -------------------------
+# Alinhamento na grade de tempo
+# -------------------------
+
+def align_series(engine, start=None, end=None, device_id=None, resolution=None,
+                 max_points=MAX_GRID_POINTS):
+    """
+    Monta a grade comum a partir dos rollups.
+    Retorna {"resolucao_s", "t0", "series": {nome: lista/array}, "picos": {device: {...}}}
+    - series: média combinada de todos os dispositivos (ou só de device_id), NaN sem dados;
+      inclui "hvac" = |Δ temperatura| entre pontos consecutivos.
+    - picos: por dispositivo, máximos por ponto de energy_peak e co2 (para coocorrência).
+    """
+    res = resolution or engine.pick_resolution(start, end, max_points)
+
+    rows = []
+    for (t, dev), values in engine.rows(res, start, end):
+        if start is not None and t + res <= start:
+            continue
+        if end is not None and t >= end:
+            continue
+        if device_id is not None and dev != device_id:
+            continue
+        rows.append((t, dev, values))
+
+    out = {"resolucao_s": res, "t0": None, "series": {}, "picos": {}}
+    if not rows:
+        return out
+
+    t0 = min(r[0] for r in rows)
+    n = int((max(r[0] for r in rows) - t0) // res) + 1
+    out["t0"] = t0
+
+    sums = {name: [0.0] * n for name in SERIES}
+    counts = {name: [0] * n for name in SERIES}
+    peaks = {}
+    for t, dev, values in rows:
+        i = int((t - t0) // res)
+        for name, (metric, _) in SERIES.items():
+            st = values.get(metric)
+            if st is not None and st.count:
+                sums[name][i] += st.sum
+                counts[name][i] += st.count
+        dev_peaks = peaks.get(dev)
+        if dev_peaks is None:
+            dev_peaks = peaks[dev] = {"energia": [_NAN] * n, "co2": [_NAN] * n}
+        for name, metric in (("energia", "energy_peak"), ("co2", "co2")):
+            st = values.get(metric)
+            if st is not None and st.count:
+                dev_peaks[name][i] = st.max
+
+    series = {
+        name: [s / c if c else _NAN for s, c in zip(sums[name], counts[name])]
+        for name in SERIES
+    }
+    temp = series["temperatura"]
+    series["hvac"] = [_NAN] + [abs(b - a) for a, b in zip(temp, temp[1:])]
+
+    if _use_numpy:
+        series = {k: np.asarray(v, dtype=np.float64) for k, v in series.items()}
+        peaks = {d: {k: np.asarray(v, dtype=np.float64) for k, v in p.items()} for d, p in peaks.items()}
+    out["series"] = series
+    out["picos"] = peaks
+    return out
+
+# -------------------------
+# Estatística (NumPy ou Python puro, mesma interface)
+# -------------------------
+
+def _pairs(x, y):
+    """Pares (x, y) com os dois valores presentes."""
+    if _use_numpy:
+        m = ~(np.isnan(x) | np.isnan(y))
+        return x[m], y[m]
+    xs, ys = [], []
+    for a, b in zip(x, y):
+        if not (_isnan(a) or _isnan(b)):
+            xs.append(a)
+            ys.append(b)
+    return xs, ys
+
+def _pearson_complete(x, y):
+    n = len(x)
+    if n < 3:
+        return None
+    if _use_numpy:
+        xc = x - x.mean()
+        yc = y - y.mean()
+        den = math.sqrt(float(np.dot(xc, xc)) * float(np.dot(yc, yc)))
+        return float(np.dot(xc, yc)) / den if den > 0 else None
+    mx = sum(x) / n
+    my = sum(y) / n
+    sxy = sxx = syy = 0.0
+    for a, b in zip(x, y):
+        da = a - mx
+        db = b - my
+        sxy += da * db
+        sxx += da * da
+        syy += db * db
+    den = math.sqrt(sxx * syy)
+    return sxy / den if den > 0 else None
+
+def pearson(x, y):
+    """Coeficiente de Pearson nos pontos em que as duas séries têm valor (None se indefinido)."""
+    return _pearson_complete(*_pairs(x, y))
+
+def _ranks(v):
+    """Postos 1..n com empates recebendo o posto médio."""
+    if _use_numpy:
+        _, inv, counts = np.unique(v, return_inverse=True, return_counts=True)
+        avg = np.cumsum(counts) - (counts - 1) / 2.0
+        return avg[inv]
+    order = sorted(range(len(v)), key=v.__getitem__)
+    ranks = [0.0] * len(v)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and v[order[j + 1]] == v[order[i]]:
+            j += 1
+        avg = (i + j) / 2.0 + 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = avg
+        i = j + 1
+    return ranks
+
+def spearman(x, y):
+    """Correlação de Spearman (Pearson dos postos), robusta a relações monotônicas não lineares."""
+    xs, ys = _pairs(x, y)
+    if len(xs) < 3:
+        return None
+    return _pearson_complete(_ranks(xs), _ranks(ys))
+
+def cross_correlation(x, y, max_lag=DEFAULT_MAX_LAG):
+    """
+    Pearson de x[t] contra y[t + lag] para lag em [-max_lag, max_lag].
+    Lag positivo: y acompanha x com atraso. Retorna {lag: r}.
+    """
+    n = len(x)
+    out = {}
+    for lag in range(-max_lag, max_lag + 1):
+        if abs(lag) > n // 4:
+            continue  # sobreposição pequena demais para um r confiável
+        if lag >= 0:
+            r = pearson(x[:n - lag], y[lag:])
+        else:
+            r = pearson(x[-lag:], y[:n + lag])
+        if r is not None:
+            out[lag] = r
+    return out
+
+def rolling_correlation(x, y, window=DEFAULT_WINDOW):
+    """
+    Pearson em janelas móveis de 'window' pontos (somas prefixadas, O(n)).
+    Janelas com menos da metade dos pontos válidos ficam de fora.
+    Retorna a lista de r por janela (na ordem do tempo).
+    """
+    n = len(x)
+    if n < window:
+        return []
+    min_valid = max(3, window // 2)
+
+    if _use_numpy:
+        m = ~(np.isnan(x) | np.isnan(y))
+        # centraliza para reduzir cancelamento numérico nas somas de quadrados
+        xc = np.where(m, x - (x[m].mean() if m.any() else 0.0), 0.0)
+        yc = np.where(m, y - (y[m].mean() if m.any() else 0.0), 0.0)
+
+        def wsum(a):
+            c = np.concatenate(([0.0], np.cumsum(a, dtype=np.float64)))
+            return c[window:] - c[:-window]
+
+        cnt = wsum(m.astype(np.float64))
+        sx, sy = wsum(xc), wsum(yc)
+        sxx, syy, sxy = wsum(xc * xc), wsum(yc * yc), wsum(xc * yc)
+        num = cnt * sxy - sx * sy
+        den = (cnt * sxx - sx * sx) * (cnt * syy - sy * sy)
+        ok = (cnt >= min_valid) & (den > 0)
+        return (num[ok] / np.sqrt(den[ok])).tolist()
+
+    xs, ys = _pairs(x, y)
+    mx = sum(xs) / len(xs) if xs else 0.0
+    my = sum(ys) / len(ys) if ys else 0.0
+    pre = [(0, 0.0, 0.0, 0.0, 0.0, 0.0)]
+    c = sx = sy = sxx = syy = sxy = 0.0
+    for a, b in zip(x, y):
+        if not (_isnan(a) or _isnan(b)):
+            a -= mx
+            b -= my
+            c += 1
+            sx += a
+            sy += b
+            sxx += a * a
+            syy += b * b
+            sxy += a * b
+        pre.append((c, sx, sy, sxx, syy, sxy))
+
+    out = []
+    for i in range(window, n + 1):
+        hi, lo = pre[i], pre[i - window]
+        cnt, wx, wy, wxx, wyy, wxy = (h - l for h, l in zip(hi, lo))
+        if cnt < min_valid:
+            continue
+        den = (cnt * wxx - wx * wx) * (cnt * wyy - wy * wy)
+        if den > 0:
+            out.append((cnt * wxy - wx * wy) / math.sqrt(den))
+    return out
+
+def _quantile(values, q):
+    """Quantil (interpolação linear) ignorando NaN; None se vazio."""
+    if _use_numpy:
+        v = values[~np.isnan(values)]
+        return float(np.quantile(v, q)) if v.size else None
+    v = sorted(a for a in values if not _isnan(a))
+    if not v:
+        return None
+    pos = (len(v) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(v) - 1)
+    return v[lo] + (v[hi] - v[lo]) * (pos - lo)
+
+def peak_cooccurrence(energy, co2, q=PEAK_QUANTILE, tolerance=PEAK_TOLERANCE):
+    """
+    Conta pontos em que houve pico de energia e pico de CO₂ a até 'tolerance'
+    pontos de distância. Pico = valor >= quantil q da própria série.
+    'esperado' é a contagem esperada se os picos fossem independentes;
+    lift = coocorrências / esperado (> 1 indica que os picos andam juntos).
+    """
+    te = _quantile(energy, q)
+    tc = _quantile(co2, q)
+    if te is None or tc is None:
+        return None
+
+    n = len(energy)
+    if _use_numpy:
+        pe = ~np.isnan(energy) & (energy >= te)
+        pc = ~np.isnan(co2) & (co2 >= tc)
+        near = pc.copy()
+        for s in range(1, tolerance + 1):
+            near[s:] |= pc[:-s]
+            near[:-s] |= pc[s:]
+        n_e, n_c, both = int(pe.sum()), int(pc.sum()), int((pe & near).sum())
+        valid = int((~np.isnan(energy) & ~np.isnan(co2)).sum())
+    else:
+        pe = [not _isnan(v) and v >= te for v in energy]
+        pc = [not _isnan(v) and v >= tc for v in co2]
+        both = sum(
+            1 for i in range(n)
+            if pe[i] and any(pc[j] for j in range(max(0, i - tolerance), min(n, i + tolerance + 1)))
+        )
+        n_e, n_c = sum(pe), sum(pc)
+        valid = sum(1 for a, b in zip(energy, co2) if not (_isnan(a) or _isnan(b)))
+
+    if not valid:
+        return None
+    # probabilidade de um ponto estar perto de algum pico de CO₂, se independentes
+    p_near = min(1.0, n_c * (2 * tolerance + 1) / valid)
+    expected = n_e * p_near
+    return {
+        "picos_energia": n_e,
+        "picos_co2": n_c,
+        "coocorrencias": both,
+        "esperado": round(expected, 2),
+        "lift": round(both / expected, 2) if expected else None,
+    }
+
+# -------------------------
+# Análise completa
+# -------------------------
+
+def analyze(engine, start=None, end=None, device_id=None, max_lag=DEFAULT_MAX_LAG,
+            window=DEFAULT_WINDOW):
+    """
+    Executa todas as medidas sobre a grade da janela [start, end).
+    Retorna None se não houver pontos suficientes para correlacionar.
+    """
+    grid = align_series(engine, start, end, device_id)
+    series = grid["series"]
+    if not series or len(series["energia"]) < 3:
+        return None
+    res = grid["resolucao_s"]
+
+    pares = {}
+    for a, b in PAIRS:
+        x, y = series[a], series[b]
+        lags = cross_correlation(x, y, max_lag)
+        best = max(lags, key=lambda k: abs(lags[k])) if lags else None
+        roll = rolling_correlation(x, y, window)
+        pares[f"{a}_x_{b}"] = {
+            "pearson": _round(pearson(x, y)),
+            "spearman": _round(spearman(x, y)),
+            "n": len(_pairs(x, y)[0]),
+            "defasagem": {"lag_s": best * res, "r": _round(lags[best])} if best is not None else None,
+            "janela_movel": {
+                "janela_s": window * res,
+                "janelas": len(roll),
+                "media": _round(sum(roll) / len(roll)) if roll else None,
+                "min": _round(min(roll)) if roll else None,
+                "max": _round(max(roll)) if roll else None,
+                "fracao_forte": _round(sum(1 for r in roll if abs(r) >= 0.5) / len(roll), 3) if roll else None,
+            },
+        }
+
+    picos = {}
+    for dev, p in sorted(grid["picos"].items()):
+        co = peak_cooccurrence(p["energia"], p["co2"])
+        if co is not None:
+            picos[dev] = co
+
+    return {
+        "resolucao_s": res,
+        "pontos": len(series["energia"]),
+        "dispositivos": len(grid["picos"]),
+        "backend": "numpy" if _use_numpy else "python",
+        "pares": pares,
+        "coocorrencia_picos": picos,
+    }
+
+def analyze_period(periodo=None, device_id=None, log_path=None):
+    """Atalho para relatórios: atualiza os rollups do log e analisa o 'periodo'."""
+    engine = iot_rollups.shared_engine(log_path)
+    rng = iot_stream.parse_periodo(periodo) if periodo else None
+    start, end = rng if rng else (None, None)
+    with engine.lock:
+        engine.refresh()
+        return analyze(engine, start, end, device_id)
+
+def strength_label(r):
+    """Rótulo qualitativo para |r|."""
+    if r is None:
+        return "indefinida"
+    a = abs(r)
+    if a >= 0.7:
+        return "forte"
+    if a >= 0.5:
+        return "moderada a forte"
+    if a >= 0.3:
+        return "moderada"
+    if a >= 0.1:
+        return "fraca"
+    return "desprezível"
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Correlação energia x CO₂ x climatização")
+    parser.add_argument("--log", default=iot_stream.DEFAULT_LOG_PATH)
+    parser.add_argument("--periodo", default=None)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--max-lag", type=int, default=DEFAULT_MAX_LAG,
+                        help="defasagem máxima em pontos da grade")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW,
+                        help="pontos da grade por janela móvel")
+    args = parser.parse_args()
+
+    engine = iot_rollups.RollupEngine(args.log)
+    engine.refresh()
+    rng = iot_stream.parse_periodo(args.periodo) if args.periodo else None
+    start, end = rng if rng else (None, None)
+    out = analyze(engine, start, end, args.device, args.max_lag, args.window)
+    json.dump(out, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# iot_dataset.py
+#
+# Gerador offline de datasets IoT grandes e determinísticos (mesmo formato de
+# iot_simulator.simulate_readings), para testar relatórios, rollups e o
+# armazenamento colunar em escala: meses de leituras de dezenas/centenas de
+# dispositivos em segundos.
+#
+# Diferente do simulador (cada sensor sorteado de forma independente), aqui as
+# grandezas seguem um modelo simples e coerente:
+#   - ocupação com ciclo dia/noite (pico à tarde, madrugada ~25%, fim de semana menor);
+#   - CO₂ acompanha a ocupação com ~20 min de atraso;
+#   - temperatura segue a externa + carga térmica da ocupação, e o HVAC a derruba;
+#   - HVAC liga por temperatura ou por CO₂ alto (ventilação);
+#   - energia = base + ocupação + HVAC, com picos nas partidas do compressor;
+#   - O₂ cai quando o CO₂ sobe; energia total é acumulada por dispositivo.
+#
+# Com NumPy o gerador trabalha em blocos vetorizados (milhões de linhas/s para
+# o formato colunar); sem NumPy cai para Python puro com o mesmo modelo.
+# Mesma semente + mesmos parâmetros (incluindo --start, que tem padrão fixo,
+# DEFAULT_START) + mesmo backend => mesmo dataset. Os dois backends seguem o
+# mesmo modelo mas usam geradores aleatórios diferentes (numpy.random e
+# random.Random), então a mesma semente gera dados diferentes com e sem
+# NumPy; --pure-python força o backend Python puro para reproduzir um dataset
+# em qualquer máquina. A memória é limitada pelo tamanho do bloco
+# (--chunk-rows), não pelo tamanho do dataset.
+#
+# Uso:
+#   python iot_dataset.py --devices 50 --days 90 --out dataset.ndjson
+#   python iot_dataset.py --devices 20 --days 30 --format csv --out dataset.csv
+#   python iot_dataset.py --devices 200 --days 180 --format columnar --out ../public/iot/columnar_sint
+#   IOT_LOG_PATH=dataset.ndjson python iot_rollups.py update
+
+import sys
+import math
+import time
+import random
+import argparse
+from datetime import datetime, timezone
+
+import iot_stream
+
+_use_numpy = False
+try:
+    import numpy as np
+    _use_numpy = True
+except Exception:
+    np = None
+
+FORMATS = ("ndjson", "csv", "columnar")
+CSV_HEADER = "device_id,timestamp,temperature,humidity,oxygen,co2,energy_instant,energy_total,energy_peak\n"
+
+DEFAULT_CHUNK_ROWS = 262144
+DEFAULT_START = "2025-01-01"   # início fixo: o dataset não depende do dia em que é gerado
+TZ_OFFSET_S = -3 * 3600        # horário local (Brasília) para o ciclo de ocupação
+CO2_LAG_S = 20 * 60            # atraso do CO₂ em relação à ocupação
+CO2_OUTDOOR = 420.0
+
+# -------------------------
+# Modelo (funções do tempo, comuns aos dois backends)
+# -------------------------
+
+def _day_profile(hour):
+    """Ocupação relativa pela hora local: ~0,25 de madrugada, pico ~1,0 por volta das 13h."""
+    bump = math.sin(math.pi * (hour - 7.0) / 12.0)
+    return 0.25 + 0.75 * (bump if 7.0 <= hour <= 19.0 and bump > 0 else 0.0)
+
+def _weekday_factor(t):
+    local = t + TZ_OFFSET_S
+    weekday = (int(local // 86400) + 3) % 7  # 1970-01-01 foi quinta (segunda = 0)
+    return 0.6 if weekday >= 5 else 1.0
+
+def _hour(t):
+    return ((t + TZ_OFFSET_S) % 86400) / 3600.0
+
+def _outdoor_temp(hour):
+    return 22.0 + 5.0 * math.sin(2 * math.pi * (hour - 9.0) / 24.0)
+
+def _iso(t):
+    return datetime.fromtimestamp(t, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class DeviceParams:
+    """Características fixas de cada dispositivo/sala, sorteadas a partir da semente."""
+
+    def __init__(self, n, seed, prefix):
+        rnd = random.Random(seed)
+        self.ids = [f"{prefix}-{i + 1:04d}" for i in range(n)]
+        self.temp_offset = [rnd.gauss(0.0, 0.7) for _ in range(n)]
+        self.occ_scale = [rnd.uniform(0.6, 1.0) for _ in range(n)]
+        self.phase_s = [rnd.uniform(-45, 45) * 60 for _ in range(n)]   # salas "acordam" em horários diferentes
+        self.base_kw = [rnd.uniform(0.2, 0.5) for _ in range(n)]
+        self.hvac_kw = [rnd.uniform(1.2, 2.2) for _ in range(n)]
+
+# -------------------------
+# Backend NumPy (blocos vetorizados)
+# -------------------------
+
+def _np_profile(t):
+    hour = ((t + TZ_OFFSET_S) % 86400) / 3600.0
+    bump = np.sin(np.pi * (hour - 7.0) / 12.0)
+    prof = 0.25 + 0.75 * np.where((hour >= 7.0) & (hour <= 19.0), np.clip(bump, 0.0, None), 0.0)
+    weekday = (np.floor((t + TZ_OFFSET_S) / 86400).astype(np.int64) + 3) % 7
+    return prof * np.where(weekday >= 5, 0.6, 1.0)
+
+def _chunk_numpy(rng, times, dev, state):
+    """
+    Gera K passos x D dispositivos. 'times' (K,) em epoch; 'state' guarda o
+    que atravessa blocos (energia acumulada e HVAC do último passo).
+    Retorna colunas achatadas em ordem tempo-major (como o log real).
+    """
+    K, D = times.size, len(dev.ids)
+    t = times[:, None] + np.asarray(dev.phase_s)[None, :]
+    scale = np.asarray(dev.occ_scale)[None, :]
+
+    occ = np.clip(scale * _np_profile(t) + rng.normal(0.0, 0.05, (K, D)), 0.0, 1.0)
+    occ_lag = scale * _np_profile(t - CO2_LAG_S)
+    co2 = CO2_OUTDOOR + 1000.0 * occ_lag + rng.normal(0.0, 40.0, (K, D))
+
+    hour = ((times + TZ_OFFSET_S) % 86400) / 3600.0
+    outdoor = (22.0 + 5.0 * np.sin(2 * np.pi * (hour - 9.0) / 24.0))[:, None]
+    temp_free = 21.5 + 0.5 * (outdoor - 22.0) + 3.0 * occ + np.asarray(dev.temp_offset)[None, :]
+    hvac = np.clip(np.maximum((temp_free - 24.0) / 2.0, (co2 - 900.0) / 500.0), 0.0, 1.0)
+    temperature = temp_free - 2.2 * hvac + rng.normal(0.0, 0.25, (K, D))
+
+    humidity = np.clip(50.0 + 10.0 * occ - 12.0 * hvac + rng.normal(0.0, 3.0, (K, D)), 30, 70)
+    oxygen = np.clip(98.5 - (co2 - CO2_OUTDOOR) / 250.0 + rng.normal(0.0, 0.6, (K, D)), 88, 99)
+
+    hvac_kw = np.asarray(dev.hvac_kw)[None, :]
+    instant = (np.asarray(dev.base_kw)[None, :] + 0.8 * occ + hvac_kw * hvac
+               + np.abs(rng.normal(0.0, 0.08, (K, D))))
+    prev = np.vstack([state["hvac"][None, :], hvac[:-1]])
+    startup = np.clip(hvac - prev, 0.0, 1.0)
+    peak = instant + hvac_kw * (1.5 * startup + hvac * rng.uniform(0.0, 0.4, (K, D)))
+
+    dt_h = state["interval"] / 3600.0
+    total = state["total"][None, :] + np.cumsum(instant * dt_h, axis=0)
+    state["total"] = total[-1].copy()
+    state["hvac"] = hvac[-1].copy()
+
+    return {
+        "timestamp": np.repeat(times, D),
+        "device": np.tile(np.arange(D, dtype=np.uint32), K),
+        "temperature": np.round(temperature, 1).ravel(),
+        "humidity": np.rint(humidity).ravel(),
+        "oxygen": np.rint(oxygen).ravel(),
+        "co2": np.rint(np.maximum(co2, 350.0)).ravel(),
+        "energy_instant": np.round(instant, 2).ravel(),
+        "energy_total": np.round(total, 2).ravel(),
+        "energy_peak": np.round(peak, 2).ravel(),
+    }
+
+# -------------------------
+# Backend Python puro (mesmo modelo, linha a linha)
+# -------------------------
+
+def _chunk_python(rnd, times, dev, state):
+    D = len(dev.ids)
+    cols = {c: [] for c in ("timestamp", "device") + iot_stream.METRICS}
+    dt_h = state["interval"] / 3600.0
+    gauss, uniform = rnd.gauss, rnd.uniform
+    for t0 in times:
+        outdoor = _outdoor_temp(_hour(t0))
+        for d in range(D):
+            t = t0 + dev.phase_s[d]
+            scale = dev.occ_scale[d]
+            occ = min(1.0, max(0.0, scale * _day_profile(_hour(t)) * _weekday_factor(t) + gauss(0.0, 0.05)))
+            t_lag = t - CO2_LAG_S
+            co2 = CO2_OUTDOOR + 1000.0 * scale * _day_profile(_hour(t_lag)) * _weekday_factor(t_lag) + gauss(0.0, 40.0)
+
+            temp_free = 21.5 + 0.5 * (outdoor - 22.0) + 3.0 * occ + dev.temp_offset[d]
+            hvac = min(1.0, max(0.0, (temp_free - 24.0) / 2.0, (co2 - 900.0) / 500.0))
+            temperature = temp_free - 2.2 * hvac + gauss(0.0, 0.25)
+            humidity = min(70.0, max(30.0, 50.0 + 10.0 * occ - 12.0 * hvac + gauss(0.0, 3.0)))
+            oxygen = min(99.0, max(88.0, 98.5 - (co2 - CO2_OUTDOOR) / 250.0 + gauss(0.0, 0.6)))
+
+            instant = dev.base_kw[d] + 0.8 * occ + dev.hvac_kw[d] * hvac + abs(gauss(0.0, 0.08))
+            startup = min(1.0, max(0.0, hvac - state["hvac"][d]))
+            peak = instant + dev.hvac_kw[d] * (1.5 * startup + hvac * uniform(0.0, 0.4))
+            state["hvac"][d] = hvac
+            state["total"][d] += instant * dt_h
+
+            cols["timestamp"].append(float(t0))
+            cols["device"].append(d)
+            cols["temperature"].append(round(temperature, 1))
+            cols["humidity"].append(float(round(humidity)))
+            cols["oxygen"].append(float(round(oxygen)))
+            cols["co2"].append(float(round(max(co2, 350.0))))
+            cols["energy_instant"].append(round(instant, 2))
+            cols["energy_total"].append(round(state["total"][d], 2))
+            cols["energy_peak"].append(round(peak, 2))
+    return cols
+
+# -------------------------
+# Geração em blocos
+# -------------------------
+
+def generate(devices=10, days=30, interval=5.0, start=None, seed=42, prefix="simulator",
+             chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Itera sobre blocos {coluna: sequência} (ordem tempo-major) cobrindo
+    'days' dias a partir de 'start' (epoch; padrão: 00:00 UTC de DEFAULT_START).
+    Devolve também os parâmetros dos dispositivos como primeiro item: (dev, bloco...).
+    """
+    if start is None:
+        start = iot_stream.parse_periodo(DEFAULT_START)[0]
+    dev = DeviceParams(devices, seed, prefix)
+    steps = int(days * 86400 // interval)
+    per_chunk = max(1, chunk_rows // devices)
+    state = {"interval": interval}
+
+    if _use_numpy:
+        rng = np.random.default_rng(seed)
+        state["total"] = np.zeros(devices)
+        state["hvac"] = np.zeros(devices)
+    else:
+        rng = random.Random(seed)
+        state["total"] = [0.0] * devices
+        state["hvac"] = [0.0] * devices
+
+    yield dev
+    for k0 in range(0, steps, per_chunk):
+        k1 = min(steps, k0 + per_chunk)
+        if _use_numpy:
+            times = start + np.arange(k0, k1, dtype=np.float64) * interval
+            yield _chunk_numpy(rng, times, dev, state)
+        else:
+            times = [start + k * interval for k in range(k0, k1)]
+            yield _chunk_python(rng, times, dev, state)
+
+def _tolist(col):
+    return col.tolist() if _use_numpy else col
+
+# Formato igual ao de simulate_readings (inteiros para umidade, O₂ e CO₂)
+_NDJSON_ROW = ('{"device_id":"%s","timestamp":"%s","temperature":%r,"humidity":%d,"oxygen":%d,'
+               '"co2":%d,"energy":{"instant":%r,"total":%r,"peak":%r}}\n')
+_CSV_ROW = "%s,%s,%r,%d,%d,%d,%r,%r,%r\n"
+
+def _write_text(chunk, dev, out, row_fmt, iso_cache):
+    """Formata um bloco como texto; os timestamps ISO são calculados uma vez por instante."""
+    ts = _tolist(chunk["timestamp"])
+    ids = dev.ids
+    cols = [_tolist(chunk[m]) for m in ("temperature", "humidity", "oxygen", "co2",
+                                         "energy_instant", "energy_total", "energy_peak")]
+    lines = []
+    last_t, last_iso = None, None
+    for t, d, temp, hum, o2, co2, inst, tot, peak in zip(ts, _tolist(chunk["device"]), *cols):
+        if t != last_t:
+            last_t, last_iso = t, iso_cache(t)
+        lines.append(row_fmt % (ids[d], last_iso, temp, hum, o2, co2, inst, tot, peak))
+    out.write("".join(lines))
+
+def write_dataset(out_path, fmt="ndjson", **params):
+    """Gera e grava o dataset; retorna o número de linhas."""
+    gen = generate(**params)
+    dev = next(gen)
+    rows = 0
+    t0 = time.perf_counter()
+
+    def progress():
+        elapsed = time.perf_counter() - t0
+        print(f"[dataset] {rows:,} linhas ({rows / elapsed if elapsed else 0:,.0f}/s)",
+              file=sys.stderr, flush=True)
+
+    if fmt == "columnar":
+        from iot_columnar import ColumnarWriter
+        writer = ColumnarWriter(out_path, rebuild=True)
+        index = [writer.register_device(d) for d in dev.ids]
+        try:
+            for chunk in gen:
+                devices = chunk["device"]
+                if index != list(range(len(index))):
+                    devices = [index[d] for d in devices]
+                writer.append_block(chunk["timestamp"], devices,
+                                    {m: chunk[m] for m in iot_stream.METRICS})
+                rows += len(chunk["timestamp"])
+                progress()
+        finally:
+            writer.close()
+        return rows
+
+    row_fmt = _NDJSON_ROW if fmt == "ndjson" else _CSV_ROW
+    out = sys.stdout if out_path in (None, "-") else open(out_path, "w", encoding="utf-8", newline="")
+    try:
+        if fmt == "csv":
+            out.write(CSV_HEADER)
+        for chunk in gen:
+            _write_text(chunk, dev, out, row_fmt, _iso)
+            rows += len(chunk["timestamp"])
+            progress()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return rows
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerador determinístico de datasets IoT em massa")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--interval", type=float, default=5.0, help="segundos entre leituras (padrão 5)")
+    parser.add_argument("--start", default=DEFAULT_START,
+                        help=f"início (YYYY-MM-DD, UTC); padrão {DEFAULT_START}")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--prefix", default="simulator", help="prefixo dos device_id")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--out", default="-", help="arquivo (ndjson/csv; '-' = stdout) ou pasta (columnar)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS,
+                        help="linhas por bloco (limita a memória)")
+    parser.add_argument("--pure-python", action="store_true",
+                        help="usa o backend Python puro mesmo com NumPy instalado (mesmos dados em qualquer máquina)")
+    args = parser.parse_args()
+
+    global _use_numpy
+    if args.pure_python:
+        _use_numpy = False
+
+    if args.format == "columnar" and args.out in (None, "-"):
+        parser.error("--format columnar exige --out com uma pasta")
+    rng = iot_stream.parse_periodo(args.start)
+    if not rng:
+        parser.error(f"--start inválido: {args.start!r}")
+    start = rng[0]
+
+    t0 = time.perf_counter()
+    rows = write_dataset(args.out, args.format, devices=args.devices, days=args.days,
+                         interval=args.interval, start=start, seed=args.seed,
+                         prefix=args.prefix, chunk_rows=args.chunk_rows)
+    elapsed = time.perf_counter() - t0
+    print(f"[dataset] {rows:,} linhas em {elapsed:.2f} s ({rows / elapsed:,.0f} linhas/s) | "
+          f"{'numpy' if _use_numpy else 'python'} | início {_iso(start)} | semente {args.seed} | "
+          f"{args.format} -> {args.out}",
+          file=sys.stderr, flush=True)
+
+if __name__ == "__main__":
+    main()
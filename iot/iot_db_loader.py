@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+# iot_db_loader.py
+#
+# Carga em massa do histórico IoT (iot_log.json ou NDJSON) na tabela iot_log.
+#
+# O scripts/import_iot_log.php decodifica o log inteiro na memória e faz um
+# INSERT por leitura. Aqui:
+#   - o log é lido em streaming (iot_stream.iter_log_records), com memória
+#     limitada a um bloco de transação;
+#   - cada registro é validado e normalizado para os tipos do schema
+#     (DECIMAL/INT/DATETIME); lixo como {"teste": "ok"} vai para o log de
+#     erros no mesmo formato do importador PHP, em vez de virar linha;
+#   - as linhas saem em INSERTs de várias linhas (--batch por comando) dentro
+#     de transações de --chunk linhas, ou num TSV pronto para LOAD DATA;
+#   - o offset já importado é gravado NA MESMA transação das linhas (tabela
+#     iot_log_import), então uma carga interrompida retoma de onde parou sem
+#     duplicar nem perder leituras.
+#
+# O SQLite serve de substituto local do MySQL para testes (--sqlite); o MySQL
+# usa pymysql ou mysql-connector-python, se instalados.
+#
+# Uso:
+#   python iot_db_loader.py --sqlite /tmp/iot.db                 -> carrega o log padrão
+#   python iot_db_loader.py --mysql --database smart_hospital --user root
+#   python iot_db_loader.py --tsv /tmp/iot_log.tsv               -> arquivo para LOAD DATA
+#   python iot_db_loader.py --bench 100000                       -> por linha x em lote (SQLite)
+
+import os
+import sys
+import json
+import math
+import time
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timezone
+
+import iot_stream
+from iot_aggregates import LogCheckpoint, write_json_atomic
+
+DEFAULT_ERRORS_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "import_errors.log")
+)
+
+# Linhas por transação (um checkpoint por transação) e por comando INSERT
+DEFAULT_CHUNK_ROWS = 20000
+DEFAULT_BATCH_ROWS = 500
+
+COLUMNS = ("device_id", "ts") + iot_stream.METRICS + ("raw_json",)
+
+# Faixa e casas decimais das colunas numéricas do schema (smart_hospital.sql):
+# DECIMAL(p,s) aceita |v| < 10**(p-s). Em modo estrito o MySQL rejeita o
+# comando inteiro por um valor fora da faixa, por isso a checagem é feita aqui.
+_LIMITS = (
+    ("temperature", 1e3, 2),
+    ("humidity", 1e3, 2),
+    ("oxygen", 1e3, 2),
+    ("co2", 2 ** 31, 0),
+    ("energy_instant", 1e5, 3),
+    ("energy_total", 1e9, 3),
+    ("energy_peak", 1e5, 3),
+)
+
+DEVICE_ID_MAX = 100
+
+# raw_json compacto e sem escapar acentos (JSON_UNESCAPED_UNICODE do PHP);
+# um encoder reaproveitado evita recriá-lo a cada json.dumps
+_encode_raw = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS iot_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id VARCHAR(100),
+    ts DATETIME NOT NULL,
+    temperature DECIMAL(5,2),
+    humidity DECIMAL(5,2),
+    oxygen DECIMAL(5,2),
+    co2 INTEGER,
+    energy_instant DECIMAL(8,3),
+    energy_total DECIMAL(12,3),
+    energy_peak DECIMAL(8,3),
+    raw_json TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Mesma definição nos dois bancos; uma linha por arquivo de origem
+CHECKPOINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS iot_log_import (
+    source VARCHAR(255) PRIMARY KEY,
+    byte_offset BIGINT NOT NULL,
+    head CHAR(40),
+    tail CHAR(40),
+    rows_loaded BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+class LoaderError(Exception):
+    """Situação que impede a carga (log reescrito, driver ausente...)."""
+
+# -------------------------
+# Validação e normalização
+# -------------------------
+
+def _show(raw):
+    """Valor no log de erros, no estilo do var_export do PHP para null."""
+    if raw is None:
+        return "NULL"
+    return json.dumps(raw, ensure_ascii=False)
+
+def normalize(rec):
+    """
+    Converte um registro do log numa linha de iot_log (tupla na ordem de COLUMNS).
+    Retorna (linha, None) ou (None, motivo) quando o registro deve ser ignorado.
+    O timestamp vem de timestamp/time/ts, como no importador PHP, e é gravado
+    como DATETIME em UTC.
+    """
+    if not isinstance(rec, dict):
+        return None, f"registro não é objeto -> {_show(rec)}"
+
+    raw_ts = rec.get("timestamp")
+    if raw_ts is None:
+        raw_ts = rec.get("time")
+        if raw_ts is None:
+            raw_ts = rec.get("ts")
+    ts = iot_stream.parse_timestamp(raw_ts)
+    if ts is None:
+        return None, f"timestamp inválido -> {_show(raw_ts)}"
+    if isinstance(raw_ts, str) and raw_ts.endswith("Z") and raw_ts[10:11] == "T":
+        # caso comum (simulador): ISO em UTC, basta recortar "AAAA-MM-DD HH:MM:SS"
+        ts_sql = raw_ts[:10] + " " + raw_ts[11:19]
+    else:
+        try:
+            ts_sql = datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        except (OverflowError, OSError, ValueError):
+            return None, f"timestamp fora da faixa -> {_show(raw_ts)}"
+
+    device = rec.get("device_id")
+    if device is not None:
+        device = str(device)
+        if len(device) > DEVICE_ID_MAX:
+            return None, f"device_id com mais de {DEVICE_ID_MAX} caracteres -> {_show(device)}"
+
+    values = iot_stream.reading_values(rec)
+    row = [device, ts_sql]
+    found = False
+    for metric, limit, places in _LIMITS:
+        v = values[metric]
+        if v is not None:
+            # arredonda antes de checar (999.996 vira 1000.00, que não cabe em
+            # DECIMAL(5,2)); NaN/inf não arredondam e abs(nan) < limit é falso
+            if math.isfinite(v):
+                v = int(round(v)) if places == 0 else round(v, places)
+            if not abs(v) < limit:
+                return None, f"{metric} fora da faixa -> {_show(rec.get(metric, v))}"
+            found = True
+        row.append(v)
+    if not found:
+        return None, "sem métricas numéricas"
+
+    row.append(_encode_raw(rec))
+    return tuple(row), None
+
+# -------------------------
+# Destinos
+# -------------------------
+
+class SQLSink:
+    """
+    INSERTs de várias linhas numa conexão DB-API (sqlite3, pymysql,
+    mysql.connector). commit() grava o checkpoint e as linhas na mesma transação.
+    """
+
+    def __init__(self, conn, param="?", batch_rows=DEFAULT_BATCH_ROWS, max_params=None):
+        self.conn = conn
+        self.param = param
+        if max_params:
+            batch_rows = max(1, min(batch_rows, max_params // len(COLUMNS)))
+        self.batch_rows = batch_rows
+        self._stmts = {}
+        cur = conn.cursor()
+        cur.execute(CHECKPOINT_SCHEMA)
+        cur.close()
+        conn.commit()
+
+    def _stmt(self, n):
+        sql = self._stmts.get(n)
+        if sql is None:
+            one = "(" + ",".join([self.param] * len(COLUMNS)) + ")"
+            sql = f"INSERT INTO iot_log ({', '.join(COLUMNS)}) VALUES " + ",".join([one] * n)
+            self._stmts[n] = sql
+        return sql
+
+    def load_checkpoint(self, source):
+        cur = self.conn.cursor()
+        cur.execute("SELECT byte_offset, head, tail, rows_loaded FROM iot_log_import "
+                    f"WHERE source = {self.param}", (source,))
+        row = cur.fetchone()
+        cur.close()
+        if row is None:
+            return LogCheckpoint(), 0
+        return LogCheckpoint(int(row[0]), row[1], row[2]), int(row[3])
+
+    def write(self, rows):
+        cur = self.conn.cursor()
+        step = self.batch_rows
+        for i in range(0, len(rows), step):
+            part = rows[i:i + step]
+            cur.execute(self._stmt(len(part)), [v for row in part for v in row])
+        cur.close()
+
+    def commit(self, source, checkpoint, rows_loaded):
+        p = self.param
+        cur = self.conn.cursor()
+        cur.execute(f"DELETE FROM iot_log_import WHERE source = {p}", (source,))
+        cur.execute("INSERT INTO iot_log_import (source, byte_offset, head, tail, rows_loaded) "
+                    f"VALUES ({p}, {p}, {p}, {p}, {p})",
+                    (source, checkpoint.offset, checkpoint.head, checkpoint.tail, rows_loaded))
+        cur.close()
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def _tsv_field(v):
+    if v is None:
+        return "\\N"
+    if isinstance(v, str):
+        return (v.replace("\\", "\\\\").replace("\t", "\\t")
+                 .replace("\n", "\\n").replace("\r", "\\r"))
+    return repr(v)
+
+class TSVSink:
+    """
+    Arquivo TSV para LOAD DATA (NULL como \\N, escapes com barra invertida).
+    O checkpoint fica ao lado (<arquivo>.checkpoint.json) com o tamanho do TSV
+    já confirmado: ao retomar, o que passou disso (carga interrompida no meio
+    de um bloco) é truncado antes de continuar.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.checkpoint_path = path + ".checkpoint.json"
+        self._file = None
+
+    def load_checkpoint(self, source):
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        if not state or state.get("source") != source:
+            self._file = open(self.path, "wb")
+            return LogCheckpoint(), 0
+        self._file = open(self.path, "r+b" if os.path.exists(self.path) else "wb")
+        self._file.truncate(state.get("tsv_bytes", 0))
+        self._file.seek(0, os.SEEK_END)
+        return LogCheckpoint.from_dict(state), state.get("rows_loaded", 0)
+
+    def write(self, rows):
+        data = "".join("\t".join(map(_tsv_field, row)) + "\n" for row in rows)
+        self._file.write(data.encode("utf-8"))
+
+    def commit(self, source, checkpoint, rows_loaded):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        state = checkpoint.to_dict()
+        state.update(source=source, rows_loaded=rows_loaded, tsv_bytes=self._file.tell())
+        if not write_json_atomic(self.checkpoint_path, state):
+            raise LoaderError(f"não foi possível gravar {self.checkpoint_path}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def load_data_sql(self):
+        return (f"LOAD DATA LOCAL INFILE '{os.path.abspath(self.path)}' INTO TABLE iot_log "
+                "CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+                f"LINES TERMINATED BY '\\n' ({', '.join(COLUMNS)});")
+
+def connect_sqlite(path, batch_rows=DEFAULT_BATCH_ROWS):
+    """Abre (e cria, se preciso) um banco SQLite com o schema de iot_log."""
+    conn = sqlite3.connect(path)
+    conn.execute(SQLITE_SCHEMA)
+    conn.commit()
+    # Limite de parâmetros por comando: 32766 a partir do 3.32, 999 antes
+    max_params = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+    return SQLSink(conn, "?", batch_rows, max_params)
+
+def connect_mysql(host="localhost", user="root", password="", database="smart_hospital",
+                  port=3306, batch_rows=DEFAULT_BATCH_ROWS):
+    """Conecta ao MySQL (mesmos padrões de App/Connection.php) via pymysql ou mysql.connector."""
+    try:
+        import pymysql
+        conn = pymysql.connect(host=host, user=user, password=password, database=database,
+                               port=port, charset="utf8mb4", autocommit=False)
+    except ImportError:
+        try:
+            import mysql.connector
+        except ImportError:
+            raise LoaderError("instale pymysql ou mysql-connector-python para usar --mysql")
+        conn = mysql.connector.connect(host=host, user=user, password=password, database=database,
+                                       port=port, charset="utf8mb4", autocommit=False)
+    return SQLSink(conn, "%s", batch_rows)
+
+# -------------------------
+# Carga
+# -------------------------
+
+def load(log_path, sink, chunk_rows=DEFAULT_CHUNK_ROWS, errors_path=DEFAULT_ERRORS_PATH,
+         restart=False, verbose=True):
+    """
+    Carrega o log no destino a partir do checkpoint. Retorna um resumo.
+    Levanta LoaderError se o log foi reescrito desde a última carga (retomar
+    duplicaria ou perderia linhas); restart=True ignora o checkpoint.
+    """
+    source = os.path.abspath(log_path)
+    if not os.path.exists(log_path):
+        raise LoaderError(f"arquivo não encontrado: {log_path}")
+    checkpoint, loaded = sink.load_checkpoint(source)
+    if restart:
+        checkpoint, loaded = LogCheckpoint(), 0
+    elif not checkpoint.is_valid(log_path):
+        raise LoaderError("o log foi reescrito desde a última importação; "
+                          "use --restart (as linhas já importadas não são apagadas)")
+
+    # Carga nova começa com log de erros limpo, como o importador PHP
+    errlog = open(errors_path, "a" if checkpoint.offset else "w", encoding="utf-8")
+    inserted = skipped = commits = 0
+    pending = []
+    offset = checkpoint.offset
+    t0 = time.perf_counter()
+
+    def flush():
+        nonlocal inserted, loaded, commits
+        if pending:
+            sink.write(pending)
+        errlog.flush()
+        checkpoint.advance(log_path, offset)
+        sink.commit(source, checkpoint, loaded + len(pending))
+        inserted += len(pending)
+        loaded += len(pending)
+        commits += 1
+        pending.clear()
+        if verbose:
+            elapsed = time.perf_counter() - t0
+            print(f"[loader] commit: {inserted:,} linhas ({inserted / elapsed if elapsed else 0:,.0f}/s), "
+                  f"{skipped} ignoradas, offset {offset:,}", file=sys.stderr, flush=True)
+
+    try:
+        for rec, end in iot_stream.iter_log_records(log_path, offset=checkpoint.offset):
+            row, why = normalize(rec)
+            if row is None:
+                skipped += 1
+                stamp = datetime.now().astimezone().isoformat(timespec="seconds")
+                errlog.write(f"[{stamp}] offset {offset}: {why}\n")
+            else:
+                pending.append(row)
+            offset = end
+            if len(pending) >= chunk_rows:
+                flush()
+        if offset != checkpoint.offset or pending:
+            flush()
+    except BaseException:
+        rollback = getattr(getattr(sink, "conn", None), "rollback", None)
+        if rollback is not None:
+            rollback()
+        raise
+    finally:
+        errlog.close()
+
+    elapsed = time.perf_counter() - t0
+    return {
+        "inseridos": inserted,
+        "ignorados": skipped,
+        "total_importado": loaded,
+        "transacoes": commits,
+        "offset": offset,
+        "segundos": round(elapsed, 3),
+        "linhas_por_s": round(inserted / elapsed) if elapsed and inserted else None,
+    }
+
+# -------------------------
+# Benchmark (SQLite)
+# -------------------------
+
+def _insert_per_row(rows, db_path, commit_every):
+    """
+    Referência: o padrão do import_iot_log.php, um INSERT preparado por leitura
+    e commit a cada commit_every linhas (1 = autocommit).
+    """
+    conn = sqlite3.connect(db_path)
+    conn.execute(SQLITE_SCHEMA)
+    conn.commit()
+    sql = (f"INSERT INTO iot_log ({', '.join(COLUMNS)}) "
+           f"VALUES ({', '.join('?' * len(COLUMNS))})")
+    t0 = time.perf_counter()
+    for i, row in enumerate(rows, 1):
+        conn.execute(sql, row)
+        if i % commit_every == 0:
+            conn.commit()
+    conn.commit()
+    elapsed = time.perf_counter() - t0
+    conn.close()
+    return len(rows) / elapsed
+
+def _insert_batched(rows, db_path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    sink = connect_sqlite(db_path)
+    cp = LogCheckpoint()
+    t0 = time.perf_counter()
+    for i in range(0, len(rows), chunk_rows):
+        sink.write(rows[i:i + chunk_rows])
+        sink.commit("bench", cp, i)
+    elapsed = time.perf_counter() - t0
+    sink.close()
+    return len(rows) / elapsed
+
+def bench(rows=100000, autocommit_rows=2000):
+    """
+    Compara no SQLite (arquivo em disco, synchronous padrão) só a fase de
+    gravação, com as mesmas linhas já normalizadas:
+      - por linha com autocommit (um fsync por leitura), numa amostra menor;
+      - por linha com commit a cada 500 (o importador PHP);
+      - INSERT multi-linha em transações de DEFAULT_CHUNK_ROWS (o carregador).
+    E mede também a carga completa (leitura + normalização + gravação).
+    """
+    from iot_dataset import write_dataset
+
+    devices = 10
+    interval = 60.0
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, "log.ndjson")
+        write_dataset(log_path, "ndjson", devices=devices, interval=interval,
+                      days=rows * interval / (devices * 86400.0))
+        data = [normalize(rec)[0] for rec, _ in iot_stream.iter_log_records(log_path)]
+        data = [row for row in data if row is not None]
+
+        autocommit = _insert_per_row(data[:autocommit_rows], os.path.join(tmp, "a.db"), 1)
+        per_row = _insert_per_row(data, os.path.join(tmp, "b.db"), DEFAULT_BATCH_ROWS)
+        batched = _insert_batched(data, os.path.join(tmp, "c.db"))
+
+        sink = connect_sqlite(os.path.join(tmp, "d.db"))
+        try:
+            res = load(log_path, sink, errors_path=os.path.join(tmp, "erros.log"), verbose=False)
+        finally:
+            sink.close()
+
+    return {
+        "linhas": len(data),
+        "gravacao_linhas_por_s": {
+            "por_linha_autocommit": round(autocommit),
+            "por_linha_commit_500": round(per_row),
+            "multi_linha_em_lote": round(batched),
+        },
+        "ganho_vs_autocommit": round(batched / autocommit, 1),
+        "ganho_vs_commit_500": round(batched / per_row, 1),
+        "carga_completa_linhas_por_s": res["linhas_por_s"],
+    }
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga em massa do log IoT na tabela iot_log")
+    parser.add_argument("--log", default=iot_stream.DEFAULT_LOG_PATH,
+                        help="log de origem (array JSON ou NDJSON; padrão public/iot/iot_log.json)")
+    dest = parser.add_mutually_exclusive_group()
+    dest.add_argument("--sqlite", metavar="ARQUIVO", help="carrega num banco SQLite (criado se preciso)")
+    dest.add_argument("--mysql", action="store_true", help="carrega no MySQL (pymysql ou mysql.connector)")
+    dest.add_argument("--tsv", metavar="ARQUIVO", help="gera um TSV para LOAD DATA em vez de inserir")
+    dest.add_argument("--bench", type=int, metavar="LINHAS",
+                      help="compara INSERT por linha x carregador no SQLite com N leituras sintéticas")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--database", default="smart_hospital")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK_ROWS,
+                        help=f"linhas por transação/checkpoint (padrão {DEFAULT_CHUNK_ROWS})")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH_ROWS,
+                        help=f"linhas por comando INSERT (padrão {DEFAULT_BATCH_ROWS})")
+    parser.add_argument("--errors", default=DEFAULT_ERRORS_PATH,
+                        help="log de registros ignorados (padrão scripts/import_errors.log)")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignora o checkpoint e importa desde o início do log")
+    args = parser.parse_args()
+
+    if args.bench:
+        print(json.dumps(bench(args.bench), ensure_ascii=False, indent=2))
+        return
+    if not (args.sqlite or args.mysql or args.tsv):
+        parser.error("escolha um destino: --sqlite, --mysql ou --tsv")
+
+    try:
+        if args.sqlite:
+            sink = connect_sqlite(args.sqlite, args.batch)
+        elif args.mysql:
+            sink = connect_mysql(args.host, args.user, args.password, args.database,
+                                 args.port, args.batch)
+        else:
+            sink = TSVSink(args.tsv)
+        try:
+            result = load(args.log, sink, args.chunk, args.errors, args.restart)
+        finally:
+            sink.close()
+    except LoaderError as e:
+        print(f"[loader] erro: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(json.dumps(result, ensure_ascii=False))
+    if args.tsv:
+        print(sink.load_data_sql(), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+# iot_outbox.py
+#
+# Fila de saída (outbox) em disco para o simulador / dispositivos de borda.
+#
+# Sem ela, send_payload perde a leitura a cada falha de rede e o laço
+# principal fica preso até o timeout (6 s) quando o endpoint está lento. Com
+# ela, gerar e enviar ficam desacoplados:
+#   - add() só acrescenta a leitura (uma linha JSON) ao segmento atual de um
+#     spool append-only e retorna; nada de rede nem de fsync no caminho do
+#     gerador (no modo frota, add() roda no laço asyncio). O fsync periódico
+#     e o dos segmentos fechados ficam com a thread do sender (sync());
+#   - um OutboxSender (thread) drena o spool em lotes: o tamanho do lote
+#     dobra enquanto as respostas chegam rápido e encolhe quando ficam lentas
+#     ou falham; falhas seguidas esperam um backoff exponencial com jitter.
+#     Depois de uma queda, o acúmulo sai em lotes grandes, na velocidade
+#     máxima que o endpoint aguenta;
+#   - respostas 4xx (exceto 408 e 429) são definitivas: repetir não adianta
+#     e travaria a fila. O lote é dividido ao meio até isolar a leitura
+#     recusada, que vai para dead-letter.ndjson no spool, e o cursor segue;
+#   - o cursor (até onde o servidor já confirmou) fica em cursor.json e só
+#     avança depois da resposta 2xx: entrega "pelo menos uma vez" — uma queda
+#     entre o envio e a gravação do cursor reenvia aquele lote;
+#   - o spool tem teto de tamanho: ao passar dele, os segmentos mais antigos
+#     são descartados primeiro (dados velhos valem menos que os novos), e as
+#     leituras perdidas são contadas.
+#
+# Uso (pelo simulador):
+#   python iot_simulator.py --outbox ../public/iot/outbox
+#   python iot_simulator.py --devices 500 --interval 1 --outbox /tmp/outbox --outbox-max-mb 256
+# Estado de um spool (só leitura; pode rodar com o simulador gravando):
+#   python iot_outbox.py /tmp/outbox
+
+import os
+import sys
+import json
+import gzip
+import time
+import random
+import argparse
+import threading
+
+from iot_aggregates import write_json_atomic
+
+DEFAULT_MAX_MB = 128
+DEFAULT_SEGMENT_MB = 4
+# Intervalo máximo entre fsyncs do segmento atual (perda máxima numa queda de energia)
+DEFAULT_FSYNC_MS = 1000
+
+SEGMENT_PREFIX = "outbox-"
+SEGMENT_SUFFIX = ".ndjson"
+CURSOR_NAME = "cursor.json"
+DEAD_LETTER_NAME = "dead-letter.ndjson"
+
+# 4xx que valem nova tentativa (timeout do servidor, limite de taxa)
+RETRYABLE_4XX = (408, 429)
+
+# Lote adaptativo e backoff do sender
+MIN_BATCH = 1
+MAX_BATCH = 500
+START_BATCH = 50
+TARGET_LATENCY_S = 1.0
+BASE_BACKOFF_S = 0.5
+MAX_BACKOFF_S = 60.0
+
+def _seq_of(name):
+    return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+def _list_segments(spool_dir):
+    """[(seq, caminho)] dos segmentos do spool, do mais antigo ao atual."""
+    return [(_seq_of(name), os.path.join(spool_dir, name))
+            for name in sorted(os.listdir(spool_dir))
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)]
+
+def _read_cursor(spool_dir):
+    """Cursor = (seq do segmento, offset em bytes, linhas já consumidas nele), ou None."""
+    try:
+        with open(os.path.join(spool_dir, CURSOR_NAME), "r", encoding="utf-8") as f:
+            c = json.load(f)
+        return (int(c["seq"]), int(c["offset"]), int(c["linhas"]))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _fsync_path(path):
+    """fsync de um arquivo pelo caminho (o fsync vale para o arquivo, não para o descritor)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # segmento já consumido e apagado
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def http_status(error):
+    """Status HTTP de uma exceção de post (urllib HTTPError ou requests), ou None."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(error, "response", None)
+    code = getattr(response, "status_code", None)
+    return code if isinstance(code, int) else None
+
+def is_poison(error):
+    """True se o servidor recusou o conteúdo em definitivo (4xx exceto 408/429)."""
+    status = http_status(error)
+    return status is not None and 400 <= status < 500 and status not in RETRYABLE_4XX
+
+class Outbox:
+    """
+    Spool append-only em segmentos NDJSON com cursor de consumo.
+    - add(leitura): grava e retorna (mesma interface de Batcher.add);
+    - peek(n) -> (linhas, cursor): até n leituras a partir do cursor;
+    - commit(cursor): confirma o que foi enviado (apaga segmentos consumidos);
+    - reject(linhas, cursor): grava as linhas recusadas em dead-letter e confirma;
+    - sync(): fsync, cursor e remoções pendentes, chamado pelo consumidor;
+      add() nunca espera o disco: peek/commit leem e apagam fora do lock;
+    - stats(): profundidade da fila, bytes, descartes.
+    Seguro para um produtor e um consumidor em threads diferentes.
+    """
+
+    def __init__(self, spool_dir, max_bytes=DEFAULT_MAX_MB << 20, segment_bytes=None,
+                 fsync_ms=DEFAULT_FSYNC_MS):
+        self.spool_dir = spool_dir
+        self.max_bytes = max_bytes
+        # pelo menos 4 segmentos cabem no teto, para o descarte ser gradual
+        self.segment_bytes = min(segment_bytes or DEFAULT_SEGMENT_MB << 20, max(1, max_bytes // 4))
+        self.fsync_s = fsync_ms / 1000.0 if fsync_ms is not None else None
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._cursor_lock = threading.Lock()    # serializa as gravações de cursor.json
+        os.makedirs(spool_dir, exist_ok=True)
+
+        self.appended = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._unsynced = []     # segmentos fechados ainda sem fsync
+        self._garbage = []      # segmentos fora da fila, a apagar fora do lock
+        self._cursor_dirty = False
+        # [seq, caminho, bytes, linhas], do mais antigo ao atual
+        self._segments = [[seq, path, 0, 0] for seq, path in _list_segments(spool_dir)]
+        self._cursor = _read_cursor(spool_dir)
+        self._open_active()
+        self._last_fsync = time.monotonic()
+
+    # ---- estado em disco ----
+
+    def _open_active(self):
+        if not self._segments:
+            self._new_segment(1)
+        else:
+            # uma linha gravada pela metade (processo morto no meio do write) é cortada
+            last = self._segments[-1]
+            with open(last[1], "r+b") as f:
+                data = f.read()
+                cut = data.rfind(b"\n") + 1
+                if cut < len(data):
+                    f.truncate(cut)
+            self._file = open(last[1], "ab")
+        for seg in self._segments:
+            with open(seg[1], "rb") as f:
+                data = f.read()
+            seg[2], seg[3] = len(data), data.count(b"\n")
+
+        first = self._segments[0]
+        c = self._cursor
+        if c is None or c[0] < first[0]:
+            self._cursor = (first[0], 0, 0)     # segmento do cursor foi descartado
+        else:
+            seg = self._find(c[0])
+            if seg is None or c[1] > seg[2]:
+                self._cursor = (first[0], 0, 0)
+
+    def _new_segment(self, seq):
+        path = os.path.join(self.spool_dir, f"{SEGMENT_PREFIX}{seq:08d}{SEGMENT_SUFFIX}")
+        self._file = open(path, "ab")
+        self._segments.append([seq, path, 0, 0])
+
+    def _find(self, seq):
+        for seg in self._segments:
+            if seg[0] == seq:
+                return seg
+        return None
+
+    def _persist_cursor(self):
+        """Grava o cursor atual (fora do lock da fila; sempre o valor mais recente)."""
+        with self._cursor_lock:
+            with self._lock:
+                self._cursor_dirty = False
+                seq, offset, lines = self._cursor
+            write_json_atomic(os.path.join(self.spool_dir, CURSOR_NAME),
+                              {"seq": seq, "offset": offset, "linhas": lines})
+
+    def _collect(self):
+        """Apaga os segmentos que já saíram da fila."""
+        with self._lock:
+            paths, self._garbage = self._garbage, []
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # ---- produtor ----
+
+    def add(self, reading):
+        line = json.dumps(reading, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            active = self._segments[-1]
+            active[2] += len(line)
+            active[3] += 1
+            self.appended += 1
+            if active[2] >= self.segment_bytes:
+                self._file.close()
+                self._unsynced.append(active[1])
+                self._new_segment(active[0] + 1)
+            self._enforce_cap()
+            self._ready.notify()
+
+    def sync(self, force=False):
+        """
+        fsync dos segmentos fechados e, a cada fsync_ms (ou com force), do atual.
+        O fsync roda fora do lock, então add() não espera o disco.
+        """
+        now = time.monotonic()
+        with self._lock:
+            paths, self._unsynced = self._unsynced, []
+            due = force or (self.fsync_s is not None and now - self._last_fsync >= self.fsync_s)
+            if due:
+                paths.append(self._segments[-1][1])
+                self._last_fsync = now
+        for path in paths:
+            _fsync_path(path)
+        if self._cursor_dirty:
+            self._persist_cursor()
+        self._collect()
+
+    def _enforce_cap(self):
+        """
+        Descarta os segmentos mais antigos enquanto o spool passar do teto.
+        Chamado com o lock: o cursor novo e os arquivos a apagar ficam para sync().
+        """
+        while len(self._segments) > 1 and sum(s[2] for s in self._segments) > self.max_bytes:
+            seq, path, _, lines = self._segments.pop(0)
+            if self._cursor[0] == seq:
+                lines -= self._cursor[2]
+            if self._cursor[0] <= seq:
+                self.dropped += lines
+                self._cursor = (self._segments[0][0], 0, 0)
+                self._cursor_dirty = True
+            self._garbage.append(path)
+
+    # ---- consumidor ----
+
+    def peek(self, max_items):
+        """
+        Até max_items linhas a partir do cursor, e o cursor logo após elas.
+        Os tamanhos são lidos com o lock; os arquivos, fora dele (só até
+        esses tamanhos, então uma linha sendo gravada nunca aparece).
+        """
+        with self._lock:
+            seq, offset, consumed = self._cursor
+            segments = [(s[0], s[1], s[2]) for s in self._segments if s[0] >= seq]
+
+        out = []
+        for s_seq, path, size in segments:
+            if s_seq > seq:
+                seq, offset, consumed = s_seq, 0, 0
+            if offset >= size:
+                continue
+            try:
+                f = open(path, "rb")
+            except OSError:
+                continue  # descartado pelo teto enquanto isso; commit() ignora o cursor antigo
+            with f:
+                f.seek(offset)
+                while len(out) < max_items and offset < size:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break
+                    out.append(line)
+                    offset += len(line)
+                    consumed += 1
+            if len(out) >= max_items:
+                break
+        return out, (seq, offset, consumed)
+
+    def commit(self, cursor):
+        """Confirma o envio até 'cursor' e apaga os segmentos totalmente consumidos."""
+        with self._lock:
+            if cursor[:2] <= self._cursor[:2]:
+                return  # o descarte por teto já passou deste ponto
+            self._cursor = cursor
+            while len(self._segments) > 1 and self._segments[0][0] < cursor[0]:
+                self._garbage.append(self._segments.pop(0)[1])
+        # cursor antes de apagar: uma queda no meio reenvia, mas não aponta para o nada
+        self._persist_cursor()
+        self._collect()
+
+    def reject(self, lines, cursor):
+        """Grava 'lines' (recusadas pelo servidor) em dead-letter.ndjson e confirma até 'cursor'."""
+        with open(os.path.join(self.spool_dir, DEAD_LETTER_NAME), "ab") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            self.rejected += len(lines)
+        self.commit(cursor)
+
+    def _depth(self):
+        seq, _, consumed = self._cursor
+        return sum(s[3] for s in self._segments if s[0] >= seq) - consumed
+
+    def _pending_bytes(self):
+        seq, offset, _ = self._cursor
+        return sum(s[2] for s in self._segments if s[0] >= seq) - offset
+
+    def depth(self):
+        """Leituras ainda não confirmadas."""
+        with self._lock:
+            return self._depth()
+
+    def wait(self, timeout):
+        """Espera até haver leituras pendentes (ou o timeout)."""
+        with self._ready:
+            if self._depth() == 0:
+                self._ready.wait(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "fila": self._depth(),
+                "bytes_fila": self._pending_bytes(),
+                "bytes": sum(s[2] for s in self._segments),
+                "segmentos": len(self._segments),
+                "gravadas": self.appended,
+                "descartadas": self.dropped,
+                "rejeitadas": self.rejected,
+            }
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        if self._cursor_dirty:
+            self._persist_cursor()
+        self._collect()
+
+def spool_stats(spool_dir):
+    """
+    Estado de um spool sem abri-lo para escrita (nada é cortado nem criado),
+    seguro com o simulador gravando: uma linha pela metade não é contada.
+    """
+    segments = []
+    for seq, path in _list_segments(spool_dir):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            continue  # consumido e apagado durante a leitura
+        cut = data.rfind(b"\n") + 1
+        segments.append((seq, cut, data.count(b"\n")))
+
+    rejected = 0
+    try:
+        with open(os.path.join(spool_dir, DEAD_LETTER_NAME), "rb") as f:
+            rejected = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 16), b""))
+    except OSError:
+        pass
+
+    c = _read_cursor(spool_dir)
+    if segments and (c is None or not any(s[0] == c[0] and c[1] <= s[1] for s in segments)):
+        c = (segments[0][0], 0, 0)      # mesmo critério de Outbox ao abrir
+    seq, offset, consumed = c or (0, 0, 0)
+    return {
+        "fila": sum(s[2] for s in segments if s[0] >= seq) - consumed,
+        "bytes_fila": sum(s[1] for s in segments if s[0] >= seq) - offset,
+        "bytes": sum(s[1] for s in segments),
+        "segmentos": len(segments),
+        "rejeitadas": rejected,
+    }
+
+# -------------------------
+# Envio
+# -------------------------
+
+def encode_lines(lines, fmt="json", use_gzip=False):
+    """Corpo da requisição a partir das linhas do spool, sem decodificar o JSON."""
+    if fmt == "ndjson":
+        body = b"".join(lines)
+        headers = {"Content-Type": "application/x-ndjson"}
+    else:
+        body = b"[" + b",".join(line.rstrip(b"\n") for line in lines) + b"]"
+        headers = {"Content-Type": "application/json"}
+    if use_gzip:
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+class OutboxSender:
+    """
+    Thread que drena um Outbox com post(corpo, headers) (ex.: iot_simulator.post_body).
+    - Lote adaptativo: dobra enquanto a resposta leva menos que target_latency
+      e o lote saiu cheio; encolhe na proporção quando fica lento; cai pela
+      metade a cada falha.
+    - Falhas seguidas esperam min(max_backoff, base * 2^(falhas-1)), com
+      jitter de 50–100% para vários dispositivos não voltarem juntos.
+    - Recusa definitiva (is_poison) não é falha: o próximo lote tem metade
+      do tamanho, até uma leitura só, que vai para dead-letter (Outbox.reject).
+    - Também faz o fsync periódico do spool (Outbox.sync) entre os envios.
+    - stats (opcional, SendStats do simulador) recebe cada envio/erro.
+    """
+
+    def __init__(self, outbox, post, fmt="json", use_gzip=False, stats=None,
+                 min_batch=MIN_BATCH, max_batch=MAX_BATCH, target_latency=TARGET_LATENCY_S,
+                 base_backoff=BASE_BACKOFF_S, max_backoff=MAX_BACKOFF_S):
+        self.outbox = outbox
+        self.post = post
+        self.fmt = fmt
+        self.use_gzip = use_gzip
+        self.stats = stats
+        self.min_batch = max(1, min_batch)
+        self.max_batch = max(self.min_batch, max_batch)
+        self.batch = min(max(START_BATCH, self.min_batch), self.max_batch)
+        self.target_latency = target_latency
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.sent = 0
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0       # falhas seguidas
+        self.backoff = 0.0
+        self.last_error = None
+        self._split = None      # teto do lote enquanto isola uma leitura recusada...
+        self._split_end = None  # ...até o cursor passar do fim do lote recusado
+        self._retry_at = 0.0
+        self._last_sent = 0
+        self._last_t = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="outbox-sender", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        # espera em passos de fsync_ms para o fsync periódico não parar durante o backoff
+        tick = min(0.5, self.outbox.fsync_s or 0.5)
+        while not self._stop.is_set():
+            self.outbox.sync()
+            if self.failures:
+                remaining = self._retry_at - time.monotonic()
+                if remaining > 0:
+                    self._stop.wait(min(remaining, tick))
+                    continue
+            if not self.send_once() and not self.failures:
+                self.outbox.wait(tick)
+
+    def send_once(self):
+        """Envia um lote. True se enviou algo; False se a fila estava vazia ou falhou."""
+        lines, cursor = self.outbox.peek(min(self.batch, self._split or self.batch))
+        if not lines:
+            return False
+        body, headers = encode_lines(lines, self.fmt, self.use_gzip)
+        t0 = time.perf_counter()
+        try:
+            self.post(body, headers)
+        except Exception as e:
+            self.errors += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            if self.stats is not None:
+                self.stats.record_error(e)
+            if is_poison(e):
+                # repetir o mesmo lote daria a mesma resposta: divide até isolar a leitura
+                if len(lines) > 1:
+                    self._split = len(lines) // 2
+                    if self._split_end is None:
+                        self._split_end = cursor
+                else:
+                    self.outbox.reject(lines, cursor)
+                    self._end_split(cursor)
+                self.failures = 0
+                self.backoff = 0.0
+                return True
+            self.failures += 1
+            self.batch = max(self.min_batch, self.batch // 2)
+            delay = min(self.max_backoff, self.base_backoff * 2 ** (self.failures - 1))
+            self.backoff = delay * random.uniform(0.5, 1.0)
+            self._retry_at = time.monotonic() + self.backoff
+            return False
+        dt = time.perf_counter() - t0
+
+        self.outbox.commit(cursor)
+        self._end_split(cursor)
+        self.sent += len(lines)
+        self.requests += 1
+        self.failures = 0
+        self.backoff = 0.0
+        if self.stats is not None:
+            self.stats.record(len(lines), len(body), dt)
+
+        if dt > self.target_latency:
+            self.batch = max(self.min_batch, int(self.batch * self.target_latency / dt))
+        elif len(lines) == self.batch:
+            self.batch = min(self.max_batch, self.batch * 2)
+        return True
+
+    def _end_split(self, cursor):
+        if self._split_end is not None and cursor[:2] >= self._split_end[:2]:
+            self._split = self._split_end = None
+
+    def stop(self, drain_s=5.0):
+        """Para a thread; antes tenta esvaziar a fila por até drain_s segundos."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        deadline = time.monotonic() + drain_s
+        while time.monotonic() < deadline and self.send_once():
+            pass
+
+    def metrics(self):
+        """Profundidade da fila e taxa de drenagem desde a última chamada."""
+        now = time.monotonic()
+        dt = now - self._last_t
+        rate = (self.sent - self._last_sent) / dt if dt > 0 else 0.0
+        self._last_sent, self._last_t = self.sent, now
+        out = self.outbox.stats()
+        out.update({
+            "taxa_drenagem": round(rate, 1),
+            "enviadas": self.sent,
+            "requisicoes": self.requests,
+            "erros": self.errors,
+            "lote": self.batch,
+            "falhas_seguidas": self.failures,
+            "backoff_s": round(self.backoff, 2),
+        })
+        return out
+
+    def summary(self):
+        m = self.metrics()
+        line = (f"fila {m['fila']} leituras ({m['bytes_fila'] / 1024:.1f} kB) | drenagem "
+                f"{m['taxa_drenagem']:.1f}/s | lote {m['lote']} | enviadas {m['enviadas']} | "
+                f"descartadas {m['descartadas']}")
+        if m["falhas_seguidas"]:
+            line += f" | {m['falhas_seguidas']} falhas seguidas, próximo envio em {m['backoff_s']:.1f}s"
+        if m["rejeitadas"]:
+            line += f" | rejeitadas {m['rejeitadas']} (ver {DEAD_LETTER_NAME})"
+        if self.last_error and m["falhas_seguidas"]:
+            line += f" | último erro: {self.last_error}"
+        return line
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Estado de um spool de saída do simulador")
+    parser.add_argument("spool_dir")
+    args = parser.parse_args()
+    if not os.path.isdir(args.spool_dir):
+        print(f"spool não encontrado: {args.spool_dir}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(spool_stats(args.spool_dir), ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+# iot_rollups.py
+#
+# Rollups pré-calculados (downsampling) das leituras IoT em vários tamanhos
+# de balde: 1 min, 5 min e 1 h. Para cada balde, métrica e device_id guarda
+# mínimo, máximo, média (soma/contagem), contagem e último valor.
+#
+# Os rollups são atualizados incrementalmente conforme as leituras chegam
+# (a partir do checkpoint do iot_log.json, como o cache de agregados) e uma
+# consulta escolhe a resolução mais fina que cabe em 'max_points' baldes, de
+# modo que gráficos e relatórios de um mês leem centenas de linhas em vez de
+# centenas de milhares. O estado fica particionado por resolução e por
+# dia/mês (<log>.rollups/), e uma consulta carrega só as partições da janela.
+#
+# Uso:
+#   python iot_rollups.py update
+#   python iot_rollups.py query --periodo 2025-11 --max-points 300
+#   python iot_rollups.py query --periodo 2025-11-20 --device simulator-001
+
+import os
+import sys
+import json
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import iot_stream
+from iot_aggregates import MetricStats, LogCheckpoint, refresh_together, write_json_atomic
+
+ROLLUP_VERSION = 2
+
+# Tamanhos de balde (segundos), do mais fino para o mais grosso
+RESOLUTIONS = (60, 300, 3600)
+
+# Quanto tempo cada resolução é mantida, contado a partir da leitura mais recente
+RETENTION = {
+    60: 2 * 86400,        # 1 min: 2 dias
+    300: 31 * 86400,      # 5 min: 31 dias
+    3600: 400 * 86400,    # 1 h: ~13 meses
+}
+
+DEFAULT_MAX_POINTS = 500
+
+# Partição em disco de cada resolução: um arquivo por dia (1 min, 5 min) ou por mês (1 h)
+PARTITION = {60: "day", 300: "day", 3600: "month"}
+
+# Partições mantidas em memória (as menos usadas e sem alterações são liberadas)
+MAX_LOADED_PARTITIONS = 64
+
+# -------------------------
+# Estatística de um balde
+# -------------------------
+
+class BucketStats(MetricStats):
+    """MetricStats + último valor observado no balde (e seu timestamp)."""
+
+    __slots__ = ("last", "last_ts")
+
+    def __init__(self, total=0.0, count=0, vmin=None, vmax=None, last=None, last_ts=None):
+        super().__init__(total, count, vmin, vmax)
+        self.last = last
+        self.last_ts = last_ts
+
+    def add_at(self, ts, v):
+        self.add(v)
+        if self.last_ts is None or ts >= self.last_ts:
+            self.last = v
+            self.last_ts = ts
+
+    def merge(self, other):
+        super().merge(other)
+        if other.last_ts is not None and (self.last_ts is None or other.last_ts >= self.last_ts):
+            self.last = other.last
+            self.last_ts = other.last_ts
+        return self
+
+    def to_list(self):
+        return [self.sum, self.count, self.min, self.max, self.last, self.last_ts]
+
+    @classmethod
+    def from_list(cls, data):
+        return cls(*data)
+
+    def to_dict(self):
+        return {
+            "min": self.min,
+            "max": self.max,
+            "mean": round(self.mean, 4) if self.count else None,
+            "count": self.count,
+            "last": self.last,
+        }
+
+# -------------------------
+# Motor de rollups
+# -------------------------
+
+def default_rollup_path(log_path):
+    return log_path + ".rollups"
+
+def _partition_kind(res):
+    return PARTITION.get(res, "day" if res < 3600 else "month")
+
+def _partition_key(kind, t):
+    d = datetime.fromtimestamp(t, tz=timezone.utc)
+    return d.strftime("%Y-%m-%d") if kind == "day" else d.strftime("%Y-%m")
+
+def _partition_range(kind, key):
+    """Intervalo [inicio, fim) (epoch) coberto por uma partição."""
+    if kind == "day":
+        lo = datetime.strptime(key, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        return lo.timestamp(), lo.timestamp() + 86400
+    lo = datetime.strptime(key, "%Y-%m").replace(tzinfo=timezone.utc)
+    hi = lo.replace(year=lo.year + 1, month=1) if lo.month == 12 else lo.replace(month=lo.month + 1)
+    return lo.timestamp(), hi.timestamp()
+
+class RollupEngine:
+    """
+    Rollups por resolução, particionados no tempo:
+    partição (res, dia ou mês) -> {(inicio_balde, device_id): {metrica: BucketStats}}.
+    - add(ts, device_id, values): incorpora uma leitura em todas as resoluções.
+    - refresh(): lê do log apenas o que chegou desde o último checkpoint.
+    - rows(res, start, end): baldes das partições que cruzam a janela.
+    - query(...): devolve a janela pedida na resolução adequada.
+
+    Em disco (default_rollup_path): state.json (checkpoint, geração e índice
+    das partições) e um arquivo por partição, <res>/<chave>.g<geração>.json.
+    As partições são carregadas sob demanda (no máximo MAX_LOADED_PARTITIONS
+    em memória), então uma consulta de um dia lê só os arquivos daquele dia.
+    save() grava as partições alteradas com uma geração nova e só então o
+    state.json; os arquivos da geração anterior são apagados depois, e uma
+    gravação interrompida deixa o estado anterior intacto.
+    """
+
+    def __init__(self, log_path=iot_stream.DEFAULT_LOG_PATH, path=None,
+                 resolutions=RESOLUTIONS, retention=None):
+        self.log_path = log_path
+        self.path = path or default_rollup_path(log_path)
+        self.resolutions = tuple(sorted(resolutions))
+        self.retention = dict(RETENTION if retention is None else retention)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self._garbage = set()
+        self._files = {res: {} for res in self.resolutions}
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.checkpoint = LogCheckpoint()
+        self.latest_ts = None
+        # o que já está em disco passa a ser lixo da próxima gravação
+        for res, files in self._files.items():
+            self._garbage.update(os.path.join(str(res), f) for f, _ in files.values())
+        self._files = {res: {} for res in self.resolutions}   # res -> {chave: [arquivo, baldes]}
+        self._parts = OrderedDict()                            # (res, chave) -> tabela (LRU)
+        self._dirty = set()
+        self._hot = {}                                         # res -> (dia, tabela) da última leitura
+        self._keys = {}                                        # (tipo, dia) -> chave da partição
+
+    # ---- partições ----
+
+    def _partition(self, res, key, create=True):
+        table = self._parts.get((res, key))
+        if table is not None:
+            self._parts.move_to_end((res, key))
+            return table
+        entry = self._files[res].get(key)
+        if entry is None:
+            if not create:
+                return None
+            table = {}
+        else:
+            table = self._read_partition(res, entry[0])
+        self._parts[(res, key)] = table
+        self._evict()
+        return table
+
+    def _read_partition(self, res, name):
+        path = os.path.join(self.path, str(res), name)
+        with open(path, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        return {(t, dev): {m: BucketStats.from_list(v) for m, v in metrics.items()}
+                for t, dev, metrics in rows}
+
+    def _evict(self):
+        """Libera as partições menos usadas que não têm alterações pendentes."""
+        excess = len(self._parts) - MAX_LOADED_PARTITIONS
+        if excess <= 0:
+            return
+        for pk in [pk for pk in self._parts if pk not in self._dirty][:excess]:
+            del self._parts[pk]
+        self._hot.clear()
+
+    def _keys_in(self, res, start, end):
+        kind = _partition_kind(res)
+        keys = set(self._files[res]) | {k for r, k in self._parts if r == res}
+        out = []
+        for key in sorted(keys):
+            lo, hi = _partition_range(kind, key)
+            if (start is None or hi > start) and (end is None or lo < end):
+                out.append(key)
+        return out
+
+    def rows(self, res, start=None, end=None):
+        """((inicio_balde, device_id), {metrica: BucketStats}) das partições que cruzam [start, end)."""
+        for key in self._keys_in(res, start, end):
+            table = self._partition(res, key, create=False)
+            if table:
+                yield from table.items()
+
+    def bucket_counts(self):
+        """Número de baldes por resolução (do índice, sem carregar partições)."""
+        out = {}
+        for res in self.resolutions:
+            n = sum(e[1] for k, e in self._files[res].items() if (res, k) not in self._dirty)
+            n += sum(len(t) for (r, k), t in self._parts.items() if r == res and (r, k) in self._dirty)
+            out[res] = n
+        return out
+
+    # ---- incorporação ----
+
+    def add(self, ts, device_id, values):
+        if self.latest_ts is None or ts > self.latest_ts:
+            self.latest_ts = ts
+        day = int(ts // 86400)
+        for res in self.resolutions:
+            hot = self._hot.get(res)
+            if hot is not None and hot[0] == day:
+                part = hot[1]
+            else:
+                kind = _partition_kind(res)
+                key = self._keys.get((kind, day))
+                if key is None:
+                    key = self._keys[(kind, day)] = _partition_key(kind, day * 86400)
+                self._dirty.add((res, key))
+                part = self._partition(res, key)
+                self._hot[res] = (day, part)
+
+            bucket = (int(ts // res) * res, device_id)
+            metrics = part.get(bucket)
+            if metrics is None:
+                metrics = part[bucket] = {}
+            for m, v in values.items():
+                if v is None:
+                    continue
+                st = metrics.get(m)
+                if st is None:
+                    st = metrics[m] = BucketStats()
+                st.add_at(ts, v)
+
+    def add_reading(self, rec):
+        """Incorpora um registro no formato do simulador (ignora registros inválidos)."""
+        if not iot_stream.is_valid_reading(rec):
+            return False
+        ts = iot_stream.parse_timestamp(rec.get("timestamp"))
+        self.add(ts, rec.get("device_id") or "desconhecido", iot_stream.reading_values(rec))
+        return True
+
+    def prune(self):
+        """
+        Descarta as partições inteiramente além da retenção de cada resolução
+        (a retenção é aplicada por partição: até um dia/mês a mais fica guardado).
+        """
+        if self.latest_ts is None:
+            return
+        for res in self.resolutions:
+            keep = self.retention.get(res)
+            if not keep:
+                continue
+            cutoff = self.latest_ts - keep
+            kind = _partition_kind(res)
+            keys = set(self._files[res]) | {k for r, k in self._parts if r == res}
+            for key in keys:
+                if _partition_range(kind, key)[1] > cutoff:
+                    continue
+                entry = self._files[res].pop(key, None)
+                if entry is not None:
+                    self._garbage.add(os.path.join(str(res), entry[0]))
+                self._parts.pop((res, key), None)
+                self._dirty.discard((res, key))
+        self._hot.clear()
+
+    def refresh(self, save=True):
+        """
+        Atualiza a partir do log; reconstrói se o log foi truncado ou reescrito.
+        Quando as partições alteradas passam de MAX_LOADED_PARTITIONS, grava um
+        checkpoint intermediário (a memória fica limitada mesmo numa reconstrução).
+        A leitura é a de iot_aggregates.refresh_together, que também atualiza
+        os caches por dia numa passada só.
+        """
+        return refresh_together(self.log_path, [self], save)[0]
+
+    def needs_flush(self):
+        return len(self._dirty) > MAX_LOADED_PARTITIONS
+
+    def advance(self, offset, added=0, skipped=0, save=True):
+        """Move o checkpoint para 'offset', aplica a retenção e grava."""
+        self.checkpoint.advance(self.log_path, offset)
+        self.prune()
+        if save:
+            self.save()
+
+    # ---- persistência ----
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.path, "state.json"), "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(state, dict) or state.get("version") != ROLLUP_VERSION:
+            return
+        if [int(r) for r in state.get("particoes", {})] != list(self.resolutions):
+            return  # resoluções diferentes: reconstrói
+
+        self.checkpoint = LogCheckpoint.from_dict(state.get("checkpoint"))
+        self.latest_ts = state.get("latest_ts")
+        self.generation = state.get("geracao", 0)
+        for res_txt, parts in state["particoes"].items():
+            self._files[int(res_txt)] = {k: list(v) for k, v in parts.items()}
+
+    def save(self):
+        self.generation += 1
+        for res, key in sorted(self._dirty):
+            table = self._parts[(res, key)]
+            old = self._files[res].get(key)
+            if old is not None:
+                self._garbage.add(os.path.join(str(res), old[0]))
+            if not table:
+                self._files[res].pop(key, None)
+                continue
+            name = f"{key}.g{self.generation}.json"
+            rows = [[t, dev, {m: st.to_list() for m, st in metrics.items()}]
+                    for (t, dev), metrics in sorted(table.items())]
+            os.makedirs(os.path.join(self.path, str(res)), exist_ok=True)
+            write_json_atomic(os.path.join(self.path, str(res), name), rows)
+            self._files[res][key] = [name, len(table)]
+
+        state = {
+            "version": ROLLUP_VERSION,
+            "checkpoint": self.checkpoint.to_dict(),
+            "latest_ts": self.latest_ts,
+            "geracao": self.generation,
+            "particoes": {str(res): dict(sorted(self._files[res].items())) for res in self.resolutions},
+        }
+        write_json_atomic(os.path.join(self.path, "state.json"), state)
+        self._dirty.clear()
+        self._hot.clear()
+        self._evict()
+
+        # só depois do state.json novo: arquivos substituídos e o formato antigo (um JSON único)
+        live = {os.path.join(str(res), e[0]) for res in self.resolutions for e in self._files[res].values()}
+        for rel in self._garbage - live:
+            try:
+                os.remove(os.path.join(self.path, rel))
+            except OSError:
+                pass
+        self._garbage.clear()
+        try:
+            os.remove(self.path + ".json")
+        except OSError:
+            pass
+
+    def is_stale(self):
+        """Outro processo gravou um state.json mais novo que o carregado?"""
+        try:
+            with open(os.path.join(self.path, "state.json"), "r", encoding="utf-8") as f:
+                return json.load(f).get("geracao", 0) != self.generation
+        except (OSError, ValueError, AttributeError):
+            return False
+
+    # ---- consulta ----
+
+    def pick_resolution(self, start, end, max_points=DEFAULT_MAX_POINTS):
+        """
+        Resolução mais fina que (1) gera no máximo max_points baldes na janela
+        e (2) ainda tem dados retidos desde 'start'.
+        """
+        if start is None or end is None:
+            return self.resolutions[-1]
+        span = max(0.0, end - start)
+        for res in self.resolutions:
+            if span / res > max_points:
+                continue
+            keep = self.retention.get(res)
+            if keep and self.latest_ts is not None and start < self.latest_ts - keep:
+                continue
+            return res
+        return self.resolutions[-1]
+
+    def query(self, start=None, end=None, device_id=None, max_points=DEFAULT_MAX_POINTS,
+              resolution=None, metrics=None):
+        """
+        Série temporal da janela [start, end) na resolução escolhida.
+        - device_id=None combina todos os dispositivos em cada balde.
+        - Retorna {"resolucao_s": res, "pontos": [{"t": iso, "<metrica>": {...}}, ...]}.
+        """
+        res = resolution or self.pick_resolution(start, end, max_points)
+
+        merged = {}
+        for (t, dev), values in self.rows(res, start, end):
+            if start is not None and t + res <= start:
+                continue
+            if end is not None and t >= end:
+                continue
+            if device_id is not None and dev != device_id:
+                continue
+            row = merged.setdefault(t, {})
+            for m, st in values.items():
+                if metrics and m not in metrics:
+                    continue
+                row.setdefault(m, BucketStats()).merge(st)
+
+        points = []
+        for t in sorted(merged):
+            point = {"t": datetime.fromtimestamp(t, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}
+            for m, st in merged[t].items():
+                point[m] = st.to_dict()
+            points.append(point)
+        return {"resolucao_s": res, "pontos": points}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def shared_engine(log_path=None):
+    """
+    RollupEngine do log reaproveitado entre chamadas no mesmo processo (modo
+    serviço do report_generator): o índice e as partições já lidas ficam em
+    memória. Recarrega se outro processo gravou um estado mais novo. Use
+    'with engine.lock:' em volta de refresh() + consultas.
+    """
+    path = log_path or iot_stream.DEFAULT_LOG_PATH
+    with _engines_lock:
+        engine = _engines.get(path)
+        if engine is None or engine.is_stale():
+            engine = _engines[path] = RollupEngine(path)
+        return engine
+
+def query_window(periodo=None, device_id=None, max_points=DEFAULT_MAX_POINTS, log_path=None):
+    """Atalho: atualiza os rollups do log e consulta a janela de um 'periodo' de relatório."""
+    engine = shared_engine(log_path)
+    rng = iot_stream.parse_periodo(periodo) if periodo else None
+    start, end = rng if rng else (None, None)
+    with engine.lock:
+        engine.refresh()
+        return engine.query(start, end, device_id, max_points)
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Rollups 1min/5min/1h das leituras IoT")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_up = sub.add_parser("update", help="incorpora as leituras novas do log")
+    p_up.add_argument("--log", default=iot_stream.DEFAULT_LOG_PATH)
+    p_up.add_argument("--rebuild", action="store_true")
+
+    p_q = sub.add_parser("query", help="consulta uma janela")
+    p_q.add_argument("--log", default=iot_stream.DEFAULT_LOG_PATH)
+    p_q.add_argument("--periodo", default=None)
+    p_q.add_argument("--device", default=None)
+    p_q.add_argument("--max-points", type=int, default=DEFAULT_MAX_POINTS)
+    p_q.add_argument("--resolution", type=int, choices=RESOLUTIONS, default=None,
+                     help="força uma resolução em segundos")
+
+    args = parser.parse_args()
+    engine = RollupEngine(args.log)
+
+    if args.cmd == "update":
+        if args.rebuild:
+            engine._reset()
+        added = engine.refresh()
+        print(f"{added} leituras novas; baldes por resolução: {engine.bucket_counts()}")
+        return
+
+    engine.refresh()
+    rng = iot_stream.parse_periodo(args.periodo) if args.periodo else None
+    start, end = rng if rng else (None, None)
+    out = engine.query(start, end, args.device, args.max_points, args.resolution)
+    json.dump(out, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+# iot_sectors.py
+#
+# KPIs de energia e ambiente por setor (US-05 — Visão de Consumo de Energia
+# por Setor), a partir de um cache incremental por dia e dispositivo.
+#
+# Os agregados parciais de cada dispositivo (soma/contagem/mín/máx, sketch
+# KLL de CO₂, demanda por intervalo) são combináveis, então ficam guardados
+# por dia e device_id ao lado do log (iot_log.json -> .sectors/, um arquivo
+# por dia), com o mesmo checkpoint de iot_aggregates: cada relatório só lê os
+# registros acrescentados desde a última vez e junta os dias do período. Períodos fora
+# de limites de dia caem na leitura em streaming do intervalo (iot_segments).
+#
+# Reconstruções (cache inexistente, log rotacionado ou muitos bytes novos)
+# dividem o trecho a ler em fatias de bytes, cada uma começando no início de
+# um registro, e agregam cada fatia num processo do pool; atualizações
+# pequenas rodam no próprio processo.
+#
+# Energia: a demanda média de cada dispositivo é medida em intervalos de 15
+# minutos (o intervalo de demanda da tarifação); a demanda do setor num
+# intervalo é a soma das demandas dos seus dispositivos. Daí saem:
+#   - energia_kwh       = soma, nos intervalos com leitura, de demanda × 0,25 h
+#   - demanda_max_kw    = maior demanda de 15 min do setor (pico coincidente)
+#   - fator_carga       = demanda média / demanda máxima (1 = carga constante)
+#   - pico_kw           = maior leitura instantânea/pico registrada
+#
+# Mapeamento dispositivo -> setor (public/iot/sectors.json ou IOT_SECTORS_PATH),
+# em qualquer um dos dois formatos:
+#   {"simulator-001": "UTI", "simulator-002": "Centro Cirúrgico"}
+#   {"setores": {"UTI": ["simulator-001", "simulator-003"], "Recepção": ["simulator-002"]}}
+# Sem arquivo, cada device_id é o seu próprio "setor"; com arquivo, os
+# dispositivos não listados caem em "sem setor".
+#
+# Uso:
+#   python iot_sectors.py                                  -> todos os dados, por setor
+#   python iot_sectors.py --periodo 2025-11 --workers 8
+#   python iot_sectors.py --sectors mapa.json --log dataset.ndjson
+#   python iot_sectors.py --rebuild --workers 8            -> refaz o cache do zero
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import iot_stream
+import iot_segments
+from iot_aggregates import AggregateCache, MetricStats, _day_key, shared_cache
+from quantile_sketch import KLLSketch
+
+DEFAULT_SECTORS_PATH = os.environ.get("IOT_SECTORS_PATH") or os.path.join(
+    os.path.dirname(iot_stream.DEFAULT_LOG_PATH), "sectors.json"
+)
+
+DEMAND_INTERVAL_S = 900
+UNMAPPED_SECTOR = "sem setor"
+
+# Fatias menores que isto não compensam subir um processo; atualizações com
+# menos de duas fatias de bytes novos rodam no próprio processo
+MIN_SHARD_BYTES = 16 << 20
+
+# Início de registro: linha cujo primeiro caractere não branco é '{'. Vale para
+# o JSON "pretty-printed" do PHP (objetos aninhados abrem na linha da chave)
+# e para NDJSON; strings JSON não contêm quebras de linha cruas.
+_RECORD_START = re.compile(rb"\n[ \t]*\{")
+
+# -------------------------
+# Mapeamento de setores
+# -------------------------
+
+def load_sector_map(path=DEFAULT_SECTORS_PATH):
+    """{device_id: setor} do arquivo de mapeamento, ou None se não existir."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except OSError:
+        return None
+    except ValueError as e:
+        raise ValueError(f"mapeamento de setores inválido em {path}: {e}")
+    if not isinstance(data, dict):
+        raise ValueError(f"mapeamento de setores inválido em {path}: esperado um objeto")
+    if isinstance(data.get("setores"), dict):
+        return {str(dev): sector for sector, devs in data["setores"].items() for dev in devs}
+    return {str(dev): str(sector) for dev, sector in data.items()}
+
+# -------------------------
+# Agregado parcial por dispositivo
+# -------------------------
+
+class DevicePartial:
+    """Agregados combináveis das leituras de um dispositivo (num dia ou numa fatia do log)."""
+
+    __slots__ = ("readings", "kw", "peak", "demand", "co2", "co2_q", "temp")
+
+    def __init__(self):
+        self.readings = 0
+        self.kw = MetricStats()
+        self.peak = None
+        self.demand = {}        # início do intervalo -> [soma kW, leituras]
+        self.co2 = MetricStats()
+        self.co2_q = KLLSketch()
+        self.temp = MetricStats()
+
+    def add(self, ts, values):
+        self.readings += 1
+        kw = values["energy_instant"]
+        if kw is not None:
+            self.kw.add(kw)
+            slot = int(ts // DEMAND_INTERVAL_S) * DEMAND_INTERVAL_S
+            acc = self.demand.get(slot)
+            if acc is None:
+                self.demand[slot] = [kw, 1]
+            else:
+                acc[0] += kw
+                acc[1] += 1
+        peak = values["energy_peak"]
+        if kw is not None and (peak is None or kw > peak):
+            peak = kw
+        if peak is not None and (self.peak is None or peak > self.peak):
+            self.peak = peak
+        co2 = values["co2"]
+        if co2 is not None:
+            self.co2.add(co2)
+            self.co2_q.add(co2)
+        if values["temperature"] is not None:
+            self.temp.add(values["temperature"])
+
+    def merge(self, other):
+        self.readings += other.readings
+        self.kw.merge(other.kw)
+        if other.peak is not None and (self.peak is None or other.peak > self.peak):
+            self.peak = other.peak
+        for slot, (s, n) in other.demand.items():
+            acc = self.demand.get(slot)
+            if acc is None:
+                self.demand[slot] = [s, n]
+            else:
+                acc[0] += s
+                acc[1] += n
+        self.co2.merge(other.co2)
+        self.co2_q.merge(other.co2_q)
+        self.temp.merge(other.temp)
+        return self
+
+    def to_list(self):
+        return [
+            self.readings,
+            self.kw.to_list(),
+            self.peak,
+            [[slot, s, n] for slot, (s, n) in self.demand.items()],
+            self.co2.to_list(),
+            self.co2_q.to_list(),
+            self.temp.to_list(),
+        ]
+
+    @classmethod
+    def from_list(cls, data):
+        part = cls()
+        part.readings = data[0]
+        part.kw = MetricStats.from_list(data[1])
+        part.peak = data[2]
+        part.demand = {slot: [s, n] for slot, s, n in data[3]}
+        part.co2 = MetricStats.from_list(data[4])
+        part.co2_q = KLLSketch.from_list(data[5])
+        part.temp = MetricStats.from_list(data[6])
+        return part
+
+# -------------------------
+# Fatias do log
+# -------------------------
+
+def _next_record_start(f, pos, size):
+    """Offset da primeira linha a partir de 'pos' que abre um registro (ou 'size')."""
+    f.seek(pos)
+    carry = b""
+    base = pos          # offset de carry[0] no arquivo
+    while True:
+        chunk = f.read(1 << 16)
+        if not chunk:
+            return size
+        data = carry + chunk
+        m = _RECORD_START.search(data)
+        if m:
+            return base + m.start() + 1
+        carry = data[-64:]   # "\n" + indentação pode ter ficado no fim do bloco
+        base += len(data) - len(carry)
+
+def shard_offsets(path, shards, begin=0):
+    """
+    Divide o trecho [begin, fim do arquivo) em até 'shards' fatias [início, fim)
+    de tamanhos parecidos, cada uma começando no início de um registro ('begin'
+    precisa ser um início de registro, como o offset de um checkpoint).
+    Retorna a lista de pares.
+    """
+    size = os.path.getsize(path)
+    shards = max(1, min(shards, (size - begin) // MIN_SHARD_BYTES or 1))
+    bounds = [begin]
+    with open(path, "rb") as f:
+        for i in range(1, shards):
+            pos = _next_record_start(f, max(bounds[-1], begin + (size - begin) * i // shards), size)
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:])]
+
+def _device_partial(table, rec):
+    dev = rec.get("device_id") or "desconhecido"
+    part = table.get(dev)
+    if part is None:
+        part = table[dev] = DevicePartial()
+    return part
+
+def _scan_shard(path, begin, stop):
+    """
+    Agrega por dia e device_id as leituras válidas (iot_stream.is_valid_reading)
+    que começam em [begin, stop).
+    Retorna (days, leituras, descartados, offset após o último registro lido).
+    """
+    days = {}
+    by_epoch_day = {}   # dia em epoch -> tabela do dia (evita formatar a chave a cada leitura)
+    added = skipped = 0
+    last = begin
+    for rec, rec_end in iot_stream.iter_log_records(path, offset=begin):
+        if rec_end > stop:
+            break  # começa na fatia seguinte
+        last = rec_end
+        ts = iot_stream.parse_timestamp(rec.get("timestamp")) if isinstance(rec, dict) else None
+        if ts is None:
+            skipped += 1
+            continue
+        values = iot_stream.reading_values(rec)
+        if all(v is None for v in values.values()):
+            skipped += 1
+            continue
+        d = int(ts // 86400)
+        table = by_epoch_day.get(d)
+        if table is None:
+            table = by_epoch_day[d] = days.setdefault(_day_key(ts), {})
+        _device_partial(table, rec).add(ts, values)
+        added += 1
+    return days, added, skipped, last
+
+# -------------------------
+# Cache incremental
+# -------------------------
+
+class SectorCache(AggregateCache):
+    """
+    Cache incremental de DevicePartial por dia e device_id
+    (iot_log.json -> .sectors/). Mesmo checkpoint e mesmas partições diárias
+    de AggregateCache; a consulta devolve {device_id: DevicePartial} do período.
+    """
+
+    VERSION = 2
+    SUFFIX = ".sectors"
+
+    def _load_entry(self, data):
+        return DevicePartial.from_list(data)
+
+    def _dump_entry(self, part):
+        return part.to_list()
+
+    def add(self, ts, device_id, values):
+        table = self._table_for(ts)
+        part = table.get(device_id)
+        if part is None:
+            part = table[device_id] = DevicePartial()
+        part.add(ts, values)
+
+    def refresh(self, save=True, workers=None):
+        """
+        Como AggregateCache.refresh. Com 'workers' > 1 (padrão: núcleos) e ao
+        menos duas fatias de bytes novos (reconstrução), o trecho é lido pelo
+        pool de processos; senão, no próprio processo.
+        """
+        if not os.path.exists(self.log_path):
+            return 0
+        if not self.checkpoint.is_valid(self.log_path):
+            self._reset()
+
+        workers = workers or os.cpu_count() or 1
+        begin = self.checkpoint.offset
+        size = os.path.getsize(self.log_path)
+        if workers < 2 or size - begin < 2 * MIN_SHARD_BYTES:
+            return AggregateCache.refresh(self, save)
+
+        shards = shard_offsets(self.log_path, workers, begin)
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+            futures = [pool.submit(_scan_shard, self.log_path, a, b) for a, b in shards]
+            results = [f.result() for f in futures]
+
+        added = 0
+        offset = begin
+        for days, n, skipped, last in results:
+            for day, devices in days.items():
+                mine = self._table(day)
+                for dev, part in devices.items():
+                    if dev in mine:
+                        mine[dev].merge(part)
+                    else:
+                        mine[dev] = part
+            added += n
+            self.skipped += skipped
+            offset = max(offset, last)
+
+        if offset != self.checkpoint.offset:
+            self.records += added
+            self.checkpoint.advance(self.log_path, offset)
+            if save:
+                self.save()
+        return added
+
+    def query(self, start=None, end=None, device_id=None):
+        """Combina os dias inteiros de [start, end) -> {device_id: DevicePartial}."""
+        out = {}
+        for _, devices in self.iter_days(start, end):
+            for dev, part in devices.items():
+                if device_id is not None and dev != device_id:
+                    continue
+                out.setdefault(dev, DevicePartial()).merge(part)
+        return out
+
+def period_partials(path=iot_stream.DEFAULT_LOG_PATH, start=None, end=None, device_id=None,
+                    workers=None):
+    """
+    {device_id: DevicePartial} das leituras em [start, end).
+    Retorna também a fonte: "cache" (dias inteiros, após atualizar o cache) ou
+    "log" (período fora de limites de dia, lido em streaming via iot_segments).
+    O cache é a instância do processo (iot_aggregates.shared_cache): no modo
+    serviço o índice e os dias já lidos continuam em memória.
+    """
+    cache = shared_cache(SectorCache, path)
+    if cache.covers(start, end):
+        with cache.lock:
+            cache.refresh(workers=workers)
+            return cache.query(start, end, device_id), "cache"
+
+    partials = {}
+    for ts, rec in iot_segments.iter_readings(path, start, end, device_id):
+        _device_partial(partials, rec).add(ts, iot_stream.reading_values(rec))
+    return partials, "log"
+
+# -------------------------
+# Tabela por setor
+# -------------------------
+
+def _r(v, digits):
+    return round(v, digits) if v is not None else None
+
+def sector_table(partials, sector_map=None):
+    """
+    Agrupa os agregados por setor e devolve as linhas ordenadas por energia
+    (maior consumo primeiro), com posição no ranking e participação no total.
+    """
+    groups = {}
+    for dev, part in partials.items():
+        sector = dev if sector_map is None else sector_map.get(dev, UNMAPPED_SECTOR)
+        groups.setdefault(sector, []).append((dev, part))
+
+    rows = []
+    for sector, members in groups.items():
+        total = DevicePartial()
+        demand = {}
+        for _, part in members:
+            total.merge(part)
+            # demanda do setor no intervalo = soma das médias dos dispositivos
+            for slot, (s, n) in part.demand.items():
+                demand[slot] = demand.get(slot, 0.0) + s / n
+        hours = DEMAND_INTERVAL_S / 3600.0
+        energy = sum(demand.values()) * hours
+        d_max = max(demand.values()) if demand else None
+        d_avg = sum(demand.values()) / len(demand) if demand else None
+        rows.append({
+            "setor": sector,
+            "dispositivos": sorted(dev for dev, _ in members),
+            "leituras": total.readings,
+            "energia_kwh": _r(energy, 3),
+            "demanda_media_kw": _r(d_avg, 3),
+            "demanda_max_kw": _r(d_max, 3),
+            "fator_carga": _r(d_avg / d_max, 3) if d_max else None,
+            "pico_kw": _r(total.peak, 2),
+            "co2_medio": _r(total.co2.mean, 1),
+            "co2_p95": _r(total.co2_q.percentile(95), 1),
+            "co2_max": _r(total.co2.max, 1),
+            "temp_media": _r(total.temp.mean, 2),
+            "temp_min": _r(total.temp.min, 2),
+            "temp_max": _r(total.temp.max, 2),
+        })
+
+    rows.sort(key=lambda r: (-(r["energia_kwh"] or 0.0), r["setor"]))
+    grand = sum(r["energia_kwh"] or 0.0 for r in rows)
+    for i, row in enumerate(rows, 1):
+        row["posicao"] = i
+        row["participacao_energia"] = _r(row["energia_kwh"] / grand, 4) if grand else None
+    return rows
+
+def analyze(log_path=iot_stream.DEFAULT_LOG_PATH, start=None, end=None, device_id=None,
+            workers=None, sectors_path=DEFAULT_SECTORS_PATH):
+    """Agregados do período (period_partials) + tabela por setor, com metadados da execução."""
+    t0 = time.perf_counter()
+    sector_map = load_sector_map(sectors_path) if sectors_path else None
+    if not os.path.exists(log_path):
+        raise OSError(f"log não encontrado: {log_path}")
+    partials, source = period_partials(log_path, start, end, device_id, workers)
+    return {
+        "agrupamento": "setor" if sector_map is not None else "device_id",
+        "intervalo_demanda_s": DEMAND_INTERVAL_S,
+        "leituras": sum(p.readings for p in partials.values()),
+        "fonte": source,
+        "segundos": round(time.perf_counter() - t0, 3),
+        "setores": sector_table(partials, sector_map),
+    }
+
+def analyze_period(periodo, device_id=None, log_path=None, workers=None,
+                   sectors_path=DEFAULT_SECTORS_PATH):
+    """analyze() para o 'periodo' do relatório (ver iot_stream.parse_periodo)."""
+    rng = iot_stream.parse_periodo(periodo) if periodo else None
+    start, end = rng if rng else (None, None)
+    return analyze(log_path or iot_stream.DEFAULT_LOG_PATH, start, end, device_id,
+                   workers, sectors_path)
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="KPIs de energia/ambiente por setor (US-05)")
+    parser.add_argument("--log", default=iot_stream.DEFAULT_LOG_PATH)
+    parser.add_argument("--periodo", default=None)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--sectors", default=DEFAULT_SECTORS_PATH,
+                        help="arquivo de mapeamento dispositivo -> setor (padrão public/iot/sectors.json)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processos para reconstruir o cache (padrão: núcleos)")
+    parser.add_argument("--rebuild", action="store_true", help="descarta o cache .sectors/ antes")
+    args = parser.parse_args()
+
+    try:
+        if args.rebuild:
+            cache = SectorCache(args.log)
+            cache._reset()
+            cache.refresh(workers=args.workers)
+        out = analyze_period(args.periodo, args.device, args.log, args.workers, args.sectors)
+    except ValueError as e:
+        print(f"[sectors] {e}", file=sys.stderr)
+        sys.exit(1)
+    json.dump(out, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
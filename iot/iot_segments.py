@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+# iot_segments.py
+#
+# Compactação do histórico IoT em segmentos particionados por tempo.
+#
+# O iot_log.json é um único array que só cresce; qualquer leitura de um
+# intervalo precisa varrer o arquivo inteiro. Aqui as leituras válidas são
+# copiadas (a partir do checkpoint do log, como os rollups) para segmentos
+# NDJSON comprimidos com gzip, um por dia ou por hora:
+#
+#     <log>.segments/
+#         manifest.json              -> índice: por segmento, min/max ts,
+#                                       linhas, bytes e contagem por device_id
+#         2025-11-20-0.ndjson.gz
+#         2025-11-21-0.ndjson.gz ...
+#
+# Um leitor de período abre só os segmentos cujo [min_ts, max_ts] cruza o
+# intervalo (e que contêm o device_id pedido) e completa com o trecho do log
+# ainda não compactado. O iot_log.json continua intacto: o PHP segue escrevendo
+# nele, e os segmentos são um índice derivado que pode ser reconstruído.
+# A retenção apaga segmentos antigos e registra no manifest "retido_desde";
+# a parte de um intervalo anterior a essa marca é lida do próprio log.
+#
+# Escrita sem bloquear ninguém:
+#   - o log é lido sem trava (um objeto incompleto no fim é ignorado);
+#   - leituras novas entram como um novo membro gzip no fim do segmento, e o
+#     manifest (gravado de forma atômica) guarda quantos bytes de cada
+#     segmento estão confirmados; leitores só leem até esse tamanho, e um
+#     membro gravado pela metade (queda no meio) é truncado na próxima execução;
+#   - "selar" um segmento fechado (recomprimir os membros num só) grava um
+#     arquivo novo e troca o nome no manifest; o antigo só é apagado depois.
+# Só um compactador por diretório deve rodar de cada vez.
+#
+# Uso:
+#   python iot_segments.py compact                       -> incorpora as leituras novas
+#   python iot_segments.py compact --granularity hour --rebuild
+#   python iot_segments.py watch --interval 60 --retain-days 400
+#   python iot_segments.py query --periodo 2025-11-20 --device simulator-001
+#   python iot_segments.py info
+
+import io
+import os
+import sys
+import json
+import gzip
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+
+import iot_stream
+from iot_aggregates import LogCheckpoint, write_json_atomic
+
+SEGMENTS_VERSION = 1
+
+GRANULARITIES = {"day": 86400, "hour": 3600}
+DEFAULT_GRANULARITY = "day"
+
+MANIFEST_NAME = "manifest.json"
+SEGMENT_SUFFIX = ".ndjson.gz"
+
+# Leituras acumuladas na memória antes de gravar um membro e o manifest
+DEFAULT_FLUSH_ROWS = 50000
+
+# Um segmento é selado quando termina pelo menos isto antes da leitura mais recente
+SEAL_GRACE_S = 3600
+
+# Membros novos saem rápidos (nível 1); o selo recomprime no nível máximo
+APPEND_LEVEL = 1
+SEAL_LEVEL = 9
+
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+def default_segments_dir(log_path):
+    return log_path + ".segments"
+
+def _partition_key(ts, size):
+    start = int(ts // size) * size
+    fmt = "%Y-%m-%d" if size >= 86400 else "%Y-%m-%dT%H"
+    return datetime.fromtimestamp(start, tz=timezone.utc).strftime(fmt), start
+
+def load_manifest(seg_dir):
+    """Manifest do diretório de segmentos, ou None se não existir/for inválido."""
+    try:
+        with open(os.path.join(seg_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get("versao") != SEGMENTS_VERSION:
+        return None
+    return manifest
+
+# -------------------------
+# Escrita (compactação, selo e retenção)
+# -------------------------
+
+class SegmentStore:
+    """
+    Diretório de segmentos de um log.
+    - compact(): incorpora as leituras novas do log a partir do checkpoint;
+    - seal(): recomprime num único membro os segmentos já fechados;
+    - apply_retention(days): apaga segmentos mais antigos que 'days' (contados
+      a partir da leitura mais recente);
+    - maintain(): os três, na ordem; é o que o modo watch/start_background roda.
+    """
+
+    def __init__(self, log_path=iot_stream.DEFAULT_LOG_PATH, seg_dir=None,
+                 granularity=DEFAULT_GRANULARITY, flush_rows=DEFAULT_FLUSH_ROWS):
+        self.log_path = log_path
+        self.seg_dir = seg_dir or default_segments_dir(log_path)
+        self.flush_rows = flush_rows
+        self._lock = threading.Lock()
+        os.makedirs(self.seg_dir, exist_ok=True)
+
+        manifest = load_manifest(self.seg_dir)
+        if manifest is None or manifest.get("granularidade") != granularity:
+            self._reset(granularity)
+        else:
+            self.manifest = manifest
+            self.checkpoint = LogCheckpoint.from_dict(manifest.get("origem"))
+            self._recover()
+
+    @property
+    def size(self):
+        return GRANULARITIES[self.manifest["granularidade"]]
+
+    def _reset(self, granularity=None):
+        granularity = granularity or self.manifest["granularidade"]
+        for name in os.listdir(self.seg_dir):
+            if name.endswith(SEGMENT_SUFFIX):
+                os.remove(os.path.join(self.seg_dir, name))
+        self.manifest = {
+            "versao": SEGMENTS_VERSION,
+            "granularidade": granularity,
+            "origem": {},
+            "max_ts": None,
+            "retido_desde": None,
+            "segmentos": {},
+        }
+        self.checkpoint = LogCheckpoint()
+        self._save()
+
+    def _recover(self):
+        """Desfaz gravações não confirmadas no manifest (queda no meio de um flush)."""
+        known = set()
+        for seg in self.manifest["segmentos"].values():
+            path = os.path.join(self.seg_dir, seg["arquivo"])
+            known.add(seg["arquivo"])
+            try:
+                if os.path.getsize(path) > seg["bytes"]:
+                    with open(path, "r+b") as f:
+                        f.truncate(seg["bytes"])
+            except OSError:
+                pass
+        for name in os.listdir(self.seg_dir):
+            if name.endswith(SEGMENT_SUFFIX) and name not in known:
+                os.remove(os.path.join(self.seg_dir, name))
+
+    def _save(self):
+        self.manifest["origem"] = dict(self.checkpoint.to_dict(), log=os.path.abspath(self.log_path))
+        if not write_json_atomic(os.path.join(self.seg_dir, MANIFEST_NAME), self.manifest):
+            raise OSError(f"não foi possível gravar o manifest em {self.seg_dir}")
+
+    def compact(self, rebuild=False):
+        """Copia para os segmentos as leituras novas do log. Retorna quantas."""
+        with self._lock:
+            if rebuild or not self.checkpoint.is_valid(self.log_path):
+                self._reset()
+            if not os.path.exists(self.log_path):
+                return 0
+
+            size = self.size
+            pending = {}    # partição -> [início, linhas, min, max, {device: n}]
+            count = added = 0
+            offset = self.checkpoint.offset
+            for rec, end in iot_stream.iter_log_records(self.log_path, offset=self.checkpoint.offset):
+                offset = end
+                # mesmo critério de iot_stream.is_valid_reading, sem interpretar o timestamp duas vezes
+                if not isinstance(rec, dict):
+                    continue
+                ts = iot_stream.parse_timestamp(rec.get("timestamp"))
+                if ts is None or all(v is None for v in iot_stream.reading_values(rec).values()):
+                    continue
+                key, start = _partition_key(ts, size)
+                part = pending.get(key)
+                if part is None:
+                    part = pending[key] = [start, [], ts, ts, {}]
+                part[1].append(_encode(rec))
+                if ts < part[2]:
+                    part[2] = ts
+                if ts > part[3]:
+                    part[3] = ts
+                dev = str(rec.get("device_id"))
+                part[4][dev] = part[4].get(dev, 0) + 1
+                count += 1
+                if count >= self.flush_rows:
+                    added += self._flush(pending, offset)
+                    pending, count = {}, 0
+            if offset != self.checkpoint.offset:
+                added += self._flush(pending, offset)
+            return added
+
+    def _flush(self, pending, offset):
+        """Grava um membro gzip por partição e só então confirma no manifest."""
+        segs = self.manifest["segmentos"]
+        added = 0
+        for key, (start, lines, tmin, tmax, devices) in pending.items():
+            seg = segs.get(key)
+            if seg is None:
+                seg = {
+                    "arquivo": f"{key}-0{SEGMENT_SUFFIX}",
+                    "inicio": start,
+                    "fim": start + self.size,
+                    "min_ts": tmin,
+                    "max_ts": tmax,
+                    "linhas": 0,
+                    "bytes": 0,
+                    "membros": 0,
+                    "selado": False,
+                    "dispositivos": {},
+                }
+            data = gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), compresslevel=APPEND_LEVEL)
+            with open(os.path.join(self.seg_dir, seg["arquivo"]), "ab") as f:
+                f.write(data)
+            seg["bytes"] += len(data)
+            seg["membros"] += 1
+            seg["linhas"] += len(lines)
+            seg["selado"] = False   # leituras atrasadas reabrem um segmento selado
+            seg["min_ts"] = min(seg["min_ts"], tmin)
+            seg["max_ts"] = max(seg["max_ts"], tmax)
+            for dev, n in devices.items():
+                seg["dispositivos"][dev] = seg["dispositivos"].get(dev, 0) + n
+            segs[key] = seg
+            newest = self.manifest["max_ts"]
+            self.manifest["max_ts"] = tmax if newest is None else max(newest, tmax)
+            added += len(lines)
+        self.checkpoint.advance(self.log_path, offset)
+        self._save()
+        return added
+
+    def seal(self):
+        """
+        Recomprime num único membro (nível máximo) os segmentos que já
+        fecharam. Grava em um arquivo novo e troca o nome no manifest, então
+        quem está lendo o arquivo antigo não é afetado. Retorna quantos selou.
+        """
+        with self._lock:
+            newest = self.manifest["max_ts"]
+            if newest is None:
+                return 0
+            sealed = 0
+            for key, seg in sorted(self.manifest["segmentos"].items()):
+                if seg["selado"] or seg["fim"] > newest - SEAL_GRACE_S:
+                    continue
+                old = seg["arquivo"]
+                gen = int(old[len(key) + 1:-len(SEGMENT_SUFFIX)]) + 1
+                new = f"{key}-{gen}{SEGMENT_SUFFIX}"
+                with open(os.path.join(self.seg_dir, old), "rb") as f:
+                    raw = gzip.decompress(f.read(seg["bytes"]))
+                data = gzip.compress(raw, compresslevel=SEAL_LEVEL)
+                tmp = os.path.join(self.seg_dir, new + ".tmp")
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, os.path.join(self.seg_dir, new))
+                seg.update(arquivo=new, bytes=len(data), membros=1, selado=True)
+                self._save()
+                os.remove(os.path.join(self.seg_dir, old))
+                sealed += 1
+            return sealed
+
+    def apply_retention(self, days):
+        """
+        Remove segmentos que terminam antes de (leitura mais recente - days) e
+        avança manifest["retido_desde"] até o fim do último removido.
+        """
+        with self._lock:
+            newest = self.manifest["max_ts"]
+            if newest is None or days is None:
+                return 0
+            limit = newest - days * 86400
+            old = [k for k, seg in self.manifest["segmentos"].items() if seg["fim"] <= limit]
+            removed = [self.manifest["segmentos"].pop(k) for k in old]
+            files = [seg["arquivo"] for seg in removed]
+            if old:
+                mark = max(seg["fim"] for seg in removed)
+                self.manifest["retido_desde"] = max(mark, self.manifest.get("retido_desde") or mark)
+                self._save()   # some do manifest antes de sumir do disco
+            for name in files:
+                try:
+                    os.remove(os.path.join(self.seg_dir, name))
+                except OSError:
+                    pass
+            return len(old)
+
+    def maintain(self, retain_days=None):
+        return {
+            "compactadas": self.compact(),
+            "selados": self.seal(),
+            "removidos": self.apply_retention(retain_days),
+        }
+
+    def start_background(self, interval=60.0, retain_days=None, on_cycle=None):
+        """
+        Roda maintain() a cada 'interval' segundos numa thread daemon.
+        Retorna um threading.Event; set() encerra o laço.
+        """
+        stop = threading.Event()
+
+        def loop():
+            while True:
+                try:
+                    result = self.maintain(retain_days)
+                    if on_cycle:
+                        on_cycle(result)
+                except OSError as e:
+                    print(f"[segments] erro: {e}", file=sys.stderr, flush=True)
+                if stop.wait(interval):
+                    return
+
+        threading.Thread(target=loop, name="segments-maintain", daemon=True).start()
+        return stop
+
+    def info(self):
+        segs = self.manifest["segmentos"]
+        return {
+            "granularidade": self.manifest["granularidade"],
+            "segmentos": len(segs),
+            "selados": sum(1 for s in segs.values() if s["selado"]),
+            "linhas": sum(s["linhas"] for s in segs.values()),
+            "bytes": sum(s["bytes"] for s in segs.values()),
+            "offset_log": self.checkpoint.offset,
+            "retido_desde": self.manifest.get("retido_desde"),
+            "dispositivos": len({d for s in segs.values() for d in s["dispositivos"]}),
+        }
+
+# -------------------------
+# Leitura
+# -------------------------
+
+def segments_for(manifest, start=None, end=None, device_id=None):
+    """
+    Segmentos (em ordem de tempo) que podem ter leituras em [start, end) do
+    device_id, como pares (partição, entrada do manifest).
+    """
+    out = []
+    for key, seg in manifest["segmentos"].items():
+        if start is not None and seg["max_ts"] < start:
+            continue
+        if end is not None and seg["min_ts"] >= end:
+            continue
+        if device_id is not None and device_id not in seg["dispositivos"]:
+            continue
+        out.append((key, seg))
+    out.sort(key=lambda item: item[1]["inicio"])
+    return out
+
+def _read_segment(seg_dir, key, seg):
+    """
+    Bytes confirmados de um segmento (um membro sendo gravado agora fica de
+    fora). Se o arquivo foi trocado por um selo depois que o manifest foi
+    lido, segue o nome novo; se a retenção o apagou, retorna None.
+    """
+    for _ in range(3):
+        try:
+            with open(os.path.join(seg_dir, seg["arquivo"]), "rb") as f:
+                return f.read(seg["bytes"])
+        except FileNotFoundError:
+            manifest = load_manifest(seg_dir)
+            seg = manifest["segmentos"].get(key) if manifest else None
+            if seg is None:
+                return None
+    return None
+
+def iter_readings(log_path=iot_stream.DEFAULT_LOG_PATH, start=None, end=None, device_id=None,
+                  seg_dir=None, stats=None):
+    """
+    Mesmo contrato de iot_stream.iter_readings (tuplas (epoch, registro)), mas
+    lendo só os segmentos que cruzam [start, end) e o trecho do log ainda não
+    compactado. Sem segmentos (ou com o log reescrito desde a compactação),
+    cai na varredura completa do log. A parte do intervalo anterior a
+    manifest["retido_desde"] (segmentos apagados pela retenção) também vem
+    da varredura do log, que guarda o histórico completo.
+    'stats', se for um dict, recebe quantos segmentos foram abertos/pulados.
+    """
+    seg_dir = seg_dir or default_segments_dir(log_path)
+    manifest = load_manifest(seg_dir)
+    checkpoint = LogCheckpoint.from_dict(manifest.get("origem")) if manifest else None
+    if checkpoint is None or not checkpoint.is_valid(log_path):
+        yield from iot_stream.iter_readings(log_path, start, end, device_id)
+        return
+
+    retained = manifest.get("retido_desde")
+    if retained is not None and (start is None or start < retained):
+        if end is not None and end <= retained:
+            yield from iot_stream.iter_readings(log_path, start, end, device_id)
+            return
+        yield from iot_stream.iter_readings(log_path, start, retained, device_id)
+        start = retained
+
+    chosen = segments_for(manifest, start, end, device_id)
+    if stats is not None:
+        stats["segmentos_abertos"] = len(chosen)
+        stats["segmentos_total"] = len(manifest["segmentos"])
+        stats["log_antes_de"] = retained if retained is not None and start == retained else None
+
+    for key, seg in chosen:
+        data = _read_segment(seg_dir, key, seg)
+        if not data:
+            continue
+        with gzip.GzipFile(fileobj=io.BytesIO(data)) as gz:
+            for line in gz:
+                rec = json.loads(line)
+                if device_id is not None and rec.get("device_id") != device_id:
+                    continue
+                ts = iot_stream.parse_timestamp(rec.get("timestamp"))
+                if start is not None and ts < start:
+                    continue
+                if end is not None and ts >= end:
+                    continue
+                yield ts, rec
+
+    # trecho do log que chegou depois da última compactação
+    for rec, _ in iot_stream.iter_log_records(log_path, offset=checkpoint.offset):
+        if not iot_stream.is_valid_reading(rec):
+            continue
+        if device_id is not None and rec.get("device_id") != device_id:
+            continue
+        ts = iot_stream.parse_timestamp(rec.get("timestamp"))
+        if start is not None and ts < start:
+            continue
+        if end is not None and ts >= end:
+            continue
+        yield ts, rec
+
+def iter_periodo(periodo, log_path=iot_stream.DEFAULT_LOG_PATH, device_id=None, stats=None):
+    """Leituras do 'periodo' do relatório (ver iot_stream.parse_periodo)."""
+    rng = iot_stream.parse_periodo(periodo) if periodo else None
+    start, end = rng if rng else (None, None)
+    return iter_readings(log_path, start, end, device_id, stats=stats)
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Segmentos comprimidos por dia/hora do log IoT")
+    parser.add_argument("--log", default=iot_stream.DEFAULT_LOG_PATH)
+    parser.add_argument("--dir", default=None, help="diretório dos segmentos (padrão <log>.segments)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_c = sub.add_parser("compact", help="incorpora as leituras novas e sela os segmentos fechados")
+    p_c.add_argument("--granularity", choices=sorted(GRANULARITIES), default=None,
+                     help="dia ou hora (padrão: a do manifest existente, ou day); "
+                          "trocar reconstrói os segmentos")
+    p_c.add_argument("--rebuild", action="store_true")
+    p_c.add_argument("--retain-days", type=float, default=None)
+
+    p_w = sub.add_parser("watch", help="compacta, sela e aplica retenção periodicamente")
+    p_w.add_argument("--granularity", choices=sorted(GRANULARITIES), default=None)
+    p_w.add_argument("--interval", type=float, default=60.0, help="segundos entre ciclos")
+    p_w.add_argument("--retain-days", type=float, default=None)
+
+    p_q = sub.add_parser("query", help="conta as leituras de um período lendo só os segmentos necessários")
+    p_q.add_argument("--periodo", default=None)
+    p_q.add_argument("--device", default=None)
+
+    sub.add_parser("info", help="resumo do manifest")
+
+    args = parser.parse_args()
+    seg_dir = args.dir or default_segments_dir(args.log)
+
+    if args.cmd == "query":
+        stats = {}
+        t0 = time.perf_counter()
+        n = sum(1 for _ in iter_periodo(args.periodo, args.log, args.device, stats=stats))
+        stats.update(leituras=n, segundos=round(time.perf_counter() - t0, 3))
+        print(json.dumps(stats, ensure_ascii=False))
+        return
+
+    granularity = getattr(args, "granularity", None)
+    if granularity is None:
+        manifest = load_manifest(seg_dir)
+        granularity = manifest["granularidade"] if manifest else DEFAULT_GRANULARITY
+    store = SegmentStore(args.log, seg_dir, granularity)
+
+    if args.cmd == "info":
+        print(json.dumps(store.info(), ensure_ascii=False, indent=2))
+    elif args.cmd == "compact":
+        t0 = time.perf_counter()
+        added = store.compact(rebuild=args.rebuild)
+        result = {"compactadas": added, "selados": store.seal(),
+                  "removidos": store.apply_retention(args.retain_days),
+                  "segundos": round(time.perf_counter() - t0, 3)}
+        print(json.dumps(dict(result, **store.info()), ensure_ascii=False))
+    else:
+        def report(result):
+            if any(result.values()):
+                print(f"[segments] {result}", file=sys.stderr, flush=True)
+
+        stop = store.start_background(args.interval, args.retain_days, on_cycle=report)
+        try:
+            while not stop.wait(3600):
+                pass
+        except KeyboardInterrupt:
+            stop.set()
+
+if __name__ == "__main__":
+    main()
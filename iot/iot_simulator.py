@@ -9,16 +9,48 @@ Funcionalidades:
 - Usa automaticamente 'requests' se instalado; caso contrário, utiliza urllib (nativa).
 - Pode rodar continuamente (loop) ou apenas uma vez (--once).
 - Permite alterar: INTERVAL, ENDPOINT e DEVICE_ID via argumentos CLI.
+- Modo frota (--devices N): N dispositivos virtuais em um único processo,
+  com asyncio e um pool limitado de conexões keep-alive (sem threads).
+- Envio em lotes (--batch-size/--batch-ms): várias leituras por requisição,
+  como array JSON ou NDJSON (--format), opcionalmente com gzip (--gzip).
+- Em vez de uma linha por leitura, imprime um resumo periódico
+  (--verbose volta a imprimir cada envio).
+- Benchmark de carga (--bench open|closed): taxa-alvo em malha aberta ou
+  concorrência fixa em malha fechada, com histograma de latências e
+  resultado em JSON (--bench-out) para comparar execuções.
+- Replay (--replay): reenvia o tráfego gravado em iot_log.json (lido em
+  streaming) mantendo os intervalos originais escalados por --speed,
+  com reescrita opcional de timestamp/device e fan-out para N dispositivos.
+- Fila em disco (--outbox DIR): cada leitura é gravada num spool local e uma
+  thread a envia em lotes adaptativos, com backoff exponencial nas falhas;
+  nada se perde numa queda do servidor e o gerador nunca espera a rede nem o
+  disco. Leituras recusadas em definitivo (4xx exceto 408/429) vão para
+  dead-letter.ndjson no spool (ver iot_outbox.py; --outbox-max-mb limita o
+  spool descartando o mais antigo).
 
 Como usar:
     python iot_simulator.py             -> envia dados continuamente
     python iot_simulator.py --once      -> envia apenas 1 leitura
+    python iot_simulator.py --devices 2000 --pool-size 64
+                                        -> 2000 dispositivos, 64 conexões
+    python iot_simulator.py --devices 2000 --batch-size 200 --batch-ms 500 --gzip
+                                        -> lotes de até 200 leituras ou 500 ms
+    python iot_simulator.py --bench open --rate 200 --duration 30 --bench-out r.json
+    python iot_simulator.py --bench closed --concurrency 16 --duration 30
+    python iot_simulator.py --replay ../public/iot/iot_log.json --speed 60 --fanout 50
+    python iot_simulator.py --replay ../public/iot/iot_log.json --speed 0 --rewrite-ts
+    python iot_simulator.py --devices 500 --interval 1 --outbox /tmp/outbox
+                                        -> leituras no spool, envio desacoplado
 """
 
 import time        # controla tempo de espera entre envios
 import json        # conversão de dicionário para JSON
 import random      # gera números aleatórios para simular sensores
 import argparse    # permite enviar parâmetros via terminal
+import asyncio     # laço de eventos do modo frota
+import gzip        # compressão opcional dos lotes
+import threading   # protege os contadores de envio
+from concurrent.futures import ThreadPoolExecutor  # workers do benchmark
 from datetime import datetime  # gera timestamps no formato ISO-8601 UTC
 
 
@@ -35,6 +67,19 @@ INTERVAL = 5
 # ID do dispositivo simulador
 DEVICE_ID = "simulator-001"
 
+# Modo frota: conexões simultâneas, variação do intervalo e frequência do resumo
+POOL_SIZE = 32
+JITTER = 0.1          # ±10% do intervalo, sorteado a cada envio
+SUMMARY_EVERY = 5     # segundos entre linhas de resumo
+
+# Envio em lotes: até BATCH_SIZE leituras ou BATCH_MS milissegundos (1 = sem lote)
+BATCH_SIZE = 1
+BATCH_MS = 1000
+BATCH_FORMAT = "json"   # "json" (array) ou "ndjson" (um objeto por linha)
+
+# Imprime cada envio (comportamento antigo) em vez do resumo periódico
+VERBOSE = False
+
 
 # ============================================================
 # DETECTA AUTOMATICAMENTE QUAL BIBLIOTECA HTTP UTILIZAR
@@ -54,8 +99,11 @@ except Exception:
 # GERAÇÃO DO PAYLOAD SIMULADO DE SENSORES
 # ============================================================
 
-def simulate_readings():
-    """Gera um payload JSON contendo leituras simuladas de sensores IoT."""
+def simulate_readings(device_id=None):
+    """
+    Gera um payload JSON contendo leituras simuladas de sensores IoT.
+    - device_id: identificação do dispositivo (padrão: DEVICE_ID).
+    """
 
     # Temperatura ambiente entre ~20 e 28°C com ruído adicional
     temperature = round(random.uniform(20.0, 28.0) + random.uniform(-0.4, 0.4), 1)
@@ -76,7 +124,7 @@ def simulate_readings():
 
     # Monta o JSON final enviado ao servidor PHP
     payload = {
-        "device_id": DEVICE_ID,
+        "device_id": device_id or DEVICE_ID,
         "timestamp": datetime.utcnow().isoformat() + "Z",
         "temperature": temperature,
         "humidity": humidity,
@@ -120,47 +168,670 @@ def post_with_urllib(payload):
     return status, body
 
 
+# ============================================================
+# CONTADORES DE ENVIO E RESUMO PERIÓDICO
+# ============================================================
+
+class SendStats:
+    """
+    Contadores de envio (leituras, requisições, bytes, erros e latência).
+    Substituem o print por leitura: a cada SUMMARY_EVERY segundos sai uma
+    linha de resumo. Protegidos por lock (usados também por threads).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.readings = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.last_error = None
+        self._last_readings = 0
+        self._last_report = time.monotonic()
+
+    def record(self, readings, nbytes, latency):
+        with self._lock:
+            self.readings += readings
+            self.requests += 1
+            self.bytes_sent += nbytes
+            self.latency_sum += latency
+
+    def record_error(self, error):
+        with self._lock:
+            self.errors += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+
+    def summary(self):
+        """Linha de resumo desde o último relatório (e zera a janela da taxa)."""
+        with self._lock:
+            now = time.monotonic()
+            dt = now - self._last_report
+            rate = (self.readings - self._last_readings) / dt if dt > 0 else 0.0
+            avg_ms = self.latency_sum / self.requests * 1000 if self.requests else 0.0
+            per_req = self.readings / self.requests if self.requests else 0.0
+            line = (f"leituras {self.readings} ({rate:.1f}/s) | requisições {self.requests} "
+                    f"({per_req:.1f} leituras/req) | {self.bytes_sent / 1024:.1f} kB | "
+                    f"erros {self.errors} | latência média {avg_ms:.1f} ms")
+            if self.last_error:
+                line += f" | último erro: {self.last_error}"
+                self.last_error = None
+            self._last_readings = self.readings
+            self._last_report = now
+            return line
+
+    def maybe_report(self, prefix="[resumo]", every=SUMMARY_EVERY):
+        if time.monotonic() - self._last_report >= every:
+            print(f"{prefix} {self.summary()}", flush=True)
+
+# Contadores globais do processo
+STATS = SendStats()
+
+
 # ============================================================
 # FUNÇÃO QUE DECIDE AUTOMATICAMENTE COMO ENVIAR O PAYLOAD
 # ============================================================
 
-def send_payload(payload):
+def send_payload(payload, verbose=None):
+    """
+    Envia uma leitura. Retorna True em caso de sucesso.
+    - verbose: imprime cada envio (padrão: VERBOSE); senão só o resumo periódico.
+    """
+    verbose = VERBOSE if verbose is None else verbose
+    t0 = time.perf_counter()
+    ok = False
     try:
         if _use_requests:
             status, body = post_with_requests(payload)
         else:
             status, body = post_with_urllib(payload)
 
-        print(f"[{payload['timestamp']}] Enviado -> status {status} | payload: {json.dumps(payload)}")
+        STATS.record(1, len(json.dumps(payload)), time.perf_counter() - t0)
+        ok = True
+
+        if verbose:
+            print(f"[{payload['timestamp']}] Enviado -> status {status} | payload: {json.dumps(payload)}")
 
         # opcional:
         # print("Resposta do servidor:", body)
 
     except Exception as e:
-        print(f"[{payload.get('timestamp')}] Erro ao enviar: {e}")
+        STATS.record_error(e)
+        if verbose:
+            print(f"[{payload.get('timestamp')}] Erro ao enviar: {e}")
+
+    if not verbose:
+        STATS.maybe_report()
+    return ok
+
+
+# ============================================================
+# ENVIO EM LOTES (JSON ARRAY OU NDJSON, COM GZIP OPCIONAL)
+# ============================================================
+
+def encode_batch(readings, fmt=BATCH_FORMAT, use_gzip=False):
+    """
+    Serializa um lote de leituras e devolve (corpo_bytes, headers).
+    - fmt="json": um array JSON; fmt="ndjson": um objeto por linha.
+    """
+    if fmt == "ndjson":
+        text = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in readings)
+        headers = {"Content-Type": "application/x-ndjson"}
+    else:
+        text = json.dumps(readings, separators=(",", ":"))
+        headers = {"Content-Type": "application/json"}
+
+    body = text.encode("utf-8")
+    if use_gzip:
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+# requests.Session não é thread-safe: uma sessão keep-alive por thread
+_local = threading.local()
+
+def post_body(body, headers):
+    """POST de um corpo já serializado (requests com sessão keep-alive, ou urllib)."""
+    if _use_requests:
+        session = getattr(_local, "session", None)
+        if session is None:
+            session = _local.session = requests.Session()
+        r = session.post(ENDPOINT, data=body, headers=headers, timeout=6)
+        r.raise_for_status()
+        return r.status_code, r.text
+
+    req = urllib.request.Request(ENDPOINT, data=body, headers=headers)
+    with urllib.request.urlopen(req, timeout=6) as resp:
+        return resp.getcode(), resp.read().decode("utf-8", errors="replace")
+
+def send_batch(readings, fmt=BATCH_FORMAT, use_gzip=False):
+    """Envia um lote em uma única requisição. Retorna True em caso de sucesso."""
+    if not readings:
+        return True
+    body, headers = encode_batch(readings, fmt, use_gzip)
+    t0 = time.perf_counter()
+    try:
+        post_body(body, headers)
+        STATS.record(len(readings), len(body), time.perf_counter() - t0)
+        return True
+    except Exception as e:
+        STATS.record_error(e)
+        return False
+    finally:
+        STATS.maybe_report()
+
+class Batcher:
+    """
+    Acumula leituras e envia quando o lote atinge max_records leituras ou
+    quando a leitura mais antiga do lote passa de max_ms milissegundos.
+    """
+
+    def __init__(self, max_records=BATCH_SIZE, max_ms=BATCH_MS, fmt=BATCH_FORMAT,
+                 use_gzip=False, send=send_batch):
+        self.max_records = max(1, max_records)
+        self.max_age = max_ms / 1000.0
+        self.fmt = fmt
+        self.use_gzip = use_gzip
+        self._send = send
+        self._items = []
+        self._first_at = None
+
+    def add(self, reading):
+        if not self._items:
+            self._first_at = time.monotonic()
+        self._items.append(reading)
+        if len(self._items) >= self.max_records:
+            self.flush()
+
+    def time_left(self):
+        """Segundos até o prazo do lote atual (None se vazio)."""
+        if not self._items:
+            return None
+        return max(0.0, self._first_at + self.max_age - time.monotonic())
+
+    def flush_if_due(self):
+        left = self.time_left()
+        if left is not None and left <= 0:
+            self.flush()
+
+    def flush(self):
+        items, self._items = self._items, []
+        self._first_at = None
+        if items:
+            self._send(items, self.fmt, self.use_gzip)
+
+class AsyncBatcher:
+    """
+    Versão asyncio do Batcher para o modo frota: os dispositivos só
+    acrescentam leituras; os lotes são enviados por tarefas que usam o pool.
+    - slots: asyncio.Semaphore opcional que limita os lotes em voo; com ele,
+      put() espera uma vaga antes de disparar um lote cheio (contrapressão
+      para produtores que não têm ritmo próprio, como o replay com speed=0).
+    """
+
+    def __init__(self, pool, stats, max_records=BATCH_SIZE, max_ms=BATCH_MS,
+                 fmt=BATCH_FORMAT, use_gzip=False, slots=None):
+        self.pool = pool
+        self.slots = slots
+        self.stats = stats
+        self.max_records = max(1, max_records)
+        self.max_age = max_ms / 1000.0
+        self.fmt = fmt
+        self.use_gzip = use_gzip
+        self._items = []
+        self._first_at = None
+        self._inflight = set()
+        self._timer = asyncio.create_task(self._timer_loop())
+
+    def add(self, reading):
+        if not self._items:
+            self._first_at = asyncio.get_running_loop().time()
+        self._items.append(reading)
+        if len(self._items) >= self.max_records:
+            self._spawn_flush()
+
+    async def put(self, reading):
+        """add() com contrapressão: com 'slots', espera uma vaga antes de enviar o lote cheio."""
+        if self.slots is None or len(self._items) + 1 < self.max_records:
+            self.add(reading)
+            return
+        if not self._items:
+            self._first_at = asyncio.get_running_loop().time()
+        self._items.append(reading)
+        await self.slots.acquire()
+        if not self._spawn_flush(acquired=True):
+            self.slots.release()  # o timer já enviou o lote enquanto esperávamos
+
+    def _spawn_flush(self, acquired=False):
+        items, self._items = self._items, []
+        self._first_at = None
+        if not items:
+            return False
+        task = asyncio.create_task(self._send(items, acquired))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+        return True
+
+    async def _send(self, items, acquired=False):
+        if self.slots is not None and not acquired:
+            await self.slots.acquire()
+        body, headers = encode_batch(items, self.fmt, self.use_gzip)
+        content_type = headers.pop("Content-Type")
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        try:
+            await self.pool.post(body, content_type=content_type, headers=headers)
+            self.stats.record(len(items), len(body), loop.time() - t0)
+        except Exception as e:
+            self.stats.record_error(e)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+    async def _timer_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            wait = self.max_age
+            if self._first_at is not None:
+                wait = self._first_at + self.max_age - loop.time()
+                if wait <= 0:
+                    self._spawn_flush()
+                    wait = self.max_age
+            await asyncio.sleep(wait)
+
+    async def close(self):
+        self._timer.cancel()
+        self._spawn_flush()
+        if self._inflight:
+            await asyncio.gather(*list(self._inflight), return_exceptions=True)
+
+
+# ============================================================
+# MODO FROTA: N DISPOSITIVOS VIRTUAIS EM ASYNCIO
+# ============================================================
+
+async def _device_loop(device_id, pool, interval, jitter, stats, stop_at, batcher=None):
+    """
+    Laço de um dispositivo virtual: espera um deslocamento inicial aleatório
+    (para os N dispositivos não dispararem juntos) e depois envia a cada
+    intervalo ± jitter, agendando pelo relógio (sem acumular atraso).
+    - batcher: se informado, a leitura entra no lote em vez de gerar um POST.
+    """
+    loop = asyncio.get_running_loop()
+    next_at = loop.time() + random.uniform(0, interval)
+
+    while stop_at is None or next_at < stop_at:
+        await asyncio.sleep(max(0.0, next_at - loop.time()))
+
+        payload = simulate_readings(device_id)
+        if batcher is not None:
+            batcher.add(payload)
+        else:
+            body = json.dumps(payload).encode("utf-8")
+            t0 = loop.time()
+            try:
+                await pool.post(body)
+                stats.record(1, len(body), loop.time() - t0)
+            except Exception as e:
+                stats.record_error(e)
+
+        next_at += interval * (1 + random.uniform(-jitter, jitter))
+        # se o envio demorou mais que um intervalo, não tenta "compensar" em rajada
+        next_at = max(next_at, loop.time())
+
+async def _fleet_reporter(stats, pool, devices, every, outbox=None):
+    """Imprime uma linha de resumo a cada 'every' segundos."""
+    while True:
+        await asyncio.sleep(every)
+        print(f"[frota] {devices} dispositivos | {stats.summary()} | "
+              f"conexões abertas {pool.connections_opened}", flush=True)
+        if outbox is not None:
+            print(f"[outbox] {outbox.summary()}", flush=True)
+
+async def run_fleet(devices, interval=INTERVAL, pool_size=POOL_SIZE, jitter=JITTER,
+                    duration=None, summary_every=SUMMARY_EVERY,
+                    batch_size=BATCH_SIZE, batch_ms=BATCH_MS, fmt=BATCH_FORMAT, use_gzip=False,
+                    outbox=None):
+    """
+    Roda 'devices' dispositivos virtuais em um único laço asyncio,
+    compartilhando no máximo 'pool_size' conexões keep-alive com o ENDPOINT.
+    - duration: segundos até encerrar (None = até Ctrl+C).
+    - batch_size > 1: leituras de todos os dispositivos são agrupadas em lotes.
+    - outbox: OutboxSender; as leituras vão para o spool e a thread dele envia.
+    """
+    from async_http import AsyncHTTPPool
+
+    pool = AsyncHTTPPool(ENDPOINT, size=pool_size, timeout=6)
+    stats = outbox.stats if outbox is not None else SendStats()
+    batcher = None
+    if outbox is not None:
+        batcher = outbox.outbox        # mesmo add() do lote, mas só grava em disco
+    elif batch_size > 1:
+        batcher = AsyncBatcher(pool, stats, batch_size, batch_ms, fmt, use_gzip)
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + duration if duration else None
+
+    width = max(3, len(str(devices)))
+    tasks = [
+        asyncio.create_task(
+            _device_loop(f"{DEVICE_ID}-{i:0{width}d}", pool, interval, jitter, stats, stop_at, batcher)
+        )
+        for i in range(1, devices + 1)
+    ]
+    reporter = asyncio.create_task(_fleet_reporter(stats, pool, devices, summary_every, outbox))
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        reporter.cancel()
+        for t in tasks:
+            t.cancel()
+        if outbox is not None:
+            outbox.stop()
+            outbox.outbox.close()
+        elif batcher is not None:
+            await batcher.close()
+        await pool.close()
+
+    print(f"[frota] fim: {stats.summary()} | conexões abertas {pool.connections_opened}")
+    if outbox is not None:
+        print(f"[outbox] fim: {outbox.summary()}")
+    return stats
+
+# ============================================================
+# BENCHMARK DE CARGA (MALHA ABERTA E MALHA FECHADA)
+# ============================================================
+
+def _bench_request(batch_size, fmt, use_gzip):
+    """Uma operação do benchmark: uma leitura (send_payload) ou um lote (send_batch)."""
+    if batch_size > 1:
+        return send_batch([simulate_readings() for _ in range(batch_size)], fmt, use_gzip)
+    return send_payload(simulate_readings(), verbose=False)
+
+def run_bench(mode, duration=30.0, rate=50.0, concurrency=8, batch_size=1,
+              fmt=BATCH_FORMAT, use_gzip=False, out_path=None, max_queue=None):
+    """
+    Mede o endpoint de ingestão.
+    - mode="open": dispara 'rate' requisições/s em horários fixos
+      (t0 + i/rate, sem deriva), independentemente das respostas; a latência é
+      contada a partir do horário agendado, então filas no cliente aparecem
+      nos percentis (sem "coordinated omission"). Até 'max_queue' requisições
+      (padrão 4 x concurrency) podem esperar por um worker livre; além disso
+      são descartadas e contadas, e as que começam mais de um intervalo
+      depois do horário agendado são contadas como atrasadas.
+    - mode="closed": 'concurrency' workers enviando em sequência, cada um
+      aguardando a resposta anterior.
+    Retorna (e opcionalmente grava em out_path) um dicionário com vazão,
+    taxa de erro e percentis p50/p95/p99/max.
+    """
+    from latency_histogram import LatencyHistogram
+
+    hist = LatencyHistogram()        # latência percebida (desde o horário agendado)
+    service = LatencyHistogram()     # tempo de serviço (desde o envio real)
+    lock = threading.Lock()
+    counters = {"ok": 0, "erros": 0, "descartadas": 0, "atrasadas": 0}
+    interval = 1.0 / rate if mode == "open" else None
+    if max_queue is None:
+        max_queue = 4 * concurrency
+    slots = threading.BoundedSemaphore(concurrency + max_queue)
+
+    def one(scheduled):
+        try:
+            started = time.perf_counter()
+            ok = _bench_request(batch_size, fmt, use_gzip)
+            done = time.perf_counter()
+            with lock:
+                hist.record(done - (scheduled if scheduled is not None else started))
+                service.record(done - started)
+                counters["ok" if ok else "erros"] += 1
+                if scheduled is not None and started - scheduled > interval:
+                    counters["atrasadas"] += 1
+        finally:
+            if scheduled is not None:
+                slots.release()
+
+    t0 = time.perf_counter()
+    deadline = t0 + duration
+
+    if mode == "open":
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            i = 0
+            while True:
+                scheduled = t0 + i * interval
+                if scheduled >= deadline:
+                    break
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if slots.acquire(blocking=False):
+                    pool.submit(one, scheduled)
+                else:
+                    counters["descartadas"] += 1   # fila do cliente cheia: o endpoint não acompanha
+                i += 1
+    else:
+        def worker():
+            while time.perf_counter() < deadline:
+                one(None)
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    elapsed = time.perf_counter() - t0
+    total = counters["ok"] + counters["erros"]
+    result = {
+        "modo": mode,
+        "endpoint": ENDPOINT,
+        "inicio": datetime.utcnow().isoformat() + "Z",
+        "duracao_s": round(elapsed, 3),
+        "taxa_alvo_rps": rate if mode == "open" else None,
+        "concorrencia": concurrency,
+        "leituras_por_requisicao": batch_size,
+        "formato": fmt if batch_size > 1 else "json",
+        "gzip": bool(use_gzip and batch_size > 1),
+        "requisicoes": total,
+        "erros": counters["erros"],
+        "taxa_erro": round(counters["erros"] / total, 4) if total else 0.0,
+        "descartadas": counters["descartadas"] if mode == "open" else None,
+        "atrasadas": counters["atrasadas"] if mode == "open" else None,
+        "fila_maxima": max_queue if mode == "open" else None,
+        "throughput_rps": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+        "leituras_por_s": round(counters["ok"] * batch_size / elapsed, 2) if elapsed > 0 else 0.0,
+        "latencia_ms": hist.summary_ms(),
+        "servico_ms": service.summary_ms(),
+        "histograma_us": hist.to_dict(),
+    }
+
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return result
+
+def _print_bench(result):
+    lat = result["latencia_ms"]
+    print(f"[bench] modo {result['modo']} | {result['requisicoes']} requisições em "
+          f"{result['duracao_s']} s | {result['throughput_rps']} req/s "
+          f"({result['leituras_por_s']} leituras/s) | erros {result['taxa_erro']:.2%}")
+    if result.get("descartadas") or result.get("atrasadas"):
+        print(f"[bench] endpoint abaixo da taxa-alvo: {result['descartadas']} descartadas "
+              f"(fila > {result['fila_maxima']}) | {result['atrasadas']} atrasadas")
+    print(f"[bench] latência ms: p50 {lat['p50']} | p95 {lat['p95']} | p99 {lat['p99']} | "
+          f"max {lat['max']} | média {lat['media']}")
+
+
+# ============================================================
+# REPLAY DO TRÁFEGO GRAVADO (iot_log.json)
+# ============================================================
+
+def _replay_copies(rec, fanout, rewrite_ts, rewrite_device):
+    """Gera as cópias de um registro gravado a enviar (uma por dispositivo virtual)."""
+    base = dict(rec)
+    base.pop("received_at", None)
+    if rewrite_ts:
+        base["timestamp"] = datetime.utcnow().isoformat() + "Z"
+    if rewrite_device:
+        base["device_id"] = DEVICE_ID
+    if fanout <= 1:
+        return [base]
+
+    origin = base.get("device_id") or DEVICE_ID
+    width = max(2, len(str(fanout)))
+    return [dict(base, device_id=f"{origin}-v{i:0{width}d}") for i in range(1, fanout + 1)]
+
+async def run_replay(path, speed=1.0, fanout=1, rewrite_ts=False, rewrite_device=False,
+                     max_gap=None, pool_size=POOL_SIZE, duration=None, summary_every=SUMMARY_EVERY,
+                     batch_size=BATCH_SIZE, batch_ms=BATCH_MS, fmt=BATCH_FORMAT, use_gzip=False):
+    """
+    Reenvia o log gravado preservando a forma do tráfego.
+    - O arquivo é lido em streaming (iot_stream), sem carregar o array inteiro.
+    - Cada registro é agendado em t0 + (ts - ts0) / speed (horário absoluto,
+      sem deriva); registros fora de ordem saem logo após o anterior, sem
+      atrasar o relógio. speed=0 envia o mais rápido possível.
+    - max_gap: limita (em segundos do tempo gravado) cada intervalo entre
+      registros, útil para pular madrugadas/dias sem dados.
+    - fanout: cada registro é enviado como N dispositivos virtuais.
+    """
+    import iot_stream
+    from async_http import AsyncHTTPPool
+
+    pool = AsyncHTTPPool(ENDPOINT, size=pool_size, timeout=6)
+    stats = SendStats()
+    # Limita os envios pendentes (leituras avulsas ou lotes) para a memória não
+    # crescer no modo "o mais rápido possível"
+    inflight = asyncio.Semaphore(pool_size * 4)
+
+    batcher = None
+    if batch_size > 1:
+        batcher = AsyncBatcher(pool, stats, batch_size, batch_ms, fmt, use_gzip, slots=inflight)
+
+    async def post_one(reading):
+        body = json.dumps(reading).encode("utf-8")
+        t0 = loop.time()
+        try:
+            await pool.post(body)
+            stats.record(1, len(body), loop.time() - t0)
+        except Exception as e:
+            stats.record_error(e)
+        finally:
+            inflight.release()
+
+    loop = asyncio.get_running_loop()
+    reporter = asyncio.create_task(_fleet_reporter(stats, pool, fanout, summary_every))
+    started = loop.time()
+    stop_at = started + duration if duration else None
+    tasks = set()
+
+    prev_ts = None
+    replay_clock = 0.0   # segundos de tempo gravado desde o primeiro registro (com max_gap)
+    replayed = 0
+
+    try:
+        for rec, _ in iot_stream.iter_log_records(path):
+            if not iot_stream.is_valid_reading(rec):
+                continue
+            ts = iot_stream.parse_timestamp(rec.get("timestamp"))
+            if prev_ts is not None:
+                gap = max(0.0, ts - prev_ts)  # fora de ordem: envia em seguida
+                if max_gap is not None:
+                    gap = min(gap, max_gap)
+                replay_clock += gap
+            # marca d'água: um registro atrasado não faz o próximo intervalo
+            # ser contado de novo a partir do timestamp mais antigo
+            prev_ts = ts if prev_ts is None else max(prev_ts, ts)
+
+            if speed > 0:
+                due = started + replay_clock / speed
+                if stop_at is not None and due >= stop_at:
+                    break
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif stop_at is not None and loop.time() >= stop_at:
+                break
+
+            for reading in _replay_copies(rec, fanout, rewrite_ts, rewrite_device):
+                if batcher is not None:
+                    await batcher.put(reading)
+                    continue
+                await inflight.acquire()
+                task = asyncio.create_task(post_one(reading))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            replayed += 1
+
+            if speed <= 0 and replayed % 256 == 0:
+                await asyncio.sleep(0)  # deixa os envios andarem
+
+        if tasks:
+            await asyncio.gather(*list(tasks), return_exceptions=True)
+    finally:
+        reporter.cancel()
+        if batcher is not None:
+            await batcher.close()
+        await pool.close()
+
+    print(f"[replay] fim: {replayed} registros gravados x {fanout} dispositivos | {stats.summary()}")
+    return stats
 
 
 # ============================================================
 # LOOP PRINCIPAL DO SIMULADOR
 # ============================================================
 
-def main(loop=True, interval=INTERVAL):
+def main(loop=True, interval=INTERVAL, batcher=None, outbox=None):
     print("Iniciando simulador IoT...")
     print("Endpoint alvo:", ENDPOINT)
     print("Usando requests?", _use_requests)
 
+    last_report = time.monotonic()
     try:
         while True:
             payload = simulate_readings()  # gera dados simulados
-            send_payload(payload)          # envia ao servidor PHP
+
+            if outbox is not None:
+                outbox.outbox.add(payload) # grava no spool; a thread do OutboxSender envia
+                if not VERBOSE and time.monotonic() - last_report >= SUMMARY_EVERY:
+                    print(f"[resumo] {STATS.summary()}")
+                    print(f"[outbox] {outbox.summary()}", flush=True)
+                    last_report = time.monotonic()
+            elif batcher is None:
+                send_payload(payload)      # envia ao servidor PHP
+            else:
+                batcher.add(payload)       # entra no lote (enviado por tamanho ou prazo)
 
             if not loop:  # modo --once
                 break
 
-            time.sleep(interval)
+            if batcher is None:
+                time.sleep(interval)
+                continue
+
+            # Espera o próximo envio, mas descarrega o lote se o prazo vencer antes
+            next_at = time.monotonic() + interval
+            while True:
+                remaining = next_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                left = batcher.time_left()
+                if left is not None and left <= remaining:
+                    time.sleep(left)
+                    batcher.flush_if_due()
+                else:
+                    time.sleep(remaining)
 
     except KeyboardInterrupt:
         print("Simulador interrompido pelo usuário.")
+    finally:
+        if batcher is not None:
+            batcher.flush()
+        if outbox is not None:
+            outbox.stop()
+            outbox.outbox.close()
+        if STATS.requests or STATS.errors:
+            print(f"[resumo] {STATS.summary()}")
+        if outbox is not None:
+            print(f"[outbox] {outbox.summary()}")
 
 
 # ============================================================
@@ -188,6 +859,62 @@ if __name__ == "__main__":
     parser.add_argument("--device", type=str, default=DEVICE_ID,
                         help="device_id a incluir no payload")
 
+    # Modo frota: N dispositivos virtuais em um processo
+    parser.add_argument("--devices", type=int, default=0,
+                        help="número de dispositivos virtuais (modo frota asyncio)")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE,
+                        help="máximo de conexões keep-alive no modo frota (padrão 32)")
+    parser.add_argument("--jitter", type=float, default=JITTER,
+                        help="variação relativa do intervalo por envio (padrão 0.1)")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="encerra o modo frota/benchmark após N segundos")
+
+    # Envio em lotes
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="leituras por requisição (padrão 1 = sem lote)")
+    parser.add_argument("--batch-ms", type=float, default=BATCH_MS,
+                        help="prazo máximo de um lote em ms (padrão 1000)")
+    parser.add_argument("--format", choices=("json", "ndjson"), default=BATCH_FORMAT,
+                        help="formato do lote: array JSON ou NDJSON")
+    parser.add_argument("--gzip", action="store_true",
+                        help="comprime o corpo dos lotes com gzip")
+    parser.add_argument("--verbose", action="store_true",
+                        help="imprime cada envio em vez do resumo periódico")
+
+    # Benchmark de carga
+    parser.add_argument("--bench", choices=("open", "closed"), default=None,
+                        help="benchmark: taxa fixa (open) ou concorrência fixa (closed)")
+    parser.add_argument("--rate", type=float, default=50.0,
+                        help="requisições/s no modo --bench open (padrão 50)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="workers do benchmark (padrão 8)")
+    parser.add_argument("--max-queue", type=int, default=None,
+                        help="requisições aguardando worker no --bench open antes de descartar (padrão 4 x concurrency)")
+    parser.add_argument("--bench-out", type=str, default=None,
+                        help="arquivo JSON com o resultado do benchmark")
+
+    # Replay do tráfego gravado
+    parser.add_argument("--replay", type=str, default=None,
+                        help="reenvia um iot_log.json (ou NDJSON) gravado")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="fator de aceleração do replay (60 = 1 min por segundo; 0 = máximo)")
+    parser.add_argument("--fanout", type=int, default=1,
+                        help="envia cada registro gravado como N dispositivos virtuais")
+    parser.add_argument("--rewrite-ts", action="store_true",
+                        help="substitui o timestamp gravado pelo horário do envio")
+    parser.add_argument("--rewrite-device", action="store_true",
+                        help="substitui o device_id gravado pelo de --device")
+    parser.add_argument("--max-gap", type=float, default=None,
+                        help="limita cada intervalo gravado a N segundos (pula lacunas longas)")
+
+    # Fila em disco (envio desacoplado da geração)
+    parser.add_argument("--outbox", type=str, default=None,
+                        help="diretório do spool local; leituras são enviadas por uma thread")
+    parser.add_argument("--outbox-max-mb", type=float, default=128,
+                        help="tamanho máximo do spool em MB; acima dele descarta o mais antigo")
+    parser.add_argument("--outbox-max-batch", type=int, default=500,
+                        help="maior lote que o envio adaptativo do spool pode usar")
+
     args = parser.parse_args()
 
     # Sobrescreve configurações com valores da CLI
@@ -197,5 +924,44 @@ if __name__ == "__main__":
     if args.device:
         DEVICE_ID = args.device
 
+    VERBOSE = args.verbose
+
+    outbox = None
+    if args.outbox and not (args.bench or args.replay):
+        from iot_outbox import Outbox, OutboxSender
+        outbox = OutboxSender(Outbox(args.outbox, max_bytes=int(args.outbox_max_mb * (1 << 20))),
+                              post_body, args.format, args.gzip, stats=STATS,
+                              max_batch=args.outbox_max_batch).start()
+        print(f"Outbox em {args.outbox}: {outbox.outbox.depth()} leituras pendentes")
+
     # Executa o simulador
-    main(loop=not args.once, interval=args.interval)
+    if args.bench:
+        result = run_bench(args.bench, args.duration or 30.0, args.rate, args.concurrency,
+                           args.batch_size, args.format, args.gzip, args.bench_out,
+                           args.max_queue)
+        _print_bench(result)
+        if args.bench_out:
+            print(f"[bench] resultado gravado em {args.bench_out}")
+    elif args.replay:
+        print(f"Iniciando replay de {args.replay} (velocidade {args.speed or 'máxima'}x) -> {ENDPOINT}")
+        try:
+            asyncio.run(run_replay(args.replay, args.speed, args.fanout, args.rewrite_ts,
+                                   args.rewrite_device, args.max_gap, args.pool_size,
+                                   args.duration, batch_size=args.batch_size,
+                                   batch_ms=args.batch_ms, fmt=args.format, use_gzip=args.gzip))
+        except KeyboardInterrupt:
+            print("Simulador interrompido pelo usuário.")
+    elif args.devices > 0:
+        print(f"Iniciando frota IoT: {args.devices} dispositivos -> {ENDPOINT}")
+        try:
+            asyncio.run(run_fleet(args.devices, args.interval, args.pool_size,
+                                  args.jitter, args.duration,
+                                  batch_size=args.batch_size, batch_ms=args.batch_ms,
+                                  fmt=args.format, use_gzip=args.gzip, outbox=outbox))
+        except KeyboardInterrupt:
+            print("Simulador interrompido pelo usuário.")
+    else:
+        batcher = None
+        if args.batch_size > 1 and outbox is None:
+            batcher = Batcher(args.batch_size, args.batch_ms, args.format, args.gzip)
+        main(loop=not args.once, interval=args.interval, batcher=batcher, outbox=outbox)
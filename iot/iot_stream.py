@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# iot_stream.py
+#
+# Leitura incremental (streaming) do histórico IoT gravado pelo PHP em
+# public/iot/iot_log.json. O arquivo é um único array JSON "pretty-printed"
+# que só cresce; carregar tudo com json.load custa memória proporcional ao
+# tamanho do arquivo. Aqui o arquivo é lido em blocos e cada objeto é
+# decodificado isoladamente com JSONDecoder.raw_decode, então o uso de
+# memória fica limitado ao tamanho de um bloco + um registro.
+#
+# O mesmo leitor aceita NDJSON (um objeto por linha), pois vírgulas,
+# colchetes e quebras de linha entre objetos são tratados como separadores.
+
+import os
+import json
+import codecs
+from datetime import datetime, timezone, timedelta
+
+# Caminho padrão do log (pode ser sobrescrito pela variável IOT_LOG_PATH)
+DEFAULT_LOG_PATH = os.environ.get("IOT_LOG_PATH") or os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "public", "iot", "iot_log.json")
+)
+
+# Métricas numéricas de uma leitura, já "achatadas" (energy.instant -> energy_instant)
+METRICS = (
+    "temperature",
+    "humidity",
+    "oxygen",
+    "co2",
+    "energy_instant",
+    "energy_total",
+    "energy_peak",
+)
+
+_SEPARATORS = " \t\r\n,[]"
+
+# Se o buffer passar disto sem conseguir decodificar um objeto, o trecho é lixo
+_MAX_PENDING_CHARS = 1 << 20
+
+# -------------------------
+# Leitura em streaming
+# -------------------------
+
+def iter_log_records(path=DEFAULT_LOG_PATH, offset=0, chunk_size=1 << 16):
+    """
+    Itera sobre os objetos do log sem carregar o arquivo inteiro.
+    - Produz tuplas (registro, offset_em_bytes_logo_após_o_registro).
+      O offset pode ser guardado e passado de volta para retomar a leitura.
+    - Um objeto incompleto no final do arquivo (escrita em andamento) é ignorado
+      e não avança o offset.
+    - Trechos que não podem ser decodificados são pulados até o próximo '{'.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        byte_pos = offset   # offset em bytes correspondente a buf[base]
+        buf = ""
+        base = 0            # início do trecho ainda não contabilizado em byte_pos
+        idx = 0
+        eof = False
+
+        while True:
+            n = len(buf)
+            while idx < n and buf[idx] in _SEPARATORS:
+                idx += 1
+
+            if idx < n:
+                try:
+                    obj, end = decoder.raw_decode(buf, idx)
+                except json.JSONDecodeError:
+                    end = -1
+
+                if end != -1:
+                    byte_pos += len(buf[base:end].encode("utf-8"))
+                    base = idx = end
+                    yield obj, byte_pos
+                    continue
+
+                if eof or n - idx > _MAX_PENDING_CHARS:
+                    # Não é um registro truncado: pula o lixo até o próximo objeto
+                    nxt = buf.find("{", idx + 1)
+                    if nxt == -1:
+                        if eof:
+                            return
+                        nxt = n
+                    byte_pos += len(buf[base:nxt].encode("utf-8"))
+                    base = idx = nxt
+                    continue
+
+            elif eof:
+                return
+
+            # Precisa de mais dados: descarta o que já foi consumido e lê outro bloco
+            byte_pos += len(buf[base:idx].encode("utf-8"))
+            buf = buf[idx:]
+            base = idx = 0
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                buf += utf8.decode(b"", final=True)
+            else:
+                buf += utf8.decode(chunk)
+
+def iter_readings(path=DEFAULT_LOG_PATH, start=None, end=None, device_id=None):
+    """
+    Itera apenas sobre leituras válidas, opcionalmente filtradas por intervalo
+    [start, end) em epoch (segundos UTC) e por device_id.
+    Produz tuplas (epoch, registro).
+    """
+    for rec, _ in iter_log_records(path):
+        if not is_valid_reading(rec):
+            continue
+        if device_id is not None and rec.get("device_id") != device_id:
+            continue
+        ts = parse_timestamp(rec.get("timestamp"))
+        if start is not None and ts < start:
+            continue
+        if end is not None and ts >= end:
+            continue
+        yield ts, rec
+
+# -------------------------
+# Validação e normalização
+# -------------------------
+
+def is_valid_reading(rec):
+    """
+    True se o registro parece uma leitura do simulador: precisa de timestamp
+    interpretável e de pelo menos uma métrica numérica. Descarta entradas de
+    teste como {"teste": "ok"}.
+    """
+    if not isinstance(rec, dict):
+        return False
+    if parse_timestamp(rec.get("timestamp")) is None:
+        return False
+    values = reading_values(rec)
+    return any(v is not None for v in values.values())
+
+def reading_values(rec):
+    """Extrai as métricas numéricas do registro (None quando ausentes/inválidas)."""
+    energy = rec.get("energy")
+    if not isinstance(energy, dict):
+        energy = {}
+    return {
+        "temperature": _num(rec.get("temperature")),
+        "humidity": _num(rec.get("humidity")),
+        "oxygen": _num(rec.get("oxygen")),
+        "co2": _num(rec.get("co2")),
+        "energy_instant": _num(energy.get("instant")),
+        "energy_total": _num(energy.get("total")),
+        "energy_peak": _num(energy.get("peak")),
+    }
+
+def _num(v):
+    if isinstance(v, bool):
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    if isinstance(v, str):
+        try:
+            return float(v)
+        except ValueError:
+            return None
+    return None
+
+def parse_timestamp(raw):
+    """
+    Converte o timestamp do registro em epoch (float, segundos UTC).
+    Aceita ISO-8601 (com ou sem 'Z' e frações) e epoch numérico em s ou ms.
+    Retorna None se não for possível interpretar.
+    """
+    if raw is None or isinstance(raw, bool):
+        return None
+
+    if isinstance(raw, (int, float)):
+        v = float(raw)
+        return v / 1000.0 if v > 1e12 else v
+
+    if not isinstance(raw, str) or not raw.strip():
+        return None
+
+    s = raw.strip()
+    if s.endswith("Z"):
+        s = s[:-1] + "+00:00"
+    try:
+        dt = datetime.fromisoformat(s)
+    except ValueError:
+        try:
+            return parse_timestamp(float(s))
+        except ValueError:
+            return None
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+# -------------------------
+# Período do relatório
+# -------------------------
+
+def parse_periodo(periodo):
+    """
+    Converte o 'periodo' do relatório em um intervalo [inicio, fim) em epoch UTC.
+    Formatos aceitos:
+      - "2025-11-20"              -> o dia inteiro
+      - "2025-11"                 -> o mês inteiro
+      - "2025"                    -> o ano inteiro
+      - "2025-11-18/2025-11-27"   -> do início do 1º ao fim do 2º (inclusive)
+      - datas/horas ISO completas também são aceitas nas pontas do intervalo
+    Retorna None se o período não puder ser interpretado.
+    """
+    if not isinstance(periodo, str) or not periodo.strip():
+        return None
+
+    s = periodo.strip()
+    if "/" in s:
+        a, _, b = s.partition("/")
+        ra, rb = _parse_bound(a.strip()), _parse_bound(b.strip())
+        if ra is None or rb is None:
+            return None
+        return ra[0], rb[1]
+
+    return _parse_bound(s)
+
+def _parse_bound(s):
+    """Interpreta uma ponta do período, devolvendo (inicio, fim) da unidade indicada."""
+    try:
+        if len(s) == 4 and s.isdigit():
+            y = int(s)
+            return _epoch(y, 1, 1), _epoch(y + 1, 1, 1)
+        if len(s) == 7 and s[4] == "-":
+            y, m = int(s[:4]), int(s[5:7])
+            ny, nm = (y + 1, 1) if m == 12 else (y, m + 1)
+            return _epoch(y, m, 1), _epoch(ny, nm, 1)
+        if len(s) == 10:
+            d = datetime.strptime(s, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+            return d.timestamp(), (d + timedelta(days=1)).timestamp()
+    except ValueError:
+        return None
+
+    ts = parse_timestamp(s)
+    if ts is None:
+        return None
+    return ts, ts + 1e-6
+
+def _epoch(y, m, d):
+    return datetime(y, m, d, tzinfo=timezone.utc).timestamp()
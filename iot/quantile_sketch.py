@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# quantile_sketch.py
+#
+# Sketch de quantis KLL (Karnin, Lang, Liberty, 2016): resume um fluxo de
+# valores em memória limitada e responde percentis com erro de rank
+# garantido, sem guardar cada amostra.
+#
+# Os valores ficam em "compactadores" empilhados; no nível h cada item vale
+# 2^h amostras. Quando um nível enche, ele é ordenado e metade dos itens
+# (os de posição par ou ímpar, sorteado) sobe para o nível seguinte. As
+# capacidades decrescem geometricamente (fator 2/3) dos níveis altos para os
+# baixos, então a memória fica em ~3k itens seja qual for o número de
+# amostras. Dois sketches com o mesmo k se combinam nível a nível (merge), o
+# que permite guardar um por dia/dispositivo e somá-los na consulta.
+#
+# Erro: com k=200, o rank de um quantil fica a menos de ~1,3% do verdadeiro
+# com 99% de confiança (fórmula empírica do Apache DataSketches,
+# 2.296 / k^0.9723). Enquanto nada foi compactado, o resultado é exato.
+# add() é O(1) amortizado: a compactação ordena um nível de O(k) itens a
+# cada O(k) inserções.
+
+import math
+import random
+
+DEFAULT_K = 200
+_C = 2.0 / 3.0
+_MIN_WIDTH = 8
+
+# Semente fixa: mesmos dados na mesma ordem => mesmo sketch (relatórios reproduzíveis)
+_SEED = 0x4B4C4C
+
+def rank_error(k):
+    """Erro de rank normalizado (99% de confiança) de um sketch KLL com parâmetro k."""
+    return 2.296 / k ** 0.9723
+
+class KLLSketch:
+    """Sketch de quantis KLL com add, merge, percentis e serialização."""
+
+    __slots__ = ("k", "count", "min", "max", "_levels", "_size", "_max_size", "_rng", "_view")
+
+    def __init__(self, k=DEFAULT_K):
+        self.k = k
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._levels = [[]]
+        self._size = 0
+        self._max_size = self._capacity(0)
+        self._rng = random.Random(_SEED)
+        self._view = None
+
+    def _capacity(self, h):
+        depth = len(self._levels) - h - 1
+        return max(_MIN_WIDTH, int(math.ceil(self.k * _C ** depth)))
+
+    def _grow(self):
+        self._levels.append([])
+        self._max_size = sum(self._capacity(h) for h in range(len(self._levels)))
+
+    def _compress(self):
+        for h in range(len(self._levels)):
+            level = self._levels[h]
+            if len(level) < self._capacity(h):
+                continue
+            if h + 1 == len(self._levels):
+                self._grow()
+            level.sort()
+            # com tamanho ímpar o menor item fica no nível; o resto vai em pares
+            keep = level[:1] if len(level) % 2 else []
+            rest = level[len(keep):]
+            self._levels[h + 1].extend(rest[self._rng.getrandbits(1)::2])
+            self._levels[h] = keep
+            self._size = sum(len(lv) for lv in self._levels)
+            if self._size < self._max_size:
+                break
+
+    # ---- registro ----
+
+    def add(self, v):
+        self._levels[0].append(v)
+        self._size += 1
+        self.count += 1
+        if self.min is None or v < self.min:
+            self.min = v
+        if self.max is None or v > self.max:
+            self.max = v
+        self._view = None
+        if self._size >= self._max_size:
+            self._compress()
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        if other.k != self.k:
+            raise ValueError("sketches com k diferentes")
+        while len(self._levels) < len(other._levels):
+            self._grow()
+        for h, level in enumerate(other._levels):
+            self._levels[h].extend(level)
+        self._size = sum(len(lv) for lv in self._levels)
+        self.count += other.count
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        self._view = None
+        while self._size >= self._max_size:
+            self._compress()
+        return self
+
+    # ---- consulta ----
+
+    @property
+    def exact(self):
+        """True enquanto nenhum nível foi compactado (todos os itens pesam 1)."""
+        return len(self._levels) == 1 or all(not lv for lv in self._levels[1:])
+
+    @property
+    def error(self):
+        """Erro de rank normalizado dos quantis deste sketch (0 se exato)."""
+        return 0.0 if self.exact else rank_error(self.k)
+
+    def _sorted_view(self):
+        if self._view is None:
+            items = sorted((v, 1 << h) for h, lv in enumerate(self._levels) for v in lv)
+            values, cum, total = [], [], 0
+            for v, w in items:
+                total += w
+                values.append(v)
+                cum.append(total)
+            self._view = (values, cum)
+        return self._view
+
+    def quantile(self, q):
+        """Menor valor cuja fração acumulada de amostras alcança q (0..1)."""
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        values, cum = self._sorted_view()
+        target = math.ceil(q * self.count - 1e-9)
+        lo, hi = 0, len(cum) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if cum[mid] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return values[lo]
+
+    def percentile(self, p):
+        return self.quantile(p / 100.0)
+
+    def bounds(self, p):
+        """Intervalo [baixo, alto] que contém o percentil p verdadeiro (com 99% de confiança)."""
+        eps = self.error
+        q = p / 100.0
+        return self.quantile(q - eps), self.quantile(q + eps)
+
+    def summary(self, percentiles=(50, 95, 99), digits=3):
+        """Percentis, limites de erro e contagem, prontos para JSON."""
+        out = {
+            "amostras": self.count,
+            "min": self.min,
+            "max": self.max,
+            "exato": self.exact,
+            "erro_rank": round(self.error, 4),
+            "limites": {},
+        }
+        for p in percentiles:
+            key = "p" + f"{p:g}".replace(".", "_")
+            out[key] = round(self.percentile(p), digits)
+            lo, hi = self.bounds(p)
+            out["limites"][key] = [round(lo, digits), round(hi, digits)]
+        return out
+
+    # ---- serialização ----
+
+    def to_list(self):
+        return [self.k, self.count, self.min, self.max, self._levels]
+
+    @classmethod
+    def from_list(cls, data):
+        sk = cls(data[0])
+        sk.count, sk.min, sk.max = data[1], data[2], data[3]
+        sk._levels = [list(lv) for lv in data[4]] or [[]]
+        sk._size = sum(len(lv) for lv in sk._levels)
+        sk._max_size = sum(sk._capacity(h) for h in range(len(sk._levels)))
+        return sk
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# report_cache.py
+#
+# Cache endereçado por conteúdo para os relatórios do report_generator.
+#
+# A chave é o SHA-256 do JSON canônico (chaves ordenadas, números
+# normalizados) de {ação, payload normalizado, versão dos dados IoT}. A
+# versão dos dados muda sempre que o iot_log.json cresce ou é reescrito,
+# então um relatório com KPIs derivados do log nunca é servido velho.
+#
+# Dois níveis:
+#   - memória: LRU limitado por número de entradas (por processo);
+#   - disco (opcional): um arquivo por chave, com TTL e teto de tamanho
+#     total; ao passar do teto, os arquivos usados há mais tempo saem primeiro.
+#     Como as gravações são atômicas, vários processos (modo lote, serviço)
+#     podem compartilhar o mesmo diretório.
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from iot_aggregates import write_json_atomic
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_DISK_MAX_MB = 64
+
+def canonical(obj):
+    """
+    Forma canônica para hashing: floats inteiros viram int (1.0 == 1),
+    tuplas viram listas; dicionários são ordenados na serialização.
+    """
+    if isinstance(obj, dict):
+        return {str(k): canonical(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [canonical(v) for v in obj]
+    if isinstance(obj, float) and obj.is_integer():
+        return int(obj)
+    return obj
+
+def cache_key(*parts):
+    """SHA-256 (hex) do JSON canônico das partes."""
+    data = json.dumps(canonical(list(parts)), sort_keys=True, ensure_ascii=False,
+                      separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def file_version(path):
+    """
+    Versão barata de um arquivo de dados: tamanho + mtime (ns) + inode.
+    O log só cresce, então qualquer leitura nova muda o tamanho; uma
+    reescrita do mesmo tamanho muda o mtime. None se o arquivo não existe.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{st.st_size}:{st.st_mtime_ns}:{st.st_ino}"
+
+class ReportCache:
+    """
+    Memoização de resultados JSON-serializáveis.
+    - get(key) -> (valor, "mem" | "disk") ou (None, "miss")
+    - put(key, valor)
+    - stats() -> contadores de acertos/faltas/despejos
+    Os valores são guardados serializados: cada get devolve uma cópia nova,
+    e quem chama pode alterá-la sem contaminar o cache.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, disk_dir=None,
+                 disk_max_bytes=DEFAULT_DISK_MAX_MB << 20, ttl=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl = ttl
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions_mem = 0
+        self.evictions_disk = 0
+        self._disk_bytes = None
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # ---- disco ----
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_get(self, key):
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            if self.ttl is not None and time.time() - st.st_mtime > self.ttl:
+                self._disk_remove(path, st.st_size)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                data = f.read()
+            json.loads(data)  # arquivo corrompido conta como falta
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)  # "usado agora": o TTL e o despejo LRU contam a partir daqui
+        except OSError:
+            pass
+        return data
+
+    def _disk_remove(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        if self._disk_bytes is not None:
+            self._disk_bytes -= size
+
+    def _disk_entries(self):
+        out = []
+        try:
+            with os.scandir(self.disk_dir) as it:
+                for e in it:
+                    if e.name.endswith(".json"):
+                        try:
+                            st = e.stat()
+                        except OSError:
+                            continue
+                        out.append((st.st_mtime, st.st_size, e.path))
+        except OSError:
+            pass
+        return out
+
+    def _disk_put(self, key, value):
+        if not write_json_atomic(self._path(key), value):
+            return
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+        else:
+            try:
+                self._disk_bytes += os.path.getsize(self._path(key))
+            except OSError:
+                pass
+        if self._disk_bytes > self.disk_max_bytes:
+            self._disk_evict()
+
+    def _disk_evict(self):
+        """Remove expirados e, depois, os menos usados até caber em 90% do teto."""
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        target = self.disk_max_bytes * 0.9
+        for mtime, size, path in entries:
+            expired = self.ttl is not None and now - mtime > self.ttl
+            if not expired and total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions_disk += 1
+        self._disk_bytes = total
+
+    # ---- interface ----
+
+    def get(self, key):
+        with self._lock:
+            data = self._mem.get(key)
+            if data is not None:
+                self._mem.move_to_end(key)
+                self.hits_mem += 1
+                return json.loads(data), "mem"
+
+        if self.disk_dir:
+            with self._lock:
+                data = self._disk_get(key)
+                if data is not None:
+                    self.hits_disk += 1
+                    self._mem_put(key, data)
+            if data is not None:
+                return json.loads(data), "disk"
+
+        with self._lock:
+            self.misses += 1
+        return None, "miss"
+
+    def _mem_put(self, key, data):
+        self._mem[key] = data
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions_mem += 1
+
+    def put(self, key, value):
+        data = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._mem_put(key, data)
+            if self.disk_dir:
+                self._disk_put(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            if self.disk_dir:
+                for _, _, path in self._disk_entries():
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self._disk_bytes = 0
+
+    def stats(self):
+        lookups = self.hits_mem + self.hits_disk + self.misses
+        return {
+            "acertos_memoria": self.hits_mem,
+            "acertos_disco": self.hits_disk,
+            "faltas": self.misses,
+            "taxa_acerto": round((self.hits_mem + self.hits_disk) / lookups, 4) if lookups else None,
+            "entradas_memoria": len(self._mem),
+            "despejos_memoria": self.evictions_mem,
+            "despejos_disco": self.evictions_disk,
+            "bytes_disco": self._disk_bytes,
+        }
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# report_client.py
+#
+# Cliente do modo serviço do report_generator.py (protocolo JSON-lines) e
+# benchmark comparando a latência por requisição entre:
+#   - spawn: um novo interpretador por chamada (caminho atual do PHP via shell_exec)
+#   - serviço: uma conexão persistente com "report_generator.py serve"
+#
+# Uso como biblioteca:
+#   from report_client import ReportClient
+#   with ReportClient() as c:
+#       out = c.request("generate_report", {"periodo": "2025-11-20"})
+#
+# Benchmark (sobe o servidor automaticamente se --spawn-server):
+#   python report_client.py --bench 200 --spawn-server
+#   python report_client.py --bench 200 --concurrency 8 --spawn-server
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "report_generator.py")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# -------------------------
+# Cliente
+# -------------------------
+
+class ReportClient:
+    """
+    Conexão persistente com o servidor de relatórios.
+    - Reaproveita o mesmo socket para várias requisições (sem handshake por chamada).
+    - Não é thread-safe: use um cliente por thread.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None, timeout=10.0):
+        if unix_path:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(timeout)
+            self._sock.connect(unix_path)
+        else:
+            self._sock = socket.create_connection((host, port), timeout=timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._rfile = self._sock.makefile("rb")
+        self._next_id = 0
+
+    def request(self, action, payload=None):
+        """Envia uma requisição e devolve o 'result'; levanta RuntimeError se ok=false."""
+        self._next_id += 1
+        msg = {"id": self._next_id, "action": action, "payload": payload or {}}
+        self._sock.sendall((json.dumps(msg, ensure_ascii=False) + "\n").encode("utf-8"))
+
+        line = self._rfile.readline()
+        if not line:
+            raise ConnectionError("servidor fechou a conexão")
+        resp = json.loads(line)
+        if not resp.get("ok"):
+            raise RuntimeError(resp.get("error", "erro desconhecido"))
+        return resp["result"]
+
+    def close(self):
+        try:
+            self._rfile.close()
+        finally:
+            self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# -------------------------
+# Caminho antigo: um processo por chamada
+# -------------------------
+
+def request_spawn(action, payload=None, python=sys.executable):
+    """Reproduz o shell_exec do PHP: novo interpretador, JSON via stdin, JSON via stdout."""
+    proc = subprocess.run(
+        [python, SCRIPT, action],
+        input=json.dumps(payload or {}).encode("utf-8"),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(proc.stdout.decode("utf-8"))
+
+# -------------------------
+# Benchmark
+# -------------------------
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+def _summary(name, latencies, wall):
+    lat = sorted(latencies)
+    n = len(lat)
+    return {
+        "modo": name,
+        "requisicoes": n,
+        "tempo_total_s": round(wall, 3),
+        "throughput_rps": round(n / wall, 1) if wall > 0 else 0.0,
+        "media_ms": round(sum(lat) / n * 1000, 3) if n else 0.0,
+        "p50_ms": round(_percentile(lat, 50) * 1000, 3),
+        "p95_ms": round(_percentile(lat, 95) * 1000, 3),
+        "p99_ms": round(_percentile(lat, 99) * 1000, 3),
+        "max_ms": round(lat[-1] * 1000, 3) if n else 0.0,
+    }
+
+def _run(n, concurrency, factory):
+    """
+    Executa n chamadas com 'concurrency' workers e mede a latência de cada uma.
+    - factory() é chamada uma vez por worker e devolve (fn, close).
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(count):
+        local = []
+        fn, close = factory()
+        try:
+            for _ in range(count):
+                t0 = time.perf_counter()
+                fn()
+                local.append(time.perf_counter() - t0)
+        finally:
+            close()
+        with lock:
+            latencies.extend(local)
+
+    shares = [n // concurrency + (1 if i < n % concurrency else 0) for i in range(concurrency)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, shares))
+    return latencies, time.perf_counter() - t0
+
+def _wait_for_server(host, port, unix_path, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            ReportClient(host, port, unix_path, timeout=1.0).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise SystemExit("servidor de relatórios não respondeu a tempo")
+
+def bench(n, concurrency, action, payload, host, port, unix_path, spawn_server, skip_spawn):
+    server = None
+    if spawn_server:
+        cmd = [sys.executable, SCRIPT, "serve"]
+        cmd += ["--unix", unix_path] if unix_path else ["--host", host, "--port", str(port)]
+        server = subprocess.Popen(cmd, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_server(host, port, unix_path)
+        results = []
+
+        if not skip_spawn:
+            def spawn_ctx():
+                return (lambda: request_spawn(action, payload)), (lambda: None)
+            lat, wall = _run(n, concurrency, spawn_ctx)
+            results.append(_summary("spawn por chamada", lat, wall))
+
+        def service_ctx():
+            client = ReportClient(host, port, unix_path)
+            return (lambda: client.request(action, payload)), client.close
+        lat, wall = _run(n, concurrency, service_ctx)
+        results.append(_summary("serviço persistente", lat, wall))
+
+        return results
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+# -------------------------
+# CLI
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Cliente/benchmark do serviço report_generator")
+    parser.add_argument("action", nargs="?", default="generate_report",
+                        help="generate_report (padrão) ou generate_lessons")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", default=None, help="caminho de socket Unix")
+    parser.add_argument("--payload", default="{}", help="payload JSON enviado em cada requisição")
+    parser.add_argument("--bench", type=int, default=0,
+                        help="número de requisições do benchmark (0 = apenas uma chamada)")
+    parser.add_argument("--concurrency", type=int, default=1, help="clientes simultâneos no benchmark")
+    parser.add_argument("--spawn-server", action="store_true",
+                        help="sobe um 'report_generator.py serve' temporário para o benchmark")
+    parser.add_argument("--skip-spawn", action="store_true",
+                        help="não mede o caminho de um processo por chamada")
+    args = parser.parse_args()
+
+    payload = json.loads(args.payload)
+
+    if args.bench > 0:
+        results = bench(args.bench, max(1, args.concurrency), args.action, payload,
+                        args.host, args.port, args.unix, args.spawn_server, args.skip_spawn)
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    with ReportClient(args.host, args.port, args.unix) as client:
+        out = client.request(args.action, payload)
+    sys.stdout.buffer.write(json.dumps(out, ensure_ascii=False).encode("utf-8"))
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
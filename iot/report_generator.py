@@ -6,11 +6,158 @@
 # gera relatórios (status e lições aprendidas) e escreve JSON de saída
 # em UTF-8 para stdout. Projetado para ser chamado a partir do Controller PHP
 # via shell_exec / pipe, por isso trata robustamente entrada/saída.
+#
+# Modo serviço (evita o custo de subir um interpretador a cada relatório):
+#   python report_generator.py serve                     -> TCP 127.0.0.1:8765
+#   python report_generator.py serve --port 9000
+#   python report_generator.py serve --unix /tmp/report_generator.sock
+# Protocolo: JSON-lines. Cada linha de requisição é
+#   {"id": 1, "action": "generate_report", "payload": {...}}
+# e cada linha de resposta é
+#   {"id": 1, "ok": true, "result": {...}}   ou   {"id": 1, "ok": false, "error": "..."}
+#
+# Modo lote (vários relatórios com um único interpretador):
+#   python report_generator.py batch --workers 4 < lote.json
+# A entrada é um array de payloads (ou de requisições {"id", "action", "payload"})
+# ou um objeto de seletores {"action", "periodos": [...], "devices": [...], "kpis"};
+# a saída é NDJSON no mesmo formato de resposta do modo serviço, na ordem de conclusão.
+#
+# Cache de relatórios (report_cache): generate_report/generate_lessons são
+# memoizados pela forma normalizada do payload + versão do iot_log.json
+# (e do mapeamento de setores).
+# O nível em memória vale por processo (útil no modo serviço); o nível em
+# disco é ativado com REPORT_CACHE_DIR (ou serve --cache-dir) e tem TTL
+# (REPORT_CACHE_TTL, segundos) e teto de tamanho (REPORT_CACHE_MAX_MB).
+#
+# Instrumentação:
+#   python report_generator.py generate_report --timings   -> fases (ms) em JSON no stderr
+#   (ou REPORT_TIMINGS=1; "_timings": true no payload inclui as fases na resposta)
+#   python report_generator.py generate_report --profile   -> cProfile + tracemalloc no stderr
+# Nos modos serviço e lote, contadores por ação (requisições, erros, cache,
+# latência p50/p99) saem no stderr ao final e pela ação "stats".
 
+import os
 import sys
 import json
+import time
+import argparse
+import threading
+import socketserver
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import date
 
+import iot_stream
+import iot_aggregates
+import iot_rollups
+import iot_segments
+import iot_sectors
+import iot_correlation
+import report_cache
+from latency_histogram import LatencyHistogram
+
+# -------------------------
+# Instrumentação (fases e contadores)
+# -------------------------
+
+_tls = threading.local()
+
+class PhaseTimer:
+    """
+    Cronômetro por voltas: lap(nome) soma ao 'nome' o tempo desde a volta
+    anterior. Assim as fases ficam marcadas sem reindentar o código medido.
+    """
+
+    def __init__(self):
+        self.t0 = self._last = time.perf_counter()
+        self.fases = {}
+        self.notas = {}
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.fases[name] = self.fases.get(name, 0.0) + (now - self._last)
+        self._last = now
+
+    def note(self, key, value=True):
+        self.notas[key] = value
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.t0
+
+    def to_dict(self):
+        out = {
+            "fases_ms": {k: round(v * 1000, 3) for k, v in self.fases.items()},
+            "total_ms": round((self._last - self.t0) * 1000, 3),
+        }
+        out.update(self.notas)
+        return out
+
+@contextmanager
+def _timing():
+    """Ativa um PhaseTimer para a thread atual (aninhável)."""
+    prev = getattr(_tls, "timer", None)
+    timer = _tls.timer = PhaseTimer()
+    try:
+        yield timer
+    finally:
+        _tls.timer = prev
+
+def _lap(name):
+    timer = getattr(_tls, "timer", None)
+    if timer is not None:
+        timer.lap(name)
+
+def _note(key, value=True):
+    timer = getattr(_tls, "timer", None)
+    if timer is not None:
+        timer.note(key, value)
+
+class RequestCounters:
+    """Contadores por ação para os modos serviço e lote (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.actions = {}
+
+    def record(self, action, response):
+        with self._lock:
+            c = self.actions.get(action)
+            if c is None:
+                c = self.actions[action] = {"n": 0, "erros": 0, "cache": {}, "hist": LatencyHistogram()}
+            c["n"] += 1
+            if not response.get("ok"):
+                c["erros"] += 1
+            state = response.get("cache")
+            if state:
+                c["cache"][state] = c["cache"].get(state, 0) + 1
+            if response.get("tempo_ms") is not None:
+                c["hist"].record(response["tempo_ms"] / 1000)
+
+    def summary(self):
+        with self._lock:
+            por_acao = {}
+            for action, c in sorted(self.actions.items()):
+                lat = c["hist"].summary_ms((50, 99))
+                por_acao[action] = {
+                    "requisicoes": c["n"],
+                    "erros": c["erros"],
+                    "cache": dict(c["cache"]),
+                    "media_ms": lat["media"],
+                    "p50_ms": lat["p50"],
+                    "p99_ms": lat["p99"],
+                    "max_ms": lat["max"],
+                }
+        return {
+            "requisicoes": sum(a["requisicoes"] for a in por_acao.values()),
+            "erros": sum(a["erros"] for a in por_acao.values()),
+            "uptime_s": round(time.time() - self.started, 1),
+            "por_acao": por_acao,
+        }
+
+_counters = RequestCounters()
+
 # -------------------------
 # Helpers utilitários
 # -------------------------
@@ -55,6 +202,7 @@ def _safe_load_json(raw):
     # Se o primeiro parse resultou em string, pode ser um JSON duplamente codificado:
     # ex: raw == '"{\"kpis\": {...}}"' -> first é string que contém JSON
     if isinstance(first, str):
+        _note("dupla_codificacao")
         try:
             second = json.loads(first)
             # Se o segundo parse resultar em dict/list, retornamos
@@ -68,14 +216,106 @@ def _safe_load_json(raw):
     # Caso contrário, não conseguimos interpretar — retorna vazio
     return {}
 
-def _ensure_kpis(k):
+def _period_stats(cache_cls, periodo, log_path=None, device_id=None):
+    """
+    Combina por métrica os agregados (cache_cls.STAT) das leituras do 'periodo'.
+    - Usa o cache incremental do processo (iot_aggregates.shared_cache): só os
+      registros novos desde a última execução são lidos e só os dias do
+      período são carregados; períodos fora de limites de dia caem na
+      leitura em streaming do intervalo, que abre só os segmentos compactados
+      que cruzam o período (iot_segments) quando eles existem.
+    - Considera apenas leituras válidas dentro do 'periodo'; se o período não
+      puder ser interpretado, usa o histórico completo.
+    - device_id restringe as leituras a um dispositivo (None = todos).
+    - Retorna {} se não houver leituras; levanta OSError se o log não existir.
+    """
+    path = log_path or iot_stream.DEFAULT_LOG_PATH
+    rng = iot_stream.parse_periodo(periodo)
+    start, end = rng if rng else (None, None)
+
+    cache = iot_aggregates.shared_cache(cache_cls, path)
+    if cache.covers(start, end):
+        with cache.lock:
+            cache.refresh()
+            return cache.query(start, end, device_id)
+
+    stats = {}
+    for _, rec in iot_segments.iter_readings(path, start, end, device_id):
+        for m, v in iot_stream.reading_values(rec).items():
+            if v is not None and (cache.METRICS is None or m in cache.METRICS):
+                st = stats.get(m)
+                if st is None:
+                    st = stats[m] = cache.STAT()
+                st.add(v)
+    return stats
+
+def _refresh_iot_caches(log_path=None):
+    """
+    Atualiza numa única leitura do log os caches por dia do relatório
+    (agregados, sketches e setores) e os rollups, nas instâncias do processo;
+    as consultas seguintes só encontram o que chegou depois. Os locks são
+    tomados sempre nesta ordem. Levanta OSError se o log não puder ser lido.
+    """
+    path = log_path or iot_stream.DEFAULT_LOG_PATH
+    caches = [iot_aggregates.shared_cache(cls, path)
+              for cls in (iot_aggregates.AggregateCache, iot_aggregates.SketchCache,
+                          iot_sectors.SectorCache)]
+    caches.append(iot_rollups.shared_engine(path))
+    with ExitStack() as stack:
+        for cache in caches:
+            stack.enter_context(cache.lock)
+        iot_aggregates.refresh_together(path, caches)
+
+def _derive_iot_kpis(periodo, log_path=None, device_id=None):
+    """
+    Calcula os KPIs de ambiente a partir do histórico IoT (iot_log.json) no
+    'periodo' (ver _period_stats). Retorna {} se não houver leituras (ou se o
+    log não existir).
+    """
+    try:
+        stats = _period_stats(iot_aggregates.AggregateCache, periodo, log_path, device_id)
+    except OSError:
+        return {}
+    return _iot_kpis_from_stats(stats)
+
+def _derive_percentiles(periodo, log_path=None, device_id=None):
+    """
+    p50/p95/p99 de cada métrica no 'periodo', com limites de erro, a partir dos
+    sketches KLL por dia/dispositivo (iot_aggregates.SketchCache).
+    - Retorna None se o log não existir ou não houver leituras.
+    """
+    try:
+        sketches = _period_stats(iot_aggregates.SketchCache, periodo, log_path, device_id)
+    except OSError:
+        return None
+    return {m: sk.summary() for m, sk in sorted(sketches.items())} or None
+
+def _iot_kpis_from_stats(stats):
+    """Converte {metrica: MetricStats} nos KPIs de ambiente usados pelo relatório."""
+    out = {}
+    if "co2" in stats:
+        out["co2_pico"] = int(stats["co2"].max)
+    if "energy_peak" in stats:
+        out["energia_pico_kw"] = round(stats["energy_peak"].max, 2)
+    if "temperature" in stats:
+        out["temp_media"] = round(stats["temperature"].mean, 1)
+    if "humidity" in stats:
+        out["umi_media"] = round(stats["humidity"].mean, 1)
+    if "oxygen" in stats:
+        out["o2_medio"] = round(stats["oxygen"].mean, 1)
+    return out
+
+def _ensure_kpis(k, periodo=None, device_id=None):
     """
     Garante que exista um dicionário 'kpis' com valores válidos.
     - Se k estiver vazio (ou não for dict), retorna um conjunto de KPIs padrão/estimados.
     - Esses KPIs padrão são valores plausíveis para gerar relatórios mesmo sem dados reais.
+    - Os KPIs de ambiente (CO₂, energia, temperatura, umidade, O₂) são derivados do
+      iot_log.json para o 'periodo' (e 'device_id', se informado) quando houver
+      leituras; senão ficam estimados.
     """
     if not k or not isinstance(k, dict) or len(k) == 0:
-        return {
+        defaults = {
             "taxa_ocupacao": 0.87,        # 87% (estimado)
             "los_h": 26.4,                # length-of-stay médio em horas (estimado)
             "tempo_espera_min": 32,       # minutos (estimado)
@@ -90,26 +330,185 @@ def _ensure_kpis(k):
             "umi_media": 48.0,
             "o2_medio": 95.0
         }
+        defaults.update(_derive_iot_kpis(periodo, device_id=device_id))
+        return defaults
     return k
 
+def _derive_correlations(periodo, log_path=None, device_id=None):
+    """
+    Mede a correlação energia x CO₂ x climatização no 'periodo' (iot_correlation).
+    - Retorna None se o log não existir ou não houver pontos suficientes.
+    """
+    try:
+        return iot_correlation.analyze_period(periodo, device_id, log_path)
+    except OSError:
+        return None
+
+# Processos para reconstruir o cache por setor (iot_sectors.SectorCache);
+# None = núcleos disponíveis. Atualizações incrementais rodam no próprio
+# processo; o modo lote usa 1 dentro de cada worker para não multiplicar
+# processos (o cache já foi aquecido em _warm_caches).
+_sector_workers = None
+
+# Linhas do ranking de setores no texto (a tabela completa vai no payload)
+SECTOR_TEXT_ROWS = 10
+
+def _derive_sectors(periodo, log_path=None, device_id=None):
+    """
+    Tabela de energia/CO₂/temperatura por setor no 'periodo' (iot_sectors),
+    já ordenada por consumo. Retorna None se o log não existir, o mapeamento
+    for inválido ou não houver leituras.
+    """
+    try:
+        res = iot_sectors.analyze_period(periodo, device_id, log_path, _sector_workers)
+    except (OSError, ValueError):
+        return None
+    if not res["setores"]:
+        return None
+    return {
+        "agrupamento": res["agrupamento"],
+        "intervalo_demanda_s": res["intervalo_demanda_s"],
+        "tabela": res["setores"],
+    }
+
+def _sector_lines(sectors):
+    """Linhas do ranking por setor para a seção de energia (US-05)."""
+    label = "setor" if sectors["agrupamento"] == "setor" else "dispositivo"
+    lines = [f"   - Ranking de consumo por {label} (energia no período | demanda máx. "
+             f"{sectors['intervalo_demanda_s'] // 60} min | fator de carga | CO₂ P95 | temp. média):"]
+    for row in sectors["tabela"][:SECTOR_TEXT_ROWS]:
+        share = row["participacao_energia"]
+        parts = [f"{row['energia_kwh']:.1f} kWh" + (f" ({share:.0%})" if share is not None else "")]
+        if row["demanda_max_kw"] is not None:
+            parts.append(f"{row['demanda_max_kw']:.2f} kW")
+        if row["fator_carga"] is not None:
+            parts.append(f"FC {row['fator_carga']:.2f}")
+        if row["co2_p95"] is not None:
+            parts.append(f"{row['co2_p95']:.0f} ppm")
+        if row["temp_media"] is not None:
+            parts.append(f"{row['temp_media']:.1f}°C")
+        lines.append(f"     {row['posicao']}. {row['setor']}: " + " | ".join(parts))
+    hidden = len(sectors["tabela"]) - SECTOR_TEXT_ROWS
+    if hidden > 0:
+        lines.append(f"     ... e mais {hidden} (tabela completa em payload.setores)")
+    return lines
+
+def _correlation_summary(corr):
+    """Texto do resumo com os valores medidos (substitui a afirmação fixa de correlação)."""
+    if not corr:
+        return ("Não há leituras IoT suficientes no período para medir a correlação entre consumo "
+                "energético, CO₂ e acionamento do HVAC; recomenda-se ampliar a coleta antes de "
+                "priorizar automações das User Stories referenciadas.")
+
+    pares = corr["pares"]
+    res_min = corr["resolucao_s"] / 60
+
+    def par(key, label):
+        p = pares[key]
+        if p["pearson"] is None:
+            return f"{label}: indefinida"
+        return (f"{label}: r = {p['pearson']:.2f} (Spearman {p['spearman']:.2f}, "
+                f"{iot_correlation.strength_label(p['pearson'])})")
+
+    partes = [
+        par("energia_x_co2", "energia × CO₂"),
+        par("energia_x_hvac", "energia × acionamento do HVAC (variação de temperatura)"),
+        par("co2_x_temperatura", "CO₂ × temperatura"),
+    ]
+    txt = (f"Correlação medida em {corr['pontos']} intervalos de {res_min:g} min "
+           f"({corr['dispositivos']} dispositivo(s)) — " + "; ".join(partes) + ".")
+
+    lag = pares["energia_x_co2"]["defasagem"]
+    if lag and lag["r"] is not None and lag["lag_s"]:
+        quem = "o CO₂ acompanha a energia" if lag["lag_s"] > 0 else "a energia acompanha o CO₂"
+        txt += (f" A correlação cruzada é máxima com defasagem de {abs(lag['lag_s']) / 60:g} min "
+                f"({quem}; r = {lag['r']:.2f}).")
+
+    picos = corr["coocorrencia_picos"]
+    if picos:
+        co = sum(p["coocorrencias"] for p in picos.values())
+        pe = sum(p["picos_energia"] for p in picos.values())
+        esp = sum(p["esperado"] for p in picos.values())
+        txt += f" {co} de {pe} picos de energia coincidiram com picos de CO₂"
+        txt += f" ({co / esp:.1f}x o esperado ao acaso)." if esp else "."
+
+    fortes = [p["pearson"] for p in pares.values() if p["pearson"] is not None and abs(p["pearson"]) >= 0.5]
+    if fortes:
+        txt += (" Há oportunidade de reduzir picos e aumentar eficiência ao priorizar automações e "
+                "controles descritos nas User Stories referenciadas.")
+    else:
+        txt += (" A relação ainda não é forte o bastante para atribuir os picos ao HVAC; convém "
+                "validar com mais dados antes de priorizar automações.")
+    return txt
+
+def _co2_energy_line(corr):
+    """Relação medida entre episódios de CO₂ e picos de energia (None sem dados)."""
+    if not corr or corr["pares"]["energia_x_co2"]["pearson"] is None:
+        return None
+    r = corr["pares"]["energia_x_co2"]["pearson"]
+    txt = f"   - CO₂ × energia: r = {r:.2f} ({iot_correlation.strength_label(r)})"
+    picos = corr["coocorrencia_picos"]
+    esp = sum(p["esperado"] for p in picos.values()) if picos else 0
+    lift = None
+    if esp:
+        co = sum(p["coocorrencias"] for p in picos.values())
+        lift = co / esp
+        txt += f"; {co} picos de energia coincidiram com picos de CO₂ ({lift:.1f}x o esperado ao acaso)"
+    if abs(r) >= 0.5 or (lift is not None and lift >= 1.5):
+        return txt + ", indicando relação entre ocupação/ventilação e demanda de HVAC."
+    return txt + "; os episódios de CO₂ não acompanham os picos energéticos de forma consistente."
+
+def _hvac_line(corr):
+    """Relação medida entre acionamento do HVAC e consumo (None sem dados)."""
+    if not corr or corr["pares"]["energia_x_hvac"]["pearson"] is None:
+        return None
+    r = corr["pares"]["energia_x_hvac"]["pearson"]
+    txt = (f"   - Acionamento do HVAC (variação de temperatura entre intervalos) × energia: "
+           f"r = {r:.2f} ({iot_correlation.strength_label(r)})")
+    if abs(r) >= 0.5:
+        return txt + "; automação por zona pode suavizar ciclos e reduzir picos."
+    return txt + "; os ajustes do HVAC não explicam a maior parte da variação do consumo."
+
 # -------------------------
 # Função: gerar relatório de status
 # -------------------------
 
+def _percentile_error_txt(summary):
+    """Sufixo com o erro do sketch: vazio se exato, senão o erro de rank em %."""
+    if summary.get("exato"):
+        return ""
+    return f" (±{summary['erro_rank']:.1%} em rank)"
+
 def generate_report(payload):
     """
     Produz um relatório de status (texto) + payload resumido (KPIs).
-    - payload: dicionário (decodificado do stdin) que pode conter 'kpis' e 'periodo'.
+    - payload: dicionário (decodificado do stdin) que pode conter 'kpis', 'periodo'
+      e 'device_id' (restringe os dados IoT a um dispositivo).
     - Retorna um dict com chaves: "relatorio" (string formatada) e "payload" (objeto com kpis).
     O texto do relatório traz: cabeçalho, KPIs, observações analíticas e um insight acionável.
     """
     # Extrai kpis com segurança (se payload não for dict, usamos {})
     raw_k = payload.get("kpis", {}) if isinstance(payload, dict) else {}
-    k = _ensure_kpis(raw_k)  # garante valores padrão se estiver vazio
 
     # Período do relatório (se não fornecido, usa data de hoje)
     periodo = payload.get("periodo", f"{date.today()}") if isinstance(payload, dict) else f"{date.today()}"
 
+    device_id = payload.get("device_id") if isinstance(payload, dict) else None
+
+    try:
+        _refresh_iot_caches()   # uma leitura do log para agregados, sketches, setores e rollups
+    except OSError:
+        pass                    # cada _derive_* trata o log ausente/ilegível
+    _lap("caches_iot")
+    k = _ensure_kpis(raw_k, periodo, device_id)  # garante valores padrão se estiver vazio
+    _lap("kpis")
+    corr = _derive_correlations(periodo, device_id=device_id)  # correlações medidas no iot_log (ou None)
+    _lap("correlacoes")
+    pct = _derive_percentiles(periodo, device_id=device_id)     # p50/p95/p99 com limites de erro (ou None)
+    _lap("percentis")
+    setores = _derive_sectors(periodo, device_id=device_id)     # ranking de energia por setor (ou None)
+    _lap("setores")
+
     # Extrai KPIs individuais com valores padrão quando ausentes
     taxa_ocup = k.get("taxa_ocupacao", 0)
     los_h = k.get("los_h", 0)
@@ -125,12 +524,16 @@ def generate_report(payload):
     umi_media = k.get("umi_media", None)
     o2_medio = k.get("o2_medio", None)
 
+    # Percentis medidos (sketches KLL); ficam None sem leituras no período
+    co2_p95 = pct["co2"]["p95"] if pct and "co2" in pct else None
+    energia_p99 = pct["energy_instant"]["p99"] if pct and "energy_instant" in pct else None
+
     # Montagem do cabeçalho e resumo executivo (lista de linhas para facilitar join)
     title = "Correlação: Entrega de Feature vs. Consumo de Energia"
     subtitle = 'Análise do impacto das entregas relevantes do backlog (ex.: US-05, US-04, US-08).'
 
     conclusoes = []
-    conclusoes.append(f"Relatório de Status — {periodo}")
+    conclusoes.append(f"Relatório de Status — {periodo}" + (f" — dispositivo {device_id}" if device_id else ""))
     conclusoes.append("")  # linha em branco para separar
     conclusoes.append(title)
     conclusoes.append(subtitle)
@@ -161,27 +564,51 @@ def generate_report(payload):
         conclusoes.append(f"   - Pico instantâneo registrado: {energia_pico:.2f} kW (amostras do iot_log).")
     else:
         conclusoes.append("   - Pico instantâneo registrado: N/D")
-    conclusoes.append("   - Foram detectados picos energéticos seguidos de quedas, sugerindo ciclos de acionamento de equipamentos de alta potência.")
+    if energia_p99 is not None:
+        conclusoes.append(f"   - Demanda instantânea P99: {energia_p99:.2f} kW"
+                          f"{_percentile_error_txt(pct['energy_instant'])}.")
+    energia_pct = pct.get("energy_instant") if pct else None
+    if energia_pct and energia_pct["p50"]:
+        ratio = energia_pct["max"] / energia_pct["p50"]
+        conclusoes.append(f"   - Demanda instantânea mediana: {energia_pct['p50']:.2f} kW; o máximo chega a "
+                          f"{ratio:.1f}x a mediana"
+                          + (", sugerindo ciclos de acionamento de equipamentos de alta potência."
+                             if ratio >= 2 else " (carga sem picos pronunciados)."))
+    if setores:
+        conclusoes.extend(_sector_lines(setores))
     conclusoes.append("")
 
     conclusoes.append("2) Qualidade do ar (referência: US-04 — Monitoramento de CO₂):")
+    co2_pct = pct.get("co2") if pct else None
     if co2_pico is not None:
-        conclusoes.append(f"   - Pico de CO₂ observado: {int(co2_pico)} ppm; variações registradas entre ~350 e 1400 ppm.")
+        faixa = (f"; variações registradas entre {co2_pct['min']:.0f} e {co2_pct['max']:.0f} ppm"
+                 if co2_pct else "")
+        conclusoes.append(f"   - Pico de CO₂ observado: {int(co2_pico)} ppm{faixa}.")
     else:
         conclusoes.append("   - CO₂: N/D")
-    conclusoes.append("   - Esses episódios coincidem com picos energéticos, indicando relação entre ocupação/ventilação e demanda de HVAC.")
+    if co2_p95 is not None:
+        conclusoes.append(f"   - CO₂ P95: {co2_p95:.0f} ppm (5% do tempo acima disso)"
+                          f"{_percentile_error_txt(pct['co2'])}.")
+    line = _co2_energy_line(corr)
+    if line:
+        conclusoes.append(line)
     conclusoes.append("")
 
     conclusoes.append("3) Climatização (referência: US-08 — Automação HVAC por Zona):")
+    temp_pct = pct.get("temperature") if pct else None
     if temp_media is not None:
-        conclusoes.append(f"   - Temperatura média aproximada: {temp_media:.1f}°C (faixa observada ~19.8°C–28.2°C).")
+        faixa = (f" (faixa observada {temp_pct['min']:.1f}°C–{temp_pct['max']:.1f}°C)"
+                 if temp_pct else "")
+        conclusoes.append(f"   - Temperatura média aproximada: {temp_media:.1f}°C{faixa}.")
     else:
         conclusoes.append("   - Temperatura: N/D")
-    conclusoes.append("   - Ajustes constantes do HVAC foram identificados; automação por zona pode suavizar ciclos e reduzir picos.")
+    line = _hvac_line(corr)
+    if line:
+        conclusoes.append(line)
     conclusoes.append("")
 
     conclusoes.append("Resumo:")
-    conclusoes.append("A correlação entre consumo energético, CO₂ e acionamento do HVAC é robusta nos dados analisados — há oportunidade de reduzir picos e aumentar eficiência ao priorizar automações e controles descritos nas User Stories referenciadas.")
+    conclusoes.append(_correlation_summary(corr))
     conclusoes.append("")
 
     # Insight acionável (texto mais longo)
@@ -210,10 +637,18 @@ def generate_report(payload):
             "energia_pico_kw": energia_pico,
             "temp_media": temp_media,
             "umi_media": umi_media,
-            "o2_medio": o2_medio
-        }
+            "o2_medio": o2_medio,
+            "co2_p95": co2_p95,
+            "energia_p99_kw": energia_p99
+        },
+        "correlacoes": corr,
+        "percentis": pct,
+        "setores": setores
     }
+    if device_id:
+        payload_out["device_id"] = device_id
 
+    _lap("texto")
     return {"relatorio": rel, "payload": payload_out}
 
 # -------------------------
@@ -231,8 +666,10 @@ def generate_lessons(payload):
     Retorna um dicionário com chave 'licoes' (string formatada).
     """
     raw_k = payload.get("kpis", {}) if isinstance(payload, dict) else {}
-    k = _ensure_kpis(raw_k)
     periodo = payload.get("periodo", f"{date.today()}") if isinstance(payload, dict) else f"{date.today()}"
+    device_id = payload.get("device_id") if isinstance(payload, dict) else None
+    k = _ensure_kpis(raw_k, periodo, device_id)
+    _lap("kpis")
 
     # Extrai alguns KPIs usados para condicionar mensagens
     t_ocup = k.get("taxa_ocupacao", 0)
@@ -244,6 +681,8 @@ def generate_lessons(payload):
     parts = []
     parts.append("LIÇÕES APRENDIDAS — Smart Hospital 4.0")
     parts.append(f"Período analisado: {periodo}")
+    if device_id:
+        parts.append(f"Dispositivo: {device_id}")
     parts.append("")
     parts.append("1) Pontos Fortes")
     if t_ocup < 0.85:
@@ -283,49 +722,477 @@ def generate_lessons(payload):
     parts.append("Conclusão")
     parts.append("A coordenação entre tecnologia, operação e assistência é determinante. As implementações já concluídas (US-10 e US-11) forneceram ferramentas analíticas valiosas; priorizar automações e monitoramento avançado ampliará ganhos operacionais e qualidade assistencial.")
 
+    _lap("texto")
     return {"licoes": "\n".join(parts)}
 
+# -------------------------
+# Despacho de ações (compartilhado entre modo pipe e modo serviço)
+# -------------------------
+
+def query_rollups(payload):
+    """
+    Série reduzida (rollups 1 min / 5 min / 1 h) para os gráficos do dashboard.
+    - payload: {"periodo": ..., "device_id": ..., "max_points": ...}
+    - Retorna {"resolucao_s": ..., "pontos": [...]} (ver iot_rollups.RollupEngine.query).
+    """
+    if not isinstance(payload, dict):
+        payload = {}
+    try:
+        max_points = int(payload.get("max_points", iot_rollups.DEFAULT_MAX_POINTS))
+    except (TypeError, ValueError):
+        max_points = iot_rollups.DEFAULT_MAX_POINTS
+    return iot_rollups.query_window(payload.get("periodo"), payload.get("device_id"), max_points)
+
+# -------------------------
+# Cache de relatórios
+# -------------------------
+
+_cache = None
+
+def configure_cache(max_entries=None, disk_dir=None, disk_max_mb=None, ttl=None):
+    """
+    (Re)cria o cache de relatórios do processo.
+    Valores None usam as variáveis de ambiente REPORT_CACHE_* ou os padrões.
+    """
+    global _cache
+    env = os.environ
+    if max_entries is None:
+        max_entries = int(env.get("REPORT_CACHE_ENTRIES", report_cache.DEFAULT_MAX_ENTRIES))
+    if disk_dir is None:
+        disk_dir = env.get("REPORT_CACHE_DIR") or None
+    if disk_max_mb is None:
+        disk_max_mb = float(env.get("REPORT_CACHE_MAX_MB", report_cache.DEFAULT_DISK_MAX_MB))
+    if ttl is None and env.get("REPORT_CACHE_TTL"):
+        ttl = float(env["REPORT_CACHE_TTL"])
+    _cache = report_cache.ReportCache(max_entries, disk_dir, int(disk_max_mb * (1 << 20)), ttl)
+    return _cache
+
+def _get_cache():
+    return _cache or configure_cache()
+
+def _normalized_request(name, payload):
+    """
+    Forma normalizada do que determina a saída de um relatório: ação, período
+    (com o mesmo padrão de hoje que generate_report aplica), dispositivo e KPIs
+    como _ensure_kpis os vê (vazio/inválido -> {} = KPIs derivados/estimados).
+    """
+    if not isinstance(payload, dict):
+        payload = {}
+    kpis = payload.get("kpis", {})
+    if not kpis or not isinstance(kpis, dict):
+        kpis = {}
+    return {
+        "action": name,
+        "periodo": payload.get("periodo", f"{date.today()}"),
+        "device_id": payload.get("device_id"),
+        "kpis": kpis,
+    }
+
+def cache_stats(payload=None):
+    """Contadores do cache de relatórios deste processo."""
+    return _get_cache().stats()
+
+def service_stats(payload=None):
+    """Contadores por ação deste processo + estado do cache (modo serviço)."""
+    out = _counters.summary()
+    out["cache"] = _get_cache().stats()
+    return out
+
+ACTIONS = {
+    "generate_report": generate_report,
+    "generate_lessons": generate_lessons,
+    "query_rollups": query_rollups,
+    "cache_stats": cache_stats,
+    "stats": service_stats,
+}
+
+# Ações cuja saída depende só do payload normalizado + dados IoT
+_CACHEABLE = ("generate_report", "generate_lessons")
+
+def _run_cached(action, payload):
+    """
+    Executa a ação consultando o cache de relatórios.
+    Retorna (resultado, estado) com estado "mem", "disk", "miss" ou None (não cacheável).
+    """
+    name = (action or "").lower()
+    if name not in ACTIONS:
+        name = "generate_report"  # mesmo comportamento histórico do main
+    if name not in _CACHEABLE:
+        return ACTIONS[name](payload), None
+
+    cache = _get_cache()
+    key = report_cache.cache_key(
+        _normalized_request(name, payload),
+        report_cache.file_version(iot_stream.DEFAULT_LOG_PATH),
+        report_cache.file_version(iot_sectors.DEFAULT_SECTORS_PATH),
+    )
+    result, state = cache.get(key)
+    _note("cache", state)
+    _lap("cache")
+    if result is None:
+        result = ACTIONS[name](payload)
+        cache.put(key, result)
+        _lap("cache_gravacao")
+    return result, state
+
+def run_action(action, payload):
+    """
+    Executa a ação pedida sobre o payload já decodificado.
+    - Ações desconhecidas caem em generate_report (mesmo comportamento histórico do main).
+    - Relatórios repetidos (mesmo payload normalizado e mesmos dados IoT) vêm do cache.
+    """
+    return _run_cached(action, payload)[0]
+
+def _wants_timings(payload):
+    return isinstance(payload, dict) and bool(payload.get("_timings"))
+
+def _response(req_id, action, payload):
+    """
+    Executa uma requisição e devolve a resposta no formato do protocolo JSON-lines.
+    'tempo_ms' traz a duração; com "_timings": true no payload, o resultado
+    ganha o campo '_timings' com as fases.
+    """
+    with _timing() as timer:
+        try:
+            result, state = _run_cached(action, payload)
+        except Exception as e:
+            return {"id": req_id, "ok": False, "error": f"{type(e).__name__}: {e}",
+                    "tempo_ms": round(timer.elapsed * 1000, 3)}
+    resp = {"id": req_id, "ok": True, "result": result, "tempo_ms": round(timer.elapsed * 1000, 3)}
+    if state is not None:
+        resp["cache"] = state
+    if _wants_timings(payload) and isinstance(result, dict):
+        result["_timings"] = timer.to_dict()
+    return resp
+
+# -------------------------
+# Modo lote: vários relatórios em um processo pool
+# -------------------------
+
+def expand_batch(spec, default_action="generate_report"):
+    """
+    Converte a entrada do modo lote em uma lista de (id, action, payload).
+    Aceita:
+    - array de payloads: [{"periodo": "2025-11", "kpis": {...}}, ...]  (id = posição)
+    - array de requisições: [{"id": "a", "action": "generate_lessons", "payload": {...}}, ...]
+    - objeto de seletores: {"action": ..., "periodos": [...], "devices": [...], "kpis": {...}}
+      -> um relatório por combinação periodo x device (devices omitido = todos juntos)
+    """
+    if isinstance(spec, dict):
+        action = spec.get("action", default_action)
+        periodos = spec.get("periodos") or [spec.get("periodo", f"{date.today()}")]
+        devices = spec.get("devices") or [None]
+        kpis = spec.get("kpis", {})
+        jobs = []
+        for periodo in periodos:
+            for dev in devices:
+                payload = {"periodo": periodo, "kpis": kpis}
+                if dev:
+                    payload["device_id"] = dev
+                req_id = f"{periodo}/{dev}" if dev else f"{periodo}"
+                jobs.append((req_id, action, payload))
+        return jobs
+
+    if not isinstance(spec, list):
+        raise ValueError("a entrada do lote deve ser um array ou um objeto de seletores")
+
+    jobs = []
+    for i, item in enumerate(spec):
+        if isinstance(item, dict) and "payload" in item:
+            payload = item["payload"]
+            if isinstance(payload, str):
+                payload = _safe_load_json(payload)
+            jobs.append((item.get("id", i), item.get("action", default_action), payload))
+        else:
+            jobs.append((i, default_action, item))
+    return jobs
+
+def _warm_caches():
+    """
+    Atualiza caches de agregados, sketches, setores e rollups uma vez (numa só leitura do log),
+    no processo principal, para que os workers só leiam o estado pronto em vez de cada um reler o log.
+    """
+    try:
+        _refresh_iot_caches()
+    except OSError:
+        pass
+
+def _batch_worker_init():
+    """Workers do lote já rodam em paralelo: o cache por setor é atualizado no próprio processo."""
+    global _sector_workers
+    _sector_workers = 1
+
+def run_batch(jobs, workers=None, out=None):
+    """
+    Executa os jobs e escreve cada resposta como uma linha NDJSON assim que fica pronta.
+    - workers=1 executa no próprio processo (sem custo de subir workers).
+    - Retorna um RequestCounters com o resumo do lote.
+    """
+    out = out or sys.stdout
+    counters = RequestCounters()
+
+    def emit(action, resp):
+        counters.record(action, resp)
+        out.write(json.dumps(resp, ensure_ascii=False) + "\n")
+        out.flush()
+
+    if not jobs:
+        return counters
+    _warm_caches()
+
+    if workers == 1 or len(jobs) == 1:
+        for req_id, action, payload in jobs:
+            emit(action, _response(req_id, action, payload))
+        return counters
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_batch_worker_init) as pool:
+        futures = {pool.submit(_response, req_id, action, payload): (req_id, action)
+                   for req_id, action, payload in jobs}
+        for fut in as_completed(futures):
+            req_id, action = futures[fut]
+            try:
+                emit(action, fut.result())
+            except Exception as e:
+                # worker morreu ou o resultado não pôde ser transferido
+                emit(action, {"id": req_id, "ok": False, "error": f"{type(e).__name__}: {e}"})
+    return counters
+
+def _batch_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="report_generator.py batch",
+        description="Gera vários relatórios em uma chamada; saída NDJSON na ordem de conclusão"
+    )
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processos do pool (padrão: número de CPUs; 1 = sem pool)")
+    parser.add_argument("--action", default="generate_report", choices=sorted(ACTIONS),
+                        help="ação padrão para itens sem 'action'")
+    args = parser.parse_args(argv)
+
+    spec = _safe_load_json(sys.stdin.read())
+    try:
+        jobs = expand_batch(spec, args.action)
+    except ValueError as e:
+        raise SystemExit(f"report_generator batch: {e}")
+
+    if hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(encoding="utf-8")  # mesmo cuidado do main com Windows/PHP
+    t0 = time.perf_counter()
+    summary = run_batch(jobs, args.workers).summary()
+    summary["duracao_s"] = round(time.perf_counter() - t0, 3)
+    print(json.dumps({"evento": "batch_resumo", **summary}, ensure_ascii=False),
+          file=sys.stderr, flush=True)
+
+# -------------------------
+# Modo serviço: servidor JSON-lines (TCP local ou socket Unix)
+# -------------------------
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+class _ReportRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Atende uma conexão: lê requisições linha a linha e responde na mesma ordem.
+    A conexão pode ser mantida aberta (keep-alive) para várias requisições.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self._process(line.decode("utf-8", errors="replace"))
+            data = json.dumps(response, ensure_ascii=False) + "\n"
+            try:
+                self.wfile.write(data.encode("utf-8"))
+                self.wfile.flush()
+            except OSError:
+                # cliente fechou a conexão antes de ler a resposta
+                return
+
+    def _process(self, raw_line):
+        msg = _safe_load_json(raw_line)
+        if not isinstance(msg, dict):
+            return {"id": None, "ok": False, "error": "requisição deve ser um objeto JSON"}
+
+        req_id = msg.get("id")
+        action = msg.get("action", "generate_report")
+
+        # payload pode chegar como objeto ou como string JSON (dupla-encoding)
+        payload = msg.get("payload", {})
+        if isinstance(payload, str):
+            payload = _safe_load_json(payload)
+
+        resp = _response(req_id, action, payload)
+        _counters.record((action or "").lower(), resp)
+        return resp
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+else:
+    # Windows sem AF_UNIX: somente TCP está disponível
+    _ThreadingUnixServer = None
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+    """
+    Sobe o servidor de relatórios e bloqueia até Ctrl+C.
+    - Cada conexão é atendida em sua própria thread, permitindo requisições concorrentes.
+    - Se unix_path for informado, escuta em um socket Unix em vez de TCP.
+    """
+    if unix_path:
+        if _ThreadingUnixServer is None:
+            raise SystemExit("Sockets Unix não são suportados nesta plataforma; use --port.")
+        if os.path.exists(unix_path):
+            os.unlink(unix_path)  # remove socket órfão de uma execução anterior
+        server = _ThreadingUnixServer(unix_path, _ReportRequestHandler)
+        where = unix_path
+    else:
+        server = _ThreadingTCPServer((host, port), _ReportRequestHandler)
+        where = f"{host}:{server.server_address[1]}"
+
+    print(f"report_generator: servindo em {where}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps({"evento": "serve_resumo", **service_stats()}, ensure_ascii=False),
+              file=sys.stderr, flush=True)
+
+def _serve_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="report_generator.py serve",
+        description="Servidor persistente JSON-lines para generate_report/generate_lessons"
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, help="endereço TCP (padrão 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="porta TCP (padrão 8765)")
+    parser.add_argument("--unix", default=None, help="caminho de socket Unix (substitui TCP)")
+    parser.add_argument("--cache-entries", type=int, default=None,
+                        help="relatórios mantidos no LRU em memória (padrão 256)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="ativa o nível em disco do cache de relatórios nesta pasta")
+    parser.add_argument("--cache-max-mb", type=float, default=None,
+                        help="teto do nível em disco em MB (padrão 64)")
+    parser.add_argument("--cache-ttl", type=float, default=None,
+                        help="validade das entradas em disco, em segundos")
+    args = parser.parse_args(argv)
+    configure_cache(args.cache_entries, args.cache_dir, args.cache_max_mb, args.cache_ttl)
+    serve(host=args.host, port=args.port, unix_path=args.unix)
+
 # -------------------------
 # Função main: orquestra input -> processamento -> output
 # -------------------------
 
+def _run_once(action):
+    """
+    Uma chamada completa (stdin -> ação -> stdout), com as fases cronometradas.
+    Retorna o PhaseTimer da execução.
+    """
+    with _timing() as timer:
+        # Lê todo o stdin (pode vir via pipe do PHP)
+        raw = sys.stdin.read()
+        _lap("leitura_stdin")
+
+        # Faz parse robusto do JSON de entrada
+        payload = _safe_load_json(raw)
+        _lap("parse")
+
+        # Chama a ação correta
+        out = run_action(action, payload)
+        if _wants_timings(payload) and isinstance(out, dict):
+            out["_timings"] = timer.to_dict()  # fases até aqui (a serialização vem depois)
+
+        # Serializa saída JSON mantendo caracteres unicode (ensure_ascii=False)
+        data = json.dumps(out, ensure_ascii=False)
+        _lap("serializacao")
+        encoded = data.encode('utf-8')
+        _lap("codificacao")
+
+        try:
+            # Escreve bytes no buffer stdout para garantir codificação UTF-8
+            sys.stdout.buffer.write(encoded)
+        except Exception:
+            # Se não for possível (cenários raros), escreve via stdout normal (fallback)
+            sys.stdout.write(data)
+
+        # Garante que todo o buffer seja descarregado imediatamente
+        sys.stdout.flush()
+        _lap("escrita")
+    return timer
+
+def _run_profiled(action, top=25, out_path=None):
+    """Executa _run_once sob cProfile + tracemalloc e escreve as estatísticas no stderr."""
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    tracemalloc.start()
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        timer = _run_once(action)
+    finally:
+        prof.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    err = sys.stderr
+    print("\n=== cProfile (tempo acumulado) ===", file=err)
+    pstats.Stats(prof, stream=err).strip_dirs().sort_stats("cumulative").print_stats(top)
+    print(f"=== tracemalloc: atual {current / 1024:.1f} KiB, pico {peak / 1024:.1f} KiB ===", file=err)
+    for stat in snapshot.statistics("lineno")[:10]:
+        print(f"  {stat}", file=err)
+    if out_path:
+        prof.dump_stats(out_path)
+        print(f"perfil salvo em {out_path} (abrir com pstats/snakeviz)", file=err)
+    err.flush()
+    return timer
+
 def main():
     """
     Ponto de entrada do script.
     - Determina ação a partir do primeiro argumento da linha de comando:
        * generate_report (default)
        * generate_lessons
-    - Lê todo stdin, efetua parse robusto (_safe_load_json) e chama a função adequada.
+       * serve (sobe o servidor persistente; ver _serve_main)
+       * batch (vários relatórios em um processo pool; ver _batch_main)
+    - Lê todo stdin, efetua parse robusto (_safe_load_json) e chama a função adequada
+      (ver _run_once; --timings e --profile instrumentam a execução).
     - Escreve o JSON de saída para stdout em UTF-8 (usa sys.stdout.buffer quando disponível)
       para evitar problemas com encodings no Windows/PHP.
     """
     # Ação desejada (padrão: generate_report)
     action = sys.argv[1].lower() if len(sys.argv) >= 2 else "generate_report"
 
-    # Lê todo o stdin (pode vir via pipe do PHP)
-    raw = sys.stdin.read()
+    if action == "serve":
+        _serve_main(sys.argv[2:])
+        return
+    if action == "batch":
+        _batch_main(sys.argv[2:])
+        return
 
-    # Faz parse robusto do JSON de entrada
-    payload = _safe_load_json(raw)
+    parser = argparse.ArgumentParser(prog=f"report_generator.py {action}")
+    parser.add_argument("--timings", action="store_true",
+                        help="escreve as fases (ms) em JSON no stderr (ou REPORT_TIMINGS=1)")
+    parser.add_argument("--profile", action="store_true",
+                        help="cProfile + tracemalloc desta execução no stderr")
+    parser.add_argument("--profile-out", default=None, help="salva o perfil cProfile neste arquivo")
+    parser.add_argument("--profile-top", type=int, default=25, help="funções listadas no perfil")
+    opts = parser.parse_args(sys.argv[2:])
 
-    # Chama a ação correta
-    if action == "generate_lessons":
-        out = generate_lessons(payload)
+    if opts.profile or opts.profile_out:
+        timer = _run_profiled(action, opts.profile_top, opts.profile_out)
     else:
-        out = generate_report(payload)
-
-    # Serializa saída JSON mantendo caracteres unicode (ensure_ascii=False)
-    data = json.dumps(out, ensure_ascii=False)
-
-    try:
-        # Escreve bytes no buffer stdout para garantir codificação UTF-8
-        sys.stdout.buffer.write(data.encode('utf-8'))
-    except Exception:
-        # Se não for possível (cenários raros), escreve via stdout normal (fallback)
-        sys.stdout.write(data)
+        timer = _run_once(action)
 
-    # Garante que todo o buffer seja descarregado imediatamente
-    sys.stdout.flush()
+    if opts.timings or os.environ.get("REPORT_TIMINGS") not in (None, "", "0"):
+        print(json.dumps({"evento": "report_timings", "acao": action, **timer.to_dict()},
+                         ensure_ascii=False), file=sys.stderr, flush=True)
 
 # -------------------------
 # Execução direta